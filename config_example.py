@@ -18,7 +18,9 @@ toc_xml_suffix = 'xml'
 toc_txt_suffix = 'txt'
 
 # api
+# one KER endpoint, or a list of KER replicas the requests are balanced across
 kerator_api = 'http://kerator_api.domain.com'
+# kerator_api = ['http://ker1.domain.com/?', 'http://ker2.domain.com/?']
 aleph_api = 'http://aleph_server.domain.com/X'
 
 # ALEPH
@@ -33,9 +35,27 @@ tocs_field_number = '505'
 tocs_indicators = '0 '
 tocs_subfield = 'a'
 tocs_separator = '--'
+# update lines equal to the current fields of the record are left out, documents without changes get no update
+# file; the record of a document resolved by the offline ISBN index is fetched from the X-server by its sysno
+aleph_skip_unchanged = True
 
 kerator_params = ['?langparam', '?thresholdparam', '?max-wordsparam']
 
+# keywords
+# KER is asked once for a superset of keywords (low threshold, many words); all of them are stored with their
+# scores in the document directory and the keywords are selected locally, so changing a profile needs no KER calls
+ker_request_threshold = 0.05
+ker_request_max_words = 100
+ker_scores_file = '.ker_scores.json'
+# label of the KER model (e.g. its version); scores stored for another model are not used, so documents reprocessed
+# after a model change are sent to KER again
+ker_model = None
+# minimal score and maximum number of keywords of each profile
+keyword_profiles = {'default': {'threshold': 0.2, 'max_words': 15}}
+keyword_profile = 'default'
+# (regular expression, profile) pairs; the first one matching the document directory name selects its profile
+keyword_profile_rules = []
+
 # curl
 # curl request 'template'
 curl_request = 'curl --form'
@@ -43,6 +63,137 @@ curl_request = 'curl --form'
 # states
 finished_state = '.ker_done'
 error_state = '.ker_error'
+failure_state = '.ker_failure'
+# prefix of the intermediate results (sysno, normalized TOC, ALTO text) cached in the document directory
+ker_cache_prefix = '.ker_cache_'
 
 # log location
-log_directory = '/var/log/kerator/'
\ No newline at end of file
+log_directory = '/var/log/kerator/'
+
+# scheduler
+# formats of the DATE part of the document directory name (DONE_DATE_ISBN)
+dir_date_formats = ['%Y%m%d', '%Y-%m-%d', '%Y%m%d%H%M%S']
+# priority = age * days since scan + pages * TOC pages + retries * failed attempts
+scheduler_weights = {'age': 1.0, 'pages': -0.1, 'retries': -2.0}
+scheduler_cost_file = '/var/lib/kerator/scheduler_costs.json'
+# estimated seconds per cost unit (document + each TOC page) before any document was measured
+scheduler_default_unit_seconds = 10.0
+scheduler_smoothing = 0.2
+# seconds kept free before the deadline (e.g. for uploading the update files)
+scheduler_reserve_seconds = 300
+
+# pipeline
+# maximum number of documents waiting in front of each pipeline stage
+pipeline_queue_size = 8
+# number of worker threads of each pipeline stage; each gather worker runs the Aleph lookup, KER extraction
+# and TOC normalization of its document concurrently
+pipeline_workers = {'dedupe': 1, 'gather': 2, 'write': 1}
+# engine of 'run' and 'process': 'threads' (the pipeline above) or 'asyncio' for large backlogs, where the network
+# calls are coroutines (needs aiohttp and asyncssh)
+pipeline_engine = 'threads'
+# asyncio engine: maximum number of documents, X-server calls, KER calls and SFTP uploads in flight, and threads
+# running the local work of the stages
+aio_limits = {'documents': 1000, 'aleph': 200, 'ker': 100, 'upload': 16, 'threads': 8}
+# duplicate TOC pages: a page with the same text as an earlier page, or with estimated similarity of word
+# shingles (MinHash) of at least dedupe_threshold, is left out
+dedupe_pages = True
+dedupe_threshold = 0.7
+dedupe_shingle_size = 2
+dedupe_permutations = 64
+
+# CPU-bound work (TOC normalization, parsing of large Aleph responses, zipping of TOC files) runs in a pool
+# of processes; None starts one process per CPU, 0 runs the work in the calling thread
+cpu_workers = None
+# number of TOC pages passed to a worker process in one batch
+cpu_chunk_size = 4
+# Aleph responses smaller than this are parsed in the calling thread, passing them to a process costs more
+cpu_min_response_bytes = 65536
+# start method of the worker processes; forkserver doesn't fork the multi-threaded pipeline
+cpu_start_method = 'forkserver'
+# KER payload budget: documents with more XML TOC pages, or a bigger payload, are sent by ker_budget_strategy;
+# the bytes are measured on the payload sent, the text of the pages with ker_send_plain_text, the XML pages
+# otherwise; None disables the limit
+ker_budget_pages = 12
+ker_budget_bytes = 4 * 1024 * 1024
+# 'subset' sends pages spread evenly over the TOC within the budget, 'split' sends all pages in chunks within
+# the budget in parallel requests and merges their keywords
+ker_budget_strategy = 'split'
+# maximum number of parallel chunk requests of one document
+ker_split_workers = 4
+# size of the chunks of TOC files streamed to KER, in bytes
+ker_upload_chunk_size = 65536
+
+# offline ISBN -> sysno index (kerator.py import-isbn-index EXPORT_FILE)
+isbn_index_file = '/var/lib/kerator/isbn_index.bin'
+
+# subject authority vocabulary index (kerator.py import-authority EXPORT_FILE); keywords are written as free text
+# when the index doesn't exist
+authority_index_file = '/var/lib/kerator/authority_index.bin'
+# keywords without a match in the authority vocabulary are kept as free text (True) or dropped (False)
+authority_keep_unmatched = True
+
+# tracing
+# spans of each document (pipeline stages, Aleph and KER calls, TOC file reads, SFTP uploads) are appended to this
+# file as OTLP JSON lines; None disables tracing
+trace_file = None
+# trace_file = '/var/log/kerator/traces.jsonl'
+
+# run history
+history_file = '/var/lib/kerator/history.jsonl'
+# number of previous runs the latest run is compared with
+history_baseline_runs = 7
+# relative slowdown reported as a regression
+history_tolerance = 0.25
+# throughput of runs with fewer documents is not compared
+history_min_documents = 20
+
+# ALTO
+# send plain text of the ALTO XML TOC pages to KER instead of the XML files (or their ZIP archive)
+ker_send_plain_text = True
+ker_text_prefix = 'ker_text_'
+# when a document has no TXT TOC pages, TOC lines are made from the text of ALTO XML TOC pages
+alto_synthesize_toc = True
+
+# timeouts
+# (connect, read) timeouts of the X-server and KER requests, in seconds
+aleph_timeout = (5, 30)
+kerator_timeout = (5, 120)
+# timeout of the SSH connection and SFTP operations, in seconds
+ssh_timeout = 30
+# maximum time of processing one document, in seconds; calls are shortened so they don't outlive it (the threaded
+# pipeline limits each read of a response, one trickling in can run past the deadline; the asyncio engine limits the
+# whole call)
+document_deadline = 600
+
+# hedged KER requests
+# when a KER call is slower than ker_hedge_percentile of the last ker_hedge_window calls, a duplicate is sent
+ker_hedging = False
+ker_hedge_percentile = 95
+ker_hedge_window = 200
+# hedging starts after this number of observed calls
+ker_hedge_min_samples = 20
+# at most this fraction of calls is hedged
+ker_hedge_max_ratio = 0.1
+
+# KER load balancing
+# a replica is ejected after this number of consecutive failures
+ker_eject_failures = 3
+# ejection time in seconds, doubled with each repeated ejection up to ker_eject_max_seconds
+ker_eject_seconds = 30
+ker_eject_max_seconds = 600
+
+# reprocessing of finished documents (kerator.py reprocess)
+# collections of documents: name -> regular expression matching their directory names
+collections = {}
+# collections = {'proceedings': r'^DONE_[0-9]+_978-?80-?7080'}
+# engine of 'reprocess', which runs many documents with mostly cached stages
+reprocess_engine = 'asyncio'
+# update batches of reprocessed documents; uploaded batches are kept with the finished state suffix
+reprocess_dir = '/var/lib/kerator/reprocess'
+
+# failure quarantine
+# backoff of each failure class in seconds, doubled with each further failed attempt; None quarantines
+# the document until it is released by 'kerator.py quarantine --release'
+quarantine_backoff = {'invalid': None, 'no_toc': None, 'not_found': 7 * 86400, 'ker_parse': 86400,
+                      'timeout': 3600, 'network': 3600, 'other': 86400}
+quarantine_max_backoff = 30 * 86400
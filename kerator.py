@@ -3,90 +3,290 @@
 
 # sends the OCR output of each processed TOC page to KER processing using it's API.
 # Collects the results and saves them to the location defined in configuration file.
+#
+# usage: kerator.py [run|scan|process|upload|reprocess|status|report|quarantine|keywords|import-isbn-index|
+#                    import-authority]
+#
+# Heavy dependencies (paramiko, requests, xmltodict) are imported only by the commands which need them,
+# so 'status', 'scan' and runs with nothing to do return immediately.
 
+import argparse
 import os
+import sys
+
 import config
 from modules import workflow
-from modules import ssh
+from modules import pipeline
+from modules import quarantine
+from modules import reprocess
+from modules import scheduler
+from modules.job import DocumentJob
 
-import paramiko
 
-# go through the OBSAHATOR's directory and get the documents processed by OBSAHATOR but not by KERATOR
-done_dirs = workflow.get_dirs(path=config.obsahator_dir)
+def upload_update_files(update_files):
+    """
+    Sends Aleph update files to the Aleph server and marks their documents as finished.
+    :param update_files: iterable of Aleph update files
+    :return: counters: dictionary with number of uploaded and failed update files
+    """
+    upload_doc, close = pipeline.make_upload_stage()
+    counters = {'uploaded': 0, 'failed': 0}
 
-# in each process directory folder, get documents TOC pages in ALTO XML format
-# and process them
+    try:
+        for uf in update_files:     # uf = update file
+            try:
+                job = DocumentJob(os.path.dirname(uf))
+                job.update_file = uf
+                upload_doc(job)
+                counters['uploaded'] += 1
+            except RuntimeError as e:
+                print("Error:", os.path.basename(uf), e)
+                counters['failed'] += 1
+    finally:
+        close()
 
-responses = {}
-raw_tocs = {}
-doc_errors = {}
-aleph_errors = {}
-update_file_loc_list = []
+    return counters
 
-for path in done_dirs:
-    errors = []
-    toc_keywords_list = []
-    toc_contents_list = []
-    aleph_update_strings = []
 
-    print("Started processing document {}...".format(os.path.basename(path)))
-    print('-'*10)
+def cmd_scan(args):
+    count = 0
+    quarantined = 0
+    for path in workflow.iter_dirs(path=config.obsahator_dir):
+        if quarantine.is_quarantined(path):
+            quarantined += 1
+            continue
+        print(path)
+        count += 1
+    print("{} document(s) waiting for processing, {} in quarantine.".format(count, quarantined))
+    return 0
 
-    try:
-        update_file_loc = workflow.process_doc(path)
-        if update_file_loc is not None:
-            update_file_loc_list.append(update_file_loc)
-    
-    except RuntimeError as e:
-        print("Error:", e)
-        errors.append(e)
 
-    finally:
-        if len(errors) > 0:
-            doc_errors[path] = errors
-            print(os.path.basename(path), ": processing finished with errors")
-            print(doc_errors)
-            print('-'*10)
-            print('\n')
-            print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
- 
+def cmd_status(args):
+    status = workflow.get_status(path=config.obsahator_dir)
+    for state in ('pending', 'to_upload', 'finished', 'error', 'quarantined'):
+        print("{:<12} {}".format(state, status[state]))
+    return 0
+
+
+def cmd_process(args):
+    return process(args, upload=False)
+
+
+def cmd_upload(args):
+    counters = upload_update_files(workflow.iter_update_files(workflow.iter_dirs(path=config.obsahator_dir)))
+    if counters['uploaded'] + counters['failed'] == 0:
+        print("There are no Aleph update files to process.")
+        return 0
+    print("Uploaded {} Aleph update file(s), {} failed.".format(counters['uploaded'], counters['failed']))
+    return 1 if counters['failed'] > 0 else 0
+
+
+def cmd_run(args):
+    return process(args, upload=True)
+
+
+def process(args, upload):
+    done_dirs = workflow.get_dirs(path=config.obsahator_dir)
+    if len(done_dirs) == 0:
+        print("There are no documents to process.")
+        return 0
+
+    if args.engine == 'asyncio':
+        # aiohttp and asyncssh are imported only by the asyncio engine
+        from modules import aio_pipeline
+        engine = aio_pipeline
+    else:
+        engine = pipeline
+    counters = engine.run(done_dirs, deadline=scheduler.parse_deadline(args.deadline, args.budget),
+                          upload=upload)
+    print("Processed {} document(s), {} failed, {} uploaded, {} unchanged.".format(
+        counters['processed'], counters['failed'], counters['uploaded'], counters['unchanged']))
+    if counters['failed'] > 0:
+        print("Finished processing with errors.")
+        return 1
+    return 0
+
+
+def cmd_reprocess(args):
+    isbns = list(args.isbn)
+    if args.isbn_file is not None:
+        isbns.extend(reprocess.read_isbn_list(args.isbn_file))
+    if not (args.all or args.since or args.until or isbns or args.collection):
+        print("Select the documents to reprocess by --since, --until, --isbn, --isbn-file, --collection or --all.")
+        return 2
+
+    dirs = list(reprocess.select_dirs(config.obsahator_dir, since=args.since, until=args.until,
+                                      isbns=isbns or None, collection=args.collection))
+    if len(dirs) == 0:
+        print("There are no finished documents to reprocess.")
+        return 0
+
+    counters, batch_file = reprocess.run(dirs, deadline=scheduler.parse_deadline(args.deadline, args.budget),
+                                         upload=not args.no_upload, redo=args.redo, engine=args.engine)
+    print("Reprocessed {} document(s), {} failed, {} changed, {} unchanged.".format(
+        counters['processed'], counters['failed'], counters['uploaded'], counters['unchanged']))
+    if batch_file is not None:
+        print("Update batch:", batch_file)
+    if counters['failed'] > 0:
+        print("Finished reprocessing with errors.")
+        return 1
+    return 0
+
+
+def cmd_import_isbn_index(args):
+    from modules import isbn_index
+    count = isbn_index.import_export(args.export_file, config.isbn_index_file, export_format=args.format)
+    print("Imported {} ISBN(s) to {}.".format(count, config.isbn_index_file))
+    return 0
+
+
+def cmd_quarantine(args):
+    for name in args.release:
+        if quarantine.clear_failure(os.path.join(config.obsahator_dir, name)):
+            print("Released {} from quarantine.".format(name))
         else:
-            print(os.path.basename(path), ": processing finished successfully")
-            print('-'*10)
-            print('\n')
-            print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
+            print("Document {} is not in quarantine.".format(name))
+    if len(args.release) == 0:
+        quarantine.report(config.obsahator_dir)
+    return 0
 
 
-# send created update files
-if len(update_file_loc_list) == 0:
-    exit("There are no Aleph update files to process.")
+def cmd_keywords(args):
+    from modules import keywords
+    names = args.documents or sorted(os.listdir(config.obsahator_dir))
+    count = 0
+    for name in names:
+        path = os.path.join(config.obsahator_dir, name)
+        mapped_keywords = keywords.load_scored_keywords(path)
+        if mapped_keywords is None:
+            if len(args.documents) > 0:
+                print("Document {} has no stored keyword scores.".format(name))
+            continue
+        selection = dict(keywords.get_profile(path, name=args.profile))
+        if args.threshold is not None:
+            selection['threshold'] = args.threshold
+        if args.max_words is not None:
+            selection['max_words'] = args.max_words
+        selected = keywords.select_best_keywords(
+            keywords.select_keywords(mapped_keywords, selection['threshold'], selection['max_words']), path)
+        print("{}\t{}".format(name, '; '.join(selected)))
+        count += 1
+    print("Selected keywords of {} document(s) without calling KER.".format(count))
+    return 0
 
-try:
-    print("Opening connection to remote host", config.aleph_server)
-    client = ssh.create_ssh_client(server=config.aleph_server, user=config.aleph_user)
-    sftp = client.open_sftp()
-    # changes directory
-    sftp.chdir(config.update_dir_location)
-except ConnectionError as e:
-    raise ConnectionError("Failed to connect to the Aleph server")
 
-for uf in update_file_loc_list:     # uf = update file
+def cmd_import_authority(args):
+    from modules import authority
+    count = authority.import_export(args.export_file, config.authority_index_file, export_format=args.format)
+    print("Imported {} authority term(s) to {}.".format(count, config.authority_index_file))
+    return 0
 
-    try:
-        filename = os.path.basename(uf)
-        print("Copying file {} to remote directory {}".format(uf, os.path.join(config.update_dir_location, filename)))
-        sftp.put(uf, os.path.join(config.update_dir_location, filename))
-        workflow.write_status_file(config.finished_state, os.path.dirname(uf))
-    except RuntimeError as e:
-        aleph_errors[os.path.basename(uf)] = e
-        # raise ConnectionError("Failed to put the file into remote directory")
-
-try:
-    print("Closing connection to remote host", config.aleph_server)
-    sftp.close()
-    print("Connection closed.")
-except ConnectionError as e:
-    raise ConnectionError("Failed to close the connection to", config.aleph_server)
-
-if len(list(aleph_errors.keys())) > 0:
-    print("Finished processing with errors.")
+
+def cmd_report(args):
+    from modules import history
+    regressions = history.report()
+    return 1 if len(regressions) > 0 else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='kerator',
+                                     description="Extracts keywords and TOC contents of documents processed by "
+                                                 "OBSAHATOR and sends them to Aleph.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help="process waiting documents and upload the update files "
+                                                   "(default)")
+    subparsers.add_parser('scan', help="list documents waiting for processing")
+    process_parser = subparsers.add_parser('process', help="create Aleph update files for waiting documents")
+    subparsers.add_parser('upload', help="upload created Aleph update files to the Aleph server")
+    reprocess_parser = subparsers.add_parser('reprocess', help="process finished documents again (e.g. for a new KER "
+                                                               "model) and upload the changed records in one "
+                                                               "update batch")
+    reprocess_parser.add_argument('--since', metavar='YYYY-MM-DD', type=reprocess.parse_date, default=None,
+                                  help="documents scanned on this date or later")
+    reprocess_parser.add_argument('--until', metavar='YYYY-MM-DD', type=reprocess.parse_date, default=None,
+                                  help="documents scanned on this date or earlier")
+    reprocess_parser.add_argument('--isbn', metavar='ISBN', nargs='+', default=[],
+                                  help="documents with given ISBNs")
+    reprocess_parser.add_argument('--isbn-file', metavar='FILE', default=None,
+                                  help="documents with ISBNs listed in the file, one per line")
+    reprocess_parser.add_argument('--collection', metavar='NAME', choices=sorted(config.collections), default=None,
+                                  help="documents of a collection from the configuration")
+    reprocess_parser.add_argument('--all', action='store_true',
+                                  help="all finished documents")
+    reprocess_parser.add_argument('--redo', metavar='STAGE', nargs='+', choices=reprocess.REDO_STAGES, default=[],
+                                  help="stages which don't use the results cached by earlier runs: "
+                                       "{}".format(', '.join(reprocess.REDO_STAGES)))
+    reprocess_parser.add_argument('--no-upload', action='store_true',
+                                  help="only write the update batch, it's uploaded by the next reprocess")
+    subparsers.add_parser('status', help="show number of documents in each processing state")
+    subparsers.add_parser('report', help="compare the latest run with previous runs and show regressions")
+    quarantine_parser = subparsers.add_parser('quarantine', help="list failed documents and their next retry")
+    quarantine_parser.add_argument('--release', metavar='DOCUMENT', nargs='+', default=[],
+                                   help="remove the failure record of given document directories, so they are "
+                                        "processed by the next run")
+    keywords_parser = subparsers.add_parser('keywords', help="select keywords from the keyword scores stored by "
+                                                             "earlier runs, without calling KER")
+    keywords_parser.add_argument('documents', metavar='DOCUMENT', nargs='*',
+                                 help="document directories, all documents with stored scores by default")
+    keywords_parser.add_argument('--profile', default=None,
+                                 help="keyword profile from the configuration, by default the profile of each "
+                                      "document")
+    keywords_parser.add_argument('--threshold', type=float, default=None,
+                                 help="minimal keyword score, overrides the profile")
+    keywords_parser.add_argument('--max-words', type=int, default=None,
+                                 help="maximum number of keywords, overrides the profile")
+    import_parser = subparsers.add_parser('import-isbn-index',
+                                          help="build the offline ISBN -> sysno index from a bulk Aleph export")
+    import_parser.add_argument('export_file', help="export with field 020 and sysnos of the catalogue records")
+    import_parser.add_argument('--format', choices=['aleph', 'marc'], default='aleph',
+                               help="Aleph sequential (default) or ISO 2709 MARC export")
+
+    authority_parser = subparsers.add_parser('import-authority',
+                                             help="build the authority vocabulary index from the subject authority "
+                                                  "file")
+    authority_parser.add_argument('export_file', help="export with preferred terms (150) and variants (450)")
+    authority_parser.add_argument('--format', choices=['aleph', 'tsv'], default='aleph',
+                                  help="Aleph sequential (default) or tab separated terms and variants")
+
+    for batch_parser in (parser, run_parser, process_parser, reprocess_parser):
+        window = batch_parser.add_mutually_exclusive_group()
+        window.add_argument('--deadline', metavar='HH:MM', default=argparse.SUPPRESS,
+                            help="stop processing before documents which would not finish by this time")
+        window.add_argument('--budget', metavar='MINUTES', type=float, default=argparse.SUPPRESS,
+                            help="stop processing before documents which would not finish in given minutes")
+        default_engine = 'reprocess_engine' if batch_parser is reprocess_parser else 'pipeline_engine'
+        batch_parser.add_argument('--engine', choices=['threads', 'asyncio'], default=argparse.SUPPRESS,
+                                  help="threaded pipeline or asyncio engine for large backlogs "
+                                       "(config.{} by default)".format(default_engine))
+
+    return parser
+
+
+COMMANDS = {
+    'run': cmd_run,
+    'scan': cmd_scan,
+    'process': cmd_process,
+    'upload': cmd_upload,
+    'reprocess': cmd_reprocess,
+    'status': cmd_status,
+    'report': cmd_report,
+    'quarantine': cmd_quarantine,
+    'keywords': cmd_keywords,
+    'import-isbn-index': cmd_import_isbn_index,
+    'import-authority': cmd_import_authority,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.deadline = getattr(args, 'deadline', None)
+    args.budget = getattr(args, 'budget', None)
+    command = args.command or 'run'
+    args.engine = getattr(args, 'engine', None) or \
+        (config.reprocess_engine if command == 'reprocess' else config.pipeline_engine)
+    return COMMANDS[command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
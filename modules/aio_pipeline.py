@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# asyncio engine for draining large backlogs: the network calls (X-server, KER, SFTP) are coroutines on one event
+# loop, so thousands of them can be in flight without a thread each. The number of documents and calls in flight
+# is limited by a semaphore per service (config.aio_limits). Local work of the stages (validation, dedupe, TOC
+# normalization, writing) runs in threads via asyncio.to_thread, its CPU-bound parts in the process pool as before.
+#
+# aiohttp and asyncssh are imported only when the engine runs. The threaded pipeline (pipeline.run) and the
+# synchronous functions stay the default for the cron runs.
+
+import asyncio
+import config
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from modules import balancer
+from modules import keywords
+from modules import history
+from modules import pipeline
+from modules import scheduler
+from modules import tracing
+from modules import utility
+from modules import workflow
+from modules.errors import DocumentTimeout
+from modules.errors import KerUnavailable
+
+# asyncio.to_thread is new in Python 3.9, the minimum version in requirements.txt
+if sys.version_info < (3, 9):
+    raise ImportError("The asyncio engine needs Python 3.9 or newer")
+
+
+class KerResponse(object):
+    """
+    KER response read by the engine, with the attributes of requests.Response used by workflow.read_keywords.
+    """
+    __slots__ = ('status_code', 'text')
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+def get_client_timeout(timeout, deadline=None):
+    """
+    Gets the aiohttp timeout of a network call, shortened so the call can't outlive the deadline of the document.
+    Unlike the read timeout of requests, the total timeout of aiohttp limits the whole call, including a response
+    trickling in.
+    :param timeout: configured (connect, read) timeout in seconds
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+    :return: aiohttp.ClientTimeout
+    """
+    import aiohttp
+    connect, read = utility.get_call_timeout(timeout, deadline)
+    total = deadline - time.time() if deadline is not None else None
+
+    return aiohttp.ClientTimeout(total=total, sock_connect=connect, sock_read=read)
+
+
+async def iter_body(chunks):
+    # aiohttp streams an async iterable request body with chunked transfer encoding
+    for chunk in chunks:
+        yield chunk
+
+
+class AsyncEngine(object):
+    """
+    Processes documents as coroutines. Holds the HTTP session and the SFTP session shared by all documents, and
+    the semaphores limiting the calls in flight.
+    """
+
+    def __init__(self, upload=True, limits=None, upload_stage=None):
+        limits = limits or config.aio_limits
+        self.upload = upload
+        # function replacing the SFTP upload of each update file, it runs in a thread
+        self.upload_stage = upload_stage
+        self.documents = asyncio.Semaphore(limits['documents'])
+        self.aleph = asyncio.Semaphore(limits['aleph'])
+        self.ker = asyncio.Semaphore(limits['ker'])
+        self.sftp_puts = asyncio.Semaphore(limits['upload'])
+        self.threads = limits['threads']
+        self.session = None
+        self.ssh = None
+        self.sftp = None
+        self.ssh_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        import aiohttp
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=self.threads))
+        # the semaphores limit the connections, the connector doesn't
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        if self.ssh is not None:
+            print("Closing connection to remote host", config.aleph_server)
+            self.sftp.exit()
+            self.ssh.close()
+            await self.ssh.wait_closed()
+            print("Connection closed.")
+
+    async def fetch_aleph(self, name, url, deadline=None):
+        """
+        Sends an X-server query.
+        :param name: name of the span of the call
+        :param url: URL of the query
+        :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+        :return: tuple (HTTP status code, text of the response)
+        """
+        async with self.aleph:
+            with tracing.span(name, kind=tracing.KIND_CLIENT,
+                              **{'http.request.method': 'GET', 'url.full': url}) as span:
+                try:
+                    async with self.session.get(url, timeout=get_client_timeout(config.aleph_timeout,
+                                                                                 deadline)) as response:
+                        body = await response.read()
+                        text = await response.text(errors='replace')
+                except asyncio.TimeoutError as e:
+                    raise DocumentTimeout("ERROR (CATALOGUE): Aleph server did not respond in time: {}".format(e))
+                span.set_attribute('http.response.status_code', response.status)
+                span.set_attribute('http.response.body.size', len(body))
+
+        return response.status, text
+
+    async def get_document_record(self, doc_path, deadline=None):
+        """
+        Async version of workflow.get_document_record: the X-server queries of workflow.iter_record_queries are
+        sent by the session, the index lookup and the parsing of the responses run in a thread.
+        :param doc_path: path to a document directory
+        :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+        :return: tuple (sysno, fields of the record or None), see workflow.get_document_record
+        """
+        queries = workflow.iter_record_queries(doc_path)
+        query, record = await asyncio.to_thread(workflow.next_record_query, queries)
+        while query is not None:
+            name, aleph_url = query
+            response = await self.fetch_aleph(name, aleph_url, deadline=deadline)
+            query, record = await asyncio.to_thread(workflow.next_record_query, queries, response)
+
+        return record
+
+    async def send_ker_request(self, languages, file, threshold=0.2, max_words=15, deadline=None):
+        """
+        Async version of utility.send_ker_request. The requests for all languages are sent concurrently, each
+        to the KER replica picked by the load balancer; a replica refusing connections or answering with a server
+        error is skipped until all replicas were tried. Requests are not hedged.
+        :param languages: list of languages that will be used for keyword extraction
+        :param file: file on which the keyword extraction will be done
+        :param threshold: decimal indicating minimal score the keyword can have to be selected as a keyword
+        :param max_words: number indicating maximum number of keywords extracted from the file
+        :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+        :return: dictionary of KerResponse for each language
+        """
+        import aiohttp
+
+        ker_balancer = balancer.get_ker_balancer()
+        payload = utility.map_payload(file)
+
+        async def request(lang):
+            param_string = '&'.join(utility.get_ker_params(lang, threshold, max_words))
+            failed_endpoints = []
+            while True:
+                api_url = ker_balancer.acquire(exclude=failed_endpoints)
+                request_url = api_url + param_string
+                boundary = uuid.uuid4().hex
+                headers = {'Content-Type': 'multipart/form-data; boundary=' + boundary}
+                body = utility.iter_multipart_body(payload, boundary=boundary, filename=os.path.basename(file),
+                                                   chunk_size=config.ker_upload_chunk_size)
+                with tracing.span('ker.request', kind=tracing.KIND_CLIENT,
+                                  **{'http.request.method': 'POST', 'url.full': request_url,
+                                     'http.request.body.size': len(payload), 'ker.language': lang}) as span:
+                    try:
+                        async with self.ker:
+                            async with self.session.post(request_url, data=iter_body(body), headers=headers,
+                                                         timeout=get_client_timeout(config.kerator_timeout,
+                                                                                    deadline)) as response:
+                                text = await response.text(errors='replace')
+                    except asyncio.TimeoutError as e:
+                        ker_balancer.release(api_url, ok=False)
+                        raise DocumentTimeout("KER did not respond in time: {}".format(e))
+                    except aiohttp.ClientConnectionError as e:
+                        ker_balancer.release(api_url, ok=False)
+                        failed_endpoints.append(api_url)
+                        if len(failed_endpoints) < len(ker_balancer.endpoints):
+                            span.set_error(e)
+                            continue
+                        raise
+                    except Exception:
+                        ker_balancer.release(api_url, ok=False)
+                        raise
+                    finally:
+                        body.close()
+                    ker_balancer.release(api_url, ok=response.status < 500)
+                    span.set_attribute('http.response.status_code', response.status)
+                    span.set_attribute('http.response.body.size', len(text.encode('utf-8')))
+                    if response.status >= 500:
+                        failed_endpoints.append(api_url)
+                        error = KerUnavailable("KER {} responded with HTTP {}".format(api_url, response.status))
+                        if len(failed_endpoints) < len(ker_balancer.endpoints):
+                            span.set_error(error)
+                            continue
+                        raise error
+                    return lang, KerResponse(response.status, text)
+
+        try:
+            responses = await asyncio.gather(*[request(lang) for lang in languages])
+        finally:
+            utility.close_payload(payload)
+
+        return dict(responses)
+
+    async def get_sftp(self):
+        """
+        Gets the SFTP session to the Aleph server, it's opened with the first update file.
+        :return: asyncssh.SFTPClient
+        """
+        async with self.ssh_lock:
+            if self.sftp is None:
+                import asyncssh
+                print("Opening connection to remote host", config.aleph_server)
+                # the host key is checked against ~/.ssh/known_hosts, the system host keys of the paramiko client
+                self.ssh = await asyncssh.connect(config.aleph_server, username=config.aleph_user,
+                                                  connect_timeout=config.ssh_timeout)
+                self.sftp = await self.ssh.start_sftp_client()
+            return self.sftp
+
+    async def upload_update_file(self, update_file):
+        """
+        Async version of workflow.upload_update_file. One SFTP session serves all concurrent uploads.
+        :param update_file: path to an Aleph update file
+        :return: None
+        """
+        sftp = await self.get_sftp()
+        remote_path = os.path.join(config.update_dir_location, os.path.basename(update_file))
+        print("Copying file {} to remote directory {}".format(update_file, remote_path))
+        async with self.sftp_puts:
+            with tracing.span('sftp.put', kind=tracing.KIND_CLIENT, **{'file.path': update_file,
+                                                                        'sftp.remote_path': remote_path}) as span:
+                span.set_attribute('sftp.bytes', os.path.getsize(update_file))
+                await asyncio.wait_for(sftp.put(update_file, remote_path), timeout=config.ssh_timeout)
+        await asyncio.to_thread(workflow.write_status_file, config.finished_state, os.path.dirname(update_file))
+
+    async def resolve_doc(self, job):
+        """
+        RESOLVE stage, see workflow.resolve_doc.
+        """
+        utility.check_deadline(job.deadline, 'resolve')
+        if await asyncio.to_thread(workflow.load_cached_sysno, job):
+            return
+
+        job.sysno, job.record_fields = await self.get_document_record(job.path, deadline=job.deadline)
+        await asyncio.to_thread(workflow.cache_sysno, job)
+
+    async def extract_doc(self, job):
+        """
+        EXTRACT stage, see workflow.extract_doc. The payloads of a split document are sent concurrently.
+        """
+        locations = await asyncio.to_thread(workflow.plan_extract, job)
+        if len(locations) == 0:
+            return
+
+        async def extract(number, location):
+            with tracing.span('ker.chunk', **{'ker.chunk': number}):
+                responses = await self.send_ker_request(keywords.KER_LANGUAGES, location,
+                                                        threshold=config.ker_request_threshold,
+                                                        max_words=config.ker_request_max_words,
+                                                        deadline=job.deadline)
+            return workflow.read_keywords(responses)
+
+        chunk_keywords = await asyncio.gather(*[extract(number, location)
+                                                for number, location in enumerate(locations, start=1)])
+        await asyncio.to_thread(workflow.finish_extract, job, chunk_keywords)
+
+    async def normalize_doc(self, job):
+        """
+        NORMALIZE stage, see workflow.normalize_doc.
+        """
+        await asyncio.to_thread(workflow.normalize_doc, job)
+
+    async def gather_doc(self, job):
+        """
+        GATHER stage, see workflow.gather_doc: the Aleph lookup, KER extraction and TOC normalization of the
+        document run concurrently.
+        """
+        stages = [('resolve', self.resolve_doc), ('extract', self.extract_doc), ('normalize', self.normalize_doc)]
+
+        async def run_timed(name, stage):
+            started = time.time()
+            try:
+                with tracing.span(name):
+                    await stage(job)
+            finally:
+                job.timings[name] = time.time() - started
+
+        results = await asyncio.gather(*[run_timed(name, stage) for name, stage in stages], return_exceptions=True)
+        for (name, stage), result in zip(stages, results):
+            if isinstance(result, Exception):
+                job.failed_stage = name
+                raise result
+
+    async def dedupe_doc(self, job):
+        await asyncio.to_thread(workflow.dedupe_doc, job)
+
+    async def write_doc(self, job):
+        await asyncio.to_thread(workflow.write_doc, job)
+
+    async def upload_doc(self, job):
+        if self.upload_stage is not None:
+            await asyncio.to_thread(self.upload_stage, job)
+            return
+        if job.update_file is None:
+            # the record is unchanged, there is nothing to upload
+            return
+        await self.upload_update_file(job.update_file)
+        job.bytes_uploaded = os.path.getsize(job.update_file)
+
+    async def process_doc(self, job):
+        """
+        Runs the stages of the document, like the threaded pipeline: a failed document skips the remaining stages,
+        the time of each stage is recorded in job.timings. The document slot taken before the call is released.
+        :param job: validated DocumentJob
+        :return: job
+        """
+        stages = [('dedupe', self.dedupe_doc), ('gather', self.gather_doc), ('write', self.write_doc)]
+        if self.upload:
+            stages.append(('upload', self.upload_doc))
+
+        try:
+            for name, stage in stages:
+                if job.error is not None:
+                    break
+                started = time.time()
+                try:
+                    with tracing.span(name, parent=job.trace):
+                        await stage(job)
+                except Exception as e:
+                    job.error = e
+                    if job.failed_stage is None:
+                        job.failed_stage = name
+                finally:
+                    job.timings[name] = time.time() - started
+        finally:
+            self.documents.release()
+
+        return job
+
+
+async def run_async(dirs, deadline=None, upload=True, redo=None, upload_stage=None):
+    """
+    Coroutine of run.
+    """
+    counters = {'processed': 0, 'failed': 0, 'uploaded': 0, 'unchanged': 0}
+    costs = scheduler.load_costs()
+    run_stats = history.new_run()
+    # the scan validates the documents on disk, it runs in a thread so the calls in flight aren't held up
+    jobs = pipeline.scan_docs(dirs, costs, deadline, redo=redo)
+    stage, close = upload_stage or (None, None)
+
+    try:
+        async with AsyncEngine(upload=upload, upload_stage=stage) as engine:
+            pending = set()
+            while True:
+                job = await asyncio.to_thread(next, jobs, None)
+                if job is None:
+                    break
+                # waits while the maximum number of documents is in flight
+                await engine.documents.acquire()
+                pending.add(asyncio.create_task(engine.process_doc(job)))
+
+                finished = set(task for task in pending if task.done())
+                pending -= finished
+                for task in finished:
+                    # report_job writes the quarantine state of failed documents
+                    await asyncio.to_thread(pipeline.report_job, task.result(), counters, costs, run_stats, upload)
+
+            while len(pending) > 0:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    await asyncio.to_thread(pipeline.report_job, task.result(), counters, costs, run_stats, upload)
+    finally:
+        if close is not None:
+            close()
+        pipeline.finish_run(costs, run_stats)
+
+    return counters
+
+
+def run(dirs, deadline=None, upload=True, redo=None, upload_stage=None):
+    """
+    Processes the documents with the asyncio engine and reports each one as soon as it's finished.
+    :param dirs: iterable of document directories
+    :param deadline: timestamp of the end of the batch window or None
+    :param upload: if True, created update files are uploaded to the Aleph server
+    :param redo: reprocessing of finished documents: set of stages not using cached artifacts, see pipeline.run
+    :param upload_stage: tuple (stage function, function closing it) replacing the SFTP upload, see pipeline.run
+    :return: counters: dictionary with number of processed, failed, uploaded and unchanged documents
+    """
+    return asyncio.run(run_async(dirs, deadline=deadline, upload=upload, redo=redo, upload_stage=upload_stage))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Extracts plain text from ALTO XML TOC pages. ALTO carries coordinates, styles and confidence of every word,
+# so the text alone is many times smaller than the XML sent to KER.
+
+import os
+import xml.etree.ElementTree as ElementTree
+
+
+def get_local_name(tag):
+    """
+    Strips the namespace from the element tag ({http://www.loc.gov/standards/alto/ns-v2#}String -> String).
+    :param tag: element tag
+    :return: local name of the element
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_alto_lines(alto_file):
+    """
+    Yields text lines of an ALTO XML page in reading order (order of TextLine elements in the page).
+    The file is parsed incrementally and processed lines are cleared, so memory use doesn't depend on page size.
+    :param alto_file: path to the ALTO XML file
+    :return: generator of text lines (String/@CONTENT joined by spaces)
+    """
+    words = []
+
+    for event, element in ElementTree.iterparse(alto_file, events=('end',)):
+        name = get_local_name(element.tag)
+        if name == 'String':
+            content = element.get('CONTENT')
+            if content:
+                words.append(content)
+        elif name == 'TextLine':
+            if len(words) > 0:
+                yield ' '.join(words)
+            words = []
+            element.clear()
+        elif name == 'TextBlock':
+            element.clear()
+
+
+def write_alto_text(alto_files, text_file):
+    """
+    Writes the text of ALTO XML pages to one plain text file, one text line per line.
+    :param alto_files: list of paths to ALTO XML files
+    :param text_file: path to the created text file
+    :return: text_file: path to the created text file
+    """
+    with open(text_file, mode='w', encoding='utf-8') as f:
+        for alto_file in alto_files:
+            for line in iter_alto_lines(alto_file):
+                f.write(line)
+                f.write('\n')
+
+    if os.path.getsize(text_file) == 0:
+        raise RuntimeError("There is no text in the XML TOC files of document {}".format(
+            os.path.basename(os.path.dirname(text_file))))
+
+    return text_file
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Intermediate results of the stages (sysno of the record, normalized TOC lines, text of the ALTO pages sent to KER,
+# Aleph strings the record was updated with) cached in the document directory, so reprocessing a finished document
+# repeats only the stages whose inputs changed and writes no update of an unchanged record. Every artifact is stored with the key of the inputs it was made from and is used only for the same key.
+
+import config
+import json
+import os
+
+
+def get_artifact_file(doc_path, name):
+    """
+    Gets the path to the file of a cached artifact of the document.
+    :param doc_path: path to the document directory
+    :param name: name of the artifact
+    :return: path to the artifact file
+    """
+    return os.path.join(doc_path, config.ker_cache_prefix + name + '.json')
+
+
+def load_artifact(doc_path, name, key):
+    """
+    Loads a cached artifact of the document.
+    :param doc_path: path to the document directory
+    :param name: name of the artifact
+    :param key: JSON serializable key of the inputs the artifact has to be made from
+    :return: value of the artifact or None, if there is no artifact for the key
+    """
+    try:
+        with open(get_artifact_file(doc_path, name), encoding='utf-8') as f:
+            stored = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    # the key is compared in its JSON form, tuples of the caller are lists in the file
+    if not isinstance(stored, dict) or stored.get('key') != json.loads(json.dumps(key)):
+        return None
+
+    return stored.get('value')
+
+
+def save_artifact(doc_path, name, key, value):
+    """
+    Stores an artifact of the document in the document directory. The file is replaced atomically.
+    :param doc_path: path to the document directory
+    :param name: name of the artifact
+    :param key: JSON serializable key of the inputs the artifact was made from
+    :param value: JSON serializable value of the artifact
+    :return: path to the artifact file
+    """
+    artifact_file = get_artifact_file(doc_path, name)
+
+    tmp_file = artifact_file + '.tmp'
+    with open(tmp_file, mode='w', encoding='utf-8') as f:
+        json.dump({'key': key, 'value': value}, f, ensure_ascii=False)
+    os.replace(tmp_file, artifact_file)
+
+    return artifact_file
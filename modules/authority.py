@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Authority vocabulary index: maps KER keywords to preferred terms of the subject authority file.
+#
+# The index file is a header, an open addressing hash table and a pool of preferred terms. Each table slot holds
+# a 64-bit hash of a normalized term or variant, the offset and length of its preferred term in the pool, and
+# flags. Every word prefix of a multi-word variant is stored with the PREFIX flag, so the table works as a hashed
+# trie: a keyword is matched word by word, longest term first, without loading the vocabulary into memory.
+
+import config
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import unicodedata
+
+MAGIC = b'KRAUTH01'
+HEADER = struct.Struct('>8sIII')
+SLOT = struct.Struct('>QIHH')
+
+# slot flags: a normalized term or variant ends here / a longer variant continues with the next word
+TERM = 1
+PREFIX = 2
+
+# line of the Aleph sequential format: 000012345 15007 L $$achemie
+ALEPH_SEQ_LINE = re.compile(r'^(\d{9}) (150|450).. L (.*)$')
+
+_lock = threading.Lock()
+_index = {}
+
+
+def normalize_term(term):
+    """
+    Normalizes a term or keyword for matching: case folded, punctuation replaced by spaces, whitespace collapsed.
+    Diacritics are kept, they distinguish Czech words.
+    :param term: term string
+    :return: normalized term
+    """
+    term = unicodedata.normalize('NFC', term).casefold()
+
+    return ' '.join(re.sub(r'[\W_]+', ' ', term).split())
+
+
+def hash_term(normalized):
+    """
+    Hashes a normalized term to a non-zero 64-bit key (zero marks an empty slot).
+    :param normalized: term returned by normalize_term
+    :return: integer hash
+    """
+    digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+
+    return int.from_bytes(digest, 'big') or 1
+
+
+def iter_aleph_authority(lines):
+    """
+    Yields preferred terms (field 150) and their variants (field 450) from an Aleph sequential authority export.
+    :param lines: iterable of lines of the export
+    :return: generator of tuples (preferred term, list of variants)
+    """
+    current_sysno = None
+    preferred = None
+    variants = []
+
+    for line in lines:
+        match = ALEPH_SEQ_LINE.match(line.rstrip('\n'))
+        if not match:
+            continue
+        sysno, tag, value = match.groups()
+        if sysno != current_sysno:
+            if preferred is not None:
+                yield preferred, variants
+            current_sysno, preferred, variants = sysno, None, []
+        for code, subfield in [(part[0], part[1:]) for part in value.split(config.subfield_prefix) if part]:
+            if code != 'a':
+                continue
+            if tag == '150':
+                preferred = subfield.strip()
+            else:
+                variants.append(subfield.strip())
+
+    if preferred is not None:
+        yield preferred, variants
+
+
+def iter_tsv_authority(lines):
+    """
+    Yields preferred terms and their variants from a tab separated file, one term per line:
+    preferred term<TAB>variant<TAB>variant...
+    :param lines: iterable of lines of the file
+    :return: generator of tuples (preferred term, list of variants)
+    """
+    for line in lines:
+        fields = [field.strip() for field in line.rstrip('\n').split('\t')]
+        if len(fields[0]) > 0:
+            yield fields[0], [field for field in fields[1:] if len(field) > 0]
+
+
+def build_index(terms, index_file):
+    """
+    Builds the index file from preferred terms and their variants. A preferred term always maps to itself; when
+    a variant belongs to several terms, the first one is kept. The file is replaced atomically.
+    :param terms: iterable of tuples (preferred term, list of variants)
+    :param index_file: path to the index file
+    :return: number of preferred terms in the index
+    """
+    preferred_terms = []
+    term_ids = {}
+    variants = {}
+
+    for preferred, term_variants in terms:
+        if preferred not in term_ids:
+            term_ids[preferred] = len(preferred_terms)
+            preferred_terms.append(preferred)
+        variants[normalize_term(preferred)] = term_ids[preferred]
+        for variant in term_variants:
+            variants.setdefault(normalize_term(variant), term_ids[preferred])
+
+    entries = {}
+    max_words = 1
+    for normalized, term_id in variants.items():
+        words = normalized.split()
+        if len(words) == 0:
+            continue
+        max_words = max(max_words, len(words))
+        for length in range(1, len(words)):
+            key = hash_term(' '.join(words[:length]))
+            entry = entries.setdefault(key, [None, 0])
+            entry[1] |= PREFIX
+        entry = entries.setdefault(hash_term(normalized), [None, 0])
+        entry[0] = term_id
+        entry[1] |= TERM
+
+    pool = []
+    offsets = []
+    position = 0
+    for term in preferred_terms:
+        encoded = term.encode('utf-8')
+        offsets.append((position, len(encoded)))
+        pool.append(encoded)
+        position += len(encoded)
+
+    # load factor under 0.5 keeps probe sequences short
+    slots = 1
+    while slots < 2 * len(entries) + 1:
+        slots *= 2
+    table = bytearray(slots * SLOT.size)
+    mask = slots - 1
+    for key, (term_id, flags) in entries.items():
+        slot = key & mask
+        while SLOT.unpack_from(table, slot * SLOT.size)[0] != 0:
+            slot = (slot + 1) & mask
+        offset, length = offsets[term_id] if term_id is not None else (0, 0)
+        SLOT.pack_into(table, slot * SLOT.size, key, offset, length, flags)
+
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, mode='wb') as f:
+        f.write(HEADER.pack(MAGIC, slots, len(preferred_terms), max_words))
+        f.write(table)
+        for encoded in pool:
+            f.write(encoded)
+
+    os.replace(tmp_file, index_file)
+
+    return len(preferred_terms)
+
+
+def import_export(export_file, index_file, export_format='aleph'):
+    """
+    Imports the authority file into the index file.
+    :param export_file: path to the export
+    :param index_file: path to the index file
+    :param export_format: 'aleph' for the Aleph sequential format, 'tsv' for a tab separated list of terms
+    :return: number of preferred terms in the index
+    """
+    if export_format == 'aleph':
+        iter_terms = iter_aleph_authority
+    elif export_format == 'tsv':
+        iter_terms = iter_tsv_authority
+    else:
+        raise ValueError("Invalid export format {}. Should be 'aleph' or 'tsv' only".format(export_format))
+
+    with open(export_file, encoding='utf-8', errors='replace') as f:
+        return build_index(iter_terms(f), index_file)
+
+
+def open_index(index_file):
+    """
+    Opens the index file via mmap.
+    :param index_file: path to the index file
+    :return: tuple (mmap, number of slots, maximum number of words of a term) or None, if the index file
+    doesn't exist or is empty
+    """
+    if not os.path.isfile(index_file) or os.path.getsize(index_file) <= HEADER.size:
+        return None
+
+    with open(index_file, mode='rb') as f:
+        index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, slots, count, max_words = HEADER.unpack_from(index_map)
+    if magic != MAGIC:
+        index_map.close()
+        raise IOError("File {} is not an authority index".format(index_file))
+
+    return index_map, slots, max_words
+
+
+def find(index, normalized):
+    """
+    Finds the slot of a normalized term or term prefix in the open index.
+    :param index: tuple returned by open_index
+    :param normalized: term returned by normalize_term
+    :return: tuple (preferred term or None for a prefix only, flags) or None
+    """
+    index_map, slots, max_words = index
+    key = hash_term(normalized)
+    mask = slots - 1
+    slot = key & mask
+    pool_start = HEADER.size + slots * SLOT.size
+
+    while True:
+        slot_key, offset, length, flags = SLOT.unpack_from(index_map, HEADER.size + slot * SLOT.size)
+        if slot_key == 0:
+            return None
+        if slot_key == key:
+            term = None
+            if flags & TERM:
+                term = index_map[pool_start + offset:pool_start + offset + length].decode('utf-8')
+            return term, flags
+        slot = (slot + 1) & mask
+
+
+def match_terms(index, keyword):
+    """
+    Matches the keyword to authority terms: the whole keyword when it is a term or a variant, otherwise the longest
+    terms found in its words from left to right.
+    :param index: tuple returned by open_index
+    :param keyword: keyword returned by KER
+    :return: list of preferred terms
+    """
+    words = normalize_term(keyword).split()
+    max_words = index[2]
+    terms = []
+    start = 0
+
+    while start < len(words):
+        longest = None
+        for end in range(start + 1, min(len(words), start + max_words) + 1):
+            found = find(index, ' '.join(words[start:end]))
+            if found is None:
+                break
+            term, flags = found
+            if flags & TERM:
+                longest = (end, term)
+            if not flags & PREFIX:
+                break
+        if longest is None:
+            start += 1
+        else:
+            start, term = longest
+            terms.append(term)
+
+    return terms
+
+
+def get_index(index_file=None):
+    """
+    Gets the open authority index shared by the whole process.
+    :param index_file: path to the index file, config.authority_index_file by default
+    :return: tuple returned by open_index or None, if there is no index
+    """
+    if index_file is None:
+        index_file = getattr(config, 'authority_index_file', None)
+    if index_file is None:
+        return None
+
+    with _lock:
+        if index_file not in _index:
+            _index[index_file] = open_index(index_file)
+        return _index[index_file]
+
+
+def map_keywords(keywords, index_file=None):
+    """
+    Maps keywords selected from the KER response to preferred terms of the authority vocabulary. Keywords without
+    a match are kept as free text when config.authority_keep_unmatched is set, otherwise they are dropped.
+    :param keywords: list of keywords
+    :param index_file: path to the index file, config.authority_index_file by default
+    :return: list of terms without duplicates, in order of the keywords; the keywords unchanged, if there is
+    no index
+    """
+    index = get_index(index_file)
+    if index is None:
+        return keywords
+
+    mapped = []
+    for keyword in keywords:
+        terms = match_terms(index, keyword)
+        if len(terms) == 0 and config.authority_keep_unmatched:
+            terms = [keyword]
+        for term in terms:
+            if term not in mapped:
+                mapped.append(term)
+
+    return mapped
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Client-side load balancing across KER replicas: power-of-two choices by the number of outstanding requests,
+# with passive health checking. A replica failing config.ker_eject_failures times in a row is ejected for
+# config.ker_eject_seconds, doubled with each further ejection up to config.ker_eject_max_seconds.
+
+import config
+import random
+import threading
+import time
+
+_lock = threading.Lock()
+_balancers = {}
+
+
+class Balancer(object):
+    """
+    Picks endpoints for requests and tracks their outstanding requests and failures.
+    """
+
+    def __init__(self, endpoints):
+        if isinstance(endpoints, str):
+            endpoints = [endpoints]
+        if len(endpoints) == 0:
+            raise ValueError("At least one endpoint is needed for load balancing")
+
+        self.endpoints = list(endpoints)
+        self.lock = threading.Lock()
+        self.outstanding = dict((endpoint, 0) for endpoint in self.endpoints)
+        self.failures = dict((endpoint, 0) for endpoint in self.endpoints)
+        self.ejections = dict((endpoint, 0) for endpoint in self.endpoints)
+        self.ejected_until = dict((endpoint, 0) for endpoint in self.endpoints)
+
+    def acquire(self, exclude=()):
+        """
+        Picks an endpoint for a request: the one with fewer outstanding requests of two random healthy endpoints.
+        When all endpoints are ejected, the one which returns first is used.
+        :param exclude: endpoints which should not be picked (e.g. already failed for this request)
+        :return: endpoint
+        """
+        with self.lock:
+            now = time.time()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+            healthy = [endpoint for endpoint in candidates if self.ejected_until[endpoint] <= now]
+
+            if len(healthy) == 0:
+                endpoint = min(candidates, key=lambda candidate: self.ejected_until[candidate])
+            elif len(healthy) == 1:
+                endpoint = healthy[0]
+            else:
+                first, second = random.sample(healthy, 2)
+                endpoint = first if self.outstanding[first] <= self.outstanding[second] else second
+
+            self.outstanding[endpoint] += 1
+
+        return endpoint
+
+    def release(self, endpoint, ok):
+        """
+        Finishes a request on the endpoint and updates its health.
+        :param endpoint: endpoint returned by acquire
+        :param ok: True for a successful request, False for a failed one, None when the result says nothing about
+        the endpoint (e.g. a cancelled request)
+        :return: None
+        """
+        with self.lock:
+            self.outstanding[endpoint] -= 1
+
+            if ok is None:
+                return
+
+            if ok:
+                self.failures[endpoint] = 0
+                self.ejections[endpoint] = 0
+                return
+
+            self.failures[endpoint] += 1
+            if self.failures[endpoint] >= config.ker_eject_failures:
+                self.ejections[endpoint] += 1
+                backoff = min(config.ker_eject_seconds * 2 ** (self.ejections[endpoint] - 1),
+                              config.ker_eject_max_seconds)
+                self.ejected_until[endpoint] = time.time() + backoff
+                self.failures[endpoint] = 0
+                print("Endpoint {} ejected for {} s after repeated failures".format(endpoint, backoff))
+
+    def lease(self, exclude=()):
+        """
+        Picks an endpoint for a request like acquire, the request holds it as a Lease.
+        :param exclude: endpoints which should not be picked
+        :return: Lease
+        """
+        return Lease(self, self.acquire(exclude=exclude))
+
+    def get_state(self):
+        """
+        Gets the state of each endpoint.
+        :return: dictionary endpoint -> dictionary with outstanding requests, failures and ejection end
+        """
+        with self.lock:
+            return dict((endpoint, {'outstanding': self.outstanding[endpoint],
+                                    'failures': self.failures[endpoint],
+                                    'ejected_until': self.ejected_until[endpoint]})
+                        for endpoint in self.endpoints)
+
+
+class Lease(object):
+    """
+    Request on an endpoint picked by the balancer. It's released only once, by the request or earlier by its
+    cancellation (Lease.release(None)), so a cancelled request doesn't count as outstanding until it times out.
+    """
+    __slots__ = ('balancer', 'endpoint', 'lock', 'released')
+
+    def __init__(self, balancer, endpoint):
+        self.balancer = balancer
+        self.endpoint = endpoint
+        self.lock = threading.Lock()
+        self.released = False
+
+    def release(self, ok):
+        """
+        Finishes the request on the endpoint, see Balancer.release. Later calls do nothing.
+        :param ok: True, False or None, see Balancer.release
+        :return: None
+        """
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        self.balancer.release(self.endpoint, ok)
+
+
+def get_ker_balancer():
+    """
+    Gets the balancer of KER endpoints configured in config.kerator_api (one URL or a list of URLs).
+    :return: Balancer shared by all requests of the process
+    """
+    endpoints = config.kerator_api
+    key = endpoints if isinstance(endpoints, str) else tuple(endpoints)
+
+    with _lock:
+        if key not in _balancers:
+            _balancers[key] = Balancer(endpoints)
+        return _balancers[key]
@@ -3,104 +3,225 @@
 
 import os
 import config
-import requests
-import xmltodict
+from modules import executor
+from modules import tracing
 from modules import utility
+from modules.errors import DocumentNotFound
+from modules.errors import DocumentTimeout
 import re
 from datetime import datetime
 
 
-def get_set_number(dir_name):
+def parse_response_items(response_text, keys):
     """
-    Get's the set number of the document from Aleph library system based on the directory name which is equal to
-    documents' ISBN number. Performs a search for a document record based on the ISBN identifier.
-    :param dir_name: name of the
-    :return: set_number: string representing a set number of the search result
+    Parses the XML response of the X-server and finds values of the given keys. Only the found values are returned,
+    so when the parsing runs in a worker process, the parsed response isn't passed back.
+    :param response_text: text of the response
+    :param keys: list of keys to find (e.g. 'no_records', 'set_number')
+    :return: dictionary key -> list of found values
+    """
+    import xmltodict
+
+    response_dict = xmltodict.parse(response_text)
+
+    return dict((key, list(utility.find_item_in_response(response_dict, key=key))) for key in keys)
+
+
+def parse_record_fields(response_text, tags):
+    """
+    Parses the OAI MARC record from the 'present' response of the X-server and gets its doc_number and the varfields
+    with the given tags.
+    :param response_text: text of the response
+    :param tags: list of field tags (e.g. '653', '505')
+    :return: tuple (list of doc_numbers, dictionary tag -> list of fields, each a list of (subfield code, value))
+    """
+    import xmltodict
+
+    response_dict = xmltodict.parse(response_text)
+    doc_numbers = list(utility.find_item_in_response(response_dict, key='doc_number'))
+
+    fields = {}
+    for varfields in utility.find_item_in_response(response_dict, key='varfield'):
+        # xmltodict returns a single element as a dict and repeated elements as a list
+        if isinstance(varfields, dict):
+            varfields = [varfields]
+        for varfield in varfields:
+            if varfield.get('@id') not in tags:
+                continue
+            subfields = varfield.get('subfield') or []
+            if isinstance(subfields, dict):
+                subfields = [subfields]
+            fields.setdefault(varfield['@id'], []).append(
+                [(subfield.get('@label'), subfield.get('#text') or '') for subfield in subfields])
+
+    return doc_numbers, fields
+
+
+def run_parser(parser, response_text, *args):
+    """
+    Runs a parser of an XML response of the X-server. Large responses (config.cpu_min_response_bytes) are parsed
+    in the process pool.
+    :param parser: parse_response_items or parse_record_fields
+    :param response_text: text of the response
+    :param args: other arguments of the parser
+    :return: result of the parser
+    """
+    if len(response_text) >= config.cpu_min_response_bytes:
+        return executor.call_cpu(parser, response_text, *args)
+
+    return parser(response_text, *args)
+
+
+def get_subfield_values(fields, tag, code):
+    """
+    Gets the values of a subfield from all fields with the given tag.
+    :param fields: dictionary returned by parse_record_fields
+    :param tag: field tag
+    :param code: subfield code
+    :return: list of subfield values
+    """
+    return [value for field in fields.get(tag, []) for subfield_code, value in field if subfield_code == code]
+
+
+def fetch_query(name, aleph_url, deadline=None):
+    """
+    Sends an X-server query.
+    :param name: name of the span of the call (e.g. 'aleph.find')
+    :param aleph_url: URL of the query
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+    :return: tuple (HTTP status code, text of the response)
     """
-    # separates date and ISBN from the directory name
-    # numsplits = 3 - because name of the directory now consists of 3 parts (DONE_DATE_ISBN)
+    # requests and xmltodict are imported lazily, so commands which never reach Aleph start fast
+    import requests
 
-    name_parts = utility.split_string(dir_name, numsplits=3, sep="_", ignore_extra=True)
+    with tracing.span(name, kind=tracing.KIND_CLIENT, **{'http.request.method': 'GET', 'url.full': aleph_url}) as span:
+        try:
+            aleph_response = requests.get(aleph_url, timeout=utility.get_call_timeout(config.aleph_timeout, deadline))
+        except requests.Timeout as e:
+            raise DocumentTimeout("ERROR (CATALOGUE): Aleph server did not respond in time: {}".format(e))
+        span.set_attribute('http.response.status_code', aleph_response.status_code)
+        span.set_attribute('http.response.body.size', len(aleph_response.content))
 
-    # isbn part of the sting should be on third position in the list of name parts
-    isbn = name_parts[2]
+    return aleph_response.status_code, aleph_response.text
 
-    # construct aleph query
-    aleph_url = config.aleph_api + '/?op=find&request=isbn='+isbn+'&code=SBN&base=STK'
 
-    # get response
-    aleph_response = requests.get(aleph_url)
+def get_find_url(isbn):
+    """
+    Constructs the X-server query searching the document record by its ISBN.
+    :param isbn: ISBN of the document
+    :return: URL of the query
+    """
+    return config.aleph_api + '/?op=find&request=isbn='+isbn+'&code=SBN&base=STK'
+
 
+def read_set_number(isbn, status_code, response_text, aleph_url):
+    """
+    Reads the set number of the search result from the response of the X-server find query.
+    :param isbn: ISBN of the document
+    :param status_code: HTTP status code of the response
+    :param response_text: text of the response
+    :param aleph_url: URL of the query, for error messages
+    :return: set_number: string representing a set number of the search result
+    """
     # check response from the server
-    if aleph_response.status_code != 200:
-        print(aleph_response.status_code, aleph_url)
-        raise ValueError("ERROR (CATALOGUE): Aleph server returned response {}".format(aleph_response.status_code))
+    if status_code != 200:
+        print(status_code, aleph_url)
+        raise ValueError("ERROR (CATALOGUE): Aleph server returned response {}".format(status_code))
     # print(aleph_response.text)
 
-    # parse aleph response text to a dictionary
-    result_set_dict = xmltodict.parse(aleph_response.text)
-
-    # find number of records in the response
-    aleph_result_generator = utility.find_item_in_response(result_set_dict, key='no_records')
+    # parse aleph response text and find number of records and set number in the response
+    result_set_items = run_parser(parse_response_items, response_text, ['no_records', 'set_number'])
+    aleph_result_generator = result_set_items['no_records']
 
     # check number of found documents
     for aleph_result in aleph_result_generator:
         print("{0:%Y-%m-%d %H:%M:%S}".format(datetime.now()) + " " + "INFO (CATALOGUE): ALEPH RESULT 001:", aleph_result)
         if re.match('[0]{9}', aleph_result):
-            raise IOError("ERROR (CATALOGUE): No document found for isbn {}...".format(isbn))
+            raise DocumentNotFound("ERROR (CATALOGUE): No document found for isbn {}...".format(isbn))
 
         # if there are some documents found, get the set number from the response
         if re.match('[0]{8}[1]{1}', aleph_result):
             print("{0:%Y-%m-%d %H:%M:%S}".format(datetime.now()) + " " +
                   "INFO (CATALOGUE): Found one result for the Aleph query.")
-            set_number_generator = utility.find_item_in_response(result_set_dict, 'set_number')
+            set_number_generator = result_set_items['set_number']
             for set_number in set_number_generator:
                 return set_number
         else:
             print("{0:%Y-%m-%d %H:%M:%S}".format(datetime.now()) + " " +
                   "WARNING (CATALOGUE): Found multiple results for search query...")
-            set_number_generator = utility.find_item_in_response(result_set_dict, 'set_number')
+            set_number_generator = result_set_items['set_number']
             # will return the first set number in result generator
             for set_number in set_number_generator:
                 return set_number
 
 
-def get_document_sysno(set_number):
+def get_present_url(set_number):
     """
-    Gets system number of the processed document based on the set number of the search result.
+    Constructs the X-server query presenting the first record of the search result.
     :param set_number: string representing set number of the search result
-    :return: doc_number: system number of the document
+    :return: URL of the query
     """
     aleph_result = '000000001'  # indicates what result we want, in this case, always the first one
 
-    print("{0:%Y-%m-%d %H:%M:%S}".format(datetime.now()) + " " + "INFO (CATALOGUE): SET NUMBER:", set_number)
+    return config.aleph_api+'?op=present&set_entry='+aleph_result+'&set_number='+set_number
 
-    # construct aleph record query
-    aleph_record_query = config.aleph_api+'?op=present&set_entry='+aleph_result+'&set_number='+set_number
-    # get the response from server
-    aleph_record_response = requests.get(aleph_record_query)
+
+def read_document_record(status_code, response_text, aleph_record_query):
+    """
+    Reads the system number and the keyword and TOC fields of the record from the response of the X-server
+    present query.
+    :param status_code: HTTP status code of the response
+    :param response_text: text of the response
+    :param aleph_record_query: URL of the query, for error messages
+    :return: tuple (doc_number, dictionary returned by parse_record_fields with keyword and TOC fields)
+    """
     # check response status code
-    if aleph_record_response.status_code != 200:
-        print(aleph_record_response.status_code, aleph_record_query)
+    if status_code != 200:
+        print(status_code, aleph_record_query)
         raise ValueError("{0:%Y-%m-%d %H:%M:%S}".format(datetime.now()) + " " +
-                         "ERROR (CATALOGUE): Server returned status {}".format(aleph_record_response.status_code))
+                         "ERROR (CATALOGUE): Server returned status {}".format(status_code))
 
-    print(aleph_record_response.status_code, aleph_record_query)
-    # parse result text to a dictionary
-    result_record_dict = xmltodict.parse(aleph_record_response.text)
+    print(status_code, aleph_record_query)
+    # parse result text and search for a doc_number (sysno) and the current keyword and TOC fields in the record
+    aleph_record_generator, fields = run_parser(parse_record_fields, response_text,
+                                                [config.keywords_field_number, config.tocs_field_number])
 
-    # search for a doc_number (sysno) in the record
-    aleph_record_generator = utility.find_item_in_response(result_record_dict, key='doc_number')
-
-    if aleph_record_generator is None:
+    if len(aleph_record_generator) == 0:
         raise ValueError("{0:%Y-%m-%d %H:%M:%S}".format(datetime.now()) + " " +
                          "ERROR: Unable to find doc_number in response from Aleph server")
 
     # return the doc_number (sysno)
     for doc_number in aleph_record_generator:
         # print(doc_number)
-        return doc_number
+        return doc_number, fields
+
+
+def get_find_doc_url(sysno):
+    """
+    Constructs the X-server query presenting the record with the given system number.
+    :param sysno: system number of the document record
+    :return: URL of the query
+    """
+    return config.aleph_api + '?op=find-doc&doc_num=' + sysno + '&base=STK'
 
 
+def read_record_fields(sysno, status_code, response_text, aleph_url):
+    """
+    Reads the keyword and TOC fields of the record from the response of the X-server find-doc query.
+    :param sysno: system number of the document record
+    :param status_code: HTTP status code of the response
+    :param response_text: text of the response
+    :param aleph_url: URL of the query, for error messages
+    :return: dictionary returned by parse_record_fields with keyword and TOC fields
+    """
+    if status_code != 200:
+        print(status_code, aleph_url)
+        raise ValueError("ERROR (CATALOGUE): Aleph server returned response {}".format(status_code))
 
+    # the X-server reports an unknown sysno by an error element instead of the record
+    if '<oai_marc' not in response_text:
+        raise DocumentNotFound("ERROR (CATALOGUE): No record found for sysno {}...".format(sysno))
 
+    doc_numbers, fields = run_parser(parse_record_fields, response_text,
+                                     [config.keywords_field_number, config.tocs_field_number])
+    return fields
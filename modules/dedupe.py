@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Detection of TOC pages scanned more than once. Exact duplicates are found by a hash of the normalized page text,
+# near duplicates (the same page with different OCR errors) by MinHash signatures of word shingles: the share of
+# equal signature values estimates the Jaccard similarity of the shingle sets. A document has only a few TOC
+# pages, so every page is compared with the pages kept before it.
+
+import config
+import hashlib
+import os
+import random
+import re
+from modules import alto
+
+# Mersenne prime 2^61 - 1, modulus of the universal hash functions of the signature
+PRIME = (1 << 61) - 1
+_random = random.Random(4242)
+PERMUTATIONS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for i in range(256)]
+
+
+def normalize_text(text):
+    """
+    Normalizes the page text for comparison: case folded, only words and numbers separated by single spaces.
+    :param text: page text
+    :return: normalized text
+    """
+    return ' '.join(re.sub(r'[\W_]+', ' ', text.casefold()).split())
+
+
+def get_page_text(toc_file):
+    """
+    Gets the text of a TOC page: the content of a TXT page or the text lines of an XML (ALTO) page.
+    :param toc_file: path to a TOC page
+    :return: page text
+    """
+    if toc_file.endswith(config.toc_xml_suffix):
+        return '\n'.join(alto.iter_alto_lines(toc_file))
+
+    with open(toc_file, encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def hash_shingle(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def get_signature(normalized, shingle_size=None, permutations=None):
+    """
+    Computes the MinHash signature of the normalized page text.
+    :param normalized: text returned by normalize_text
+    :param shingle_size: number of words of a shingle, config.dedupe_shingle_size by default
+    :param permutations: length of the signature (at most 256), config.dedupe_permutations by default
+    :return: tuple of minimal hash values, one per hash function
+    """
+    shingle_size = shingle_size or config.dedupe_shingle_size
+    permutations = permutations or config.dedupe_permutations
+
+    words = normalized.split()
+    shingles = set(' '.join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1)))
+    hashes = [hash_shingle(shingle) for shingle in shingles]
+
+    return tuple(min((a * value + b) % PRIME for value in hashes) for a, b in PERMUTATIONS[:permutations])
+
+
+def estimate_similarity(signature, other):
+    """
+    Estimates the Jaccard similarity of two pages from their signatures.
+    :param signature: signature returned by get_signature
+    :param other: signature of the other page
+    :return: similarity between 0 and 1
+    """
+    return sum(1 for value, other_value in zip(signature, other) if value == other_value) / float(len(signature))
+
+
+def find_duplicates(pages, threshold=None):
+    """
+    Finds pages duplicating an earlier page of the list.
+    :param pages: list of tuples (page name, page text) in page order
+    :param threshold: minimal estimated similarity of near duplicates, config.dedupe_threshold by default
+    :return: dictionary name of the duplicate page -> name of the kept page
+    """
+    if threshold is None:
+        threshold = config.dedupe_threshold
+
+    duplicates = {}
+    digests = {}
+    kept = []
+
+    for name, text in pages:
+        normalized = normalize_text(text)
+        if len(normalized) == 0:
+            continue
+
+        digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+        if digest in digests:
+            duplicates[name] = digests[digest]
+            continue
+
+        signature = get_signature(normalized)
+        for kept_name, kept_signature in kept:
+            if estimate_similarity(signature, kept_signature) >= threshold:
+                duplicates[name] = kept_name
+                break
+        else:
+            digests[digest] = name
+            kept.append((name, signature))
+
+    return duplicates
+
+
+def get_page_name(toc_file):
+    """
+    Gets the name of the TOC page shared by its TXT and XML files (toc_001.txt, toc_001.xml -> toc_001).
+    :param toc_file: path to a TOC page
+    :return: page name
+    """
+    return os.path.splitext(os.path.basename(toc_file))[0]
+
+
+def dedupe_pages(toc_xml_files, toc_txt_files):
+    """
+    Removes duplicate pages from the TOC page lists of a document. Both files of a duplicate page are removed;
+    the pages are compared by their TXT text, or by the text of the XML page when it has no TXT file.
+    :param toc_xml_files: list of XML TOC pages
+    :param toc_txt_files: list of TXT TOC pages
+    :return: tuple (XML TOC pages, TXT TOC pages, dictionary name of the removed page -> name of the kept page)
+    """
+    page_files = {}
+    for toc_file in toc_xml_files + toc_txt_files:
+        files = page_files.setdefault(get_page_name(toc_file), {})
+        files[os.path.splitext(toc_file)[1]] = toc_file
+
+    pages = []
+    for name in sorted(page_files):
+        files = page_files[name]
+        toc_file = files.get('.' + config.toc_txt_suffix) or files.get('.' + config.toc_xml_suffix)
+        if toc_file is not None:
+            pages.append((name, get_page_text(toc_file)))
+
+    duplicates = find_duplicates(pages)
+
+    return ([toc_file for toc_file in toc_xml_files if get_page_name(toc_file) not in duplicates],
+            [toc_file for toc_file in toc_txt_files if get_page_name(toc_file) not in duplicates],
+            duplicates)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# failure_class of an error selects the retry policy of the failed document (config.quarantine_backoff)
+
+
+class DocumentTimeout(RuntimeError):
+    """
+    Raised when the processing of a document runs out of time: a network call timed out or the document's
+    deadline passed. The document is cut off and retried in the next run.
+    """
+    failure_class = 'timeout'
+
+
+class RequestCancelled(RuntimeError):
+    """
+    Raised inside a request which was cancelled, e.g. the slower of two hedged requests.
+    """
+    failure_class = 'timeout'
+
+
+class InvalidDocument(RuntimeError):
+    """
+    Raised by the validation during the scan, when a document can't be processed (bad directory name, missing
+    TOC files). Invalid documents are rejected before any network call.
+    """
+    failure_class = 'invalid'
+
+
+class MissingTocFiles(InvalidDocument):
+    """
+    Raised by the validation when the document has no TOC files to send to KER.
+    """
+    failure_class = 'no_toc'
+
+
+class DocumentNotFound(IOError):
+    """
+    Raised when Aleph has no record with the ISBN of the document.
+    """
+    failure_class = 'not_found'
+
+
+class KerUnavailable(IOError):
+    """
+    Raised when every KER replica tried by a request answered with a server error (HTTP 5xx).
+    """
+    failure_class = 'network'
+
+
+class KerResponseError(ValueError):
+    """
+    Raised when none of the KER responses of the document can be parsed.
+    """
+    failure_class = 'ker_parse'
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Hybrid execution: the pipeline stages run in threads, which is enough for the network calls, while CPU-bound
+# work (TOC normalization, parsing of large Aleph responses, zipping of TOC files) is sent to a pool of processes
+# shared by all stages, so it isn't serialized by the GIL. Only file paths and small results cross the process
+# boundary: workers read the TOC files themselves and return just the extracted values. When the caller is traced,
+# the trace context goes along and the workers export their spans themselves.
+
+import config
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from modules import tracing
+
+_lock = threading.Lock()
+_pool = {}
+
+
+def get_workers():
+    """
+    Gets the number of worker processes: config.cpu_workers, one per CPU when it's None.
+    :return: number of worker processes, 0 when the CPU-bound work runs in the calling thread
+    """
+    workers = config.cpu_workers
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    return workers
+
+
+def get_pool():
+    """
+    Gets the process pool shared by the whole process, it's started with the first CPU-bound task.
+    :return: ProcessPoolExecutor or None, if the process pool is disabled
+    """
+    workers = get_workers()
+    if workers == 0:
+        return None
+
+    with _lock:
+        if 'pool' not in _pool:
+            context = multiprocessing.get_context(config.cpu_start_method)
+            _pool['pool'] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _pool['pool']
+
+
+def call_cpu(function, *args):
+    """
+    Runs a CPU-bound function in the process pool and waits for its result.
+    :param function: module level function (it's pickled by name)
+    :param args: arguments of the function
+    :return: result of the function
+    """
+    pool = get_pool()
+    if pool is None:
+        return function(*args)
+
+    context = tracing.get_context()
+    if context is not None:
+        return pool.submit(tracing.call_traced, context, function, *args).result()
+
+    return pool.submit(function, *args).result()
+
+
+def map_cpu(function, items):
+    """
+    Runs a CPU-bound function on each item in the process pool, config.cpu_chunk_size items per task.
+    :param function: module level function (it's pickled by name)
+    :param items: list of arguments of the function
+    :return: list of results in order of the items
+    """
+    pool = get_pool()
+    if pool is None or len(items) <= 1:
+        return [function(item) for item in items]
+
+    context = tracing.get_context()
+    if context is not None:
+        function = partial(tracing.call_traced, context, function)
+
+    return list(pool.map(function, items, chunksize=config.cpu_chunk_size))
+
+
+def shutdown():
+    """
+    Stops the worker processes.
+    :return: None
+    """
+    with _lock:
+        pool = _pool.pop('pool', None)
+
+    if pool is not None:
+        pool.shutdown(wait=True)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Hedged requests: when a call takes longer than a percentile of recently observed latencies, a duplicate is sent
+# and whichever finishes first is used. The number of hedges is capped to a fraction of all calls.
+#
+# A blocking HTTP call can't be interrupted once its body was sent, so the loser may keep its thread until its read
+# timeout. Its cancellation releases everything it holds (e.g. its balancer slot) right away and its late result
+# is left out of the latencies.
+
+import config
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+_lock = threading.Lock()
+_latencies = deque(maxlen=config.ker_hedge_window)
+_stats = {'calls': 0, 'hedges': 0, 'hedge_wins': 0}
+
+
+class Cancellation(object):
+    """
+    Cancel event of an attempt. Functions registered by on_cancel run once, when the attempt is cancelled.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.callbacks = []
+
+    def is_set(self):
+        return self.cancelled
+
+    def on_cancel(self, callback):
+        """
+        Registers a function run when the attempt is cancelled, immediately if it already was.
+        :param callback: function without arguments
+        :return: None
+        """
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def set(self):
+        """
+        Cancels the attempt and runs the registered functions.
+        :return: None
+        """
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def record_latency(seconds):
+    """
+    Adds the latency of a finished call to the window of recent latencies.
+    :param seconds: latency of the call
+    :return: None
+    """
+    with _lock:
+        _latencies.append(seconds)
+
+
+def get_hedge_delay():
+    """
+    Gets the time after which a duplicate call is sent: config.ker_hedge_percentile of recent latencies.
+    :return: delay in seconds or None, if too few latencies were observed yet
+    """
+    with _lock:
+        if len(_latencies) < config.ker_hedge_min_samples:
+            return None
+        latencies = sorted(_latencies)
+
+    rank = int(math.ceil(len(latencies) * config.ker_hedge_percentile / 100.0)) - 1
+
+    return latencies[max(0, rank)]
+
+
+def get_stats():
+    """
+    Gets the hedging counters: number of calls, sent hedges and hedges which finished before the original call.
+    :return: copy of the counters
+    """
+    with _lock:
+        return dict(_stats)
+
+
+def _take_hedge():
+    # a hedge may be sent only while hedges stay under config.ker_hedge_max_ratio of all calls
+    with _lock:
+        if _stats['hedges'] + 1 > config.ker_hedge_max_ratio * _stats['calls']:
+            return False
+        _stats['hedges'] += 1
+        return True
+
+
+def _run_attempt(attempt, cancelled):
+    started = time.time()
+    result = attempt(cancelled)
+    # the late result of a cancelled attempt would only skew the window towards slow calls
+    if not cancelled.is_set():
+        record_latency(time.time() - started)
+    return result
+
+
+def hedged_call(attempt):
+    """
+    Runs the call, and when it's slower than the hedge delay, runs a duplicate and returns the result of whichever
+    finishes first successfully. The loser is cancelled: a request still sending its body stops, the functions
+    it registered by Cancellation.on_cancel run and its result is dropped.
+    :param attempt: function taking a Cancellation and returning the result
+    :return: result of the first successful attempt
+    """
+    with _lock:
+        _stats['calls'] += 1
+
+    delay = get_hedge_delay()
+    if not config.ker_hedging or delay is None:
+        return _run_attempt(attempt, Cancellation())
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        primary_cancelled = Cancellation()
+        primary = executor.submit(_run_attempt, attempt, primary_cancelled)
+        done, pending = wait([primary], timeout=delay)
+        if primary in done or not _take_hedge():
+            return primary.result()
+
+        print("KER call is slower than {:.2f} s, sending a hedged request...".format(delay))
+        hedge_cancelled = Cancellation()
+        hedge = executor.submit(_run_attempt, attempt, hedge_cancelled)
+        attempts = {primary: primary_cancelled, hedge: hedge_cancelled}
+
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for other in pending:
+                    attempts[other].set()
+                if future is hedge:
+                    with _lock:
+                        _stats['hedge_wins'] += 1
+                return future.result()
+
+        raise error
+    finally:
+        executor.shutdown(wait=False)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Run history: summary of each kerator run stored as one JSON line in config.history_file, and a report comparing
+# the latest run with a rolling baseline of previous runs.
+
+import config
+import json
+import math
+import os
+import time
+from datetime import datetime
+from modules import hedging
+
+# latency histogram buckets grow by this ratio from 1 ms, so percentiles are kept in a fixed amount of memory
+BUCKET_RATIO = 1.25
+BUCKET_START = 0.001
+BUCKET_COUNT = 80
+
+
+def new_histogram():
+    """
+    Creates an empty latency histogram.
+    :return: list of bucket counters
+    """
+    return [0] * BUCKET_COUNT
+
+
+def add_to_histogram(histogram, seconds):
+    """
+    Adds a measured latency to the histogram.
+    :param histogram: list of bucket counters created by new_histogram
+    :param seconds: latency in seconds
+    :return: None
+    """
+    if seconds <= BUCKET_START:
+        bucket = 0
+    else:
+        bucket = min(BUCKET_COUNT - 1, int(math.ceil(math.log(seconds / BUCKET_START, BUCKET_RATIO))))
+    histogram[bucket] += 1
+
+
+def get_percentile(histogram, percentile):
+    """
+    Gets the latency percentile from the histogram. The value is the upper bound of the bucket the percentile
+    falls into, so it's at most BUCKET_RATIO times higher than the exact value.
+    :param histogram: list of bucket counters created by new_histogram
+    :param percentile: percentile from 0 to 100
+    :return: latency in seconds or None, if the histogram is empty
+    """
+    total = sum(histogram)
+    if total == 0:
+        return None
+
+    rank = math.ceil(total * percentile / 100.0)
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if seen >= rank and count > 0:
+            return round(BUCKET_START * BUCKET_RATIO ** bucket, 4)
+
+    return None
+
+
+def new_run():
+    """
+    Creates the state of a run, which collects the statistics of processed documents.
+    :return: dictionary with run statistics
+    """
+    return {'started': time.time(), 'documents': 0, 'failed': 0, 'bytes_uploaded': 0,
+            'errors': {'invalid': 0, 'aleph': 0, 'ker': 0, 'upload': 0, 'other': 0}, 'stages': {},
+            'ker_strategies': {}, 'first_started': None, 'last_finished': None}
+
+
+# stage in which a document failed -> counted error type
+STAGE_ERRORS = {'validate': 'invalid', 'resolve': 'aleph', 'extract': 'ker', 'upload': 'upload'}
+
+
+def record_doc(run, job):
+    """
+    Adds the stage timings and result of a document leaving the pipeline to the run statistics.
+    :param run: run statistics created by new_run
+    :param job: processed DocumentJob
+    :return: None
+    """
+    run['documents'] += 1
+    # the processing time of the run spans from the first document entering the pipeline to the last one leaving it
+    if job.started is not None and (run['first_started'] is None or job.started < run['first_started']):
+        run['first_started'] = job.started
+    run['last_finished'] = time.time()
+
+    for stage, seconds in job.timings.items():
+        if stage not in run['stages']:
+            run['stages'][stage] = new_histogram()
+        add_to_histogram(run['stages'][stage], seconds)
+
+    if job.ker_strategy is not None:
+        run['ker_strategies'][job.ker_strategy] = run['ker_strategies'].get(job.ker_strategy, 0) + 1
+
+    if job.error is not None:
+        run['failed'] += 1
+        run['errors'][STAGE_ERRORS.get(job.failed_stage, 'other')] += 1
+    # only update files sent by the upload stage, not the ones collected in a reprocess batch
+    run['bytes_uploaded'] += job.bytes_uploaded
+
+
+def summarize_run(run):
+    """
+    Creates the summary of a finished run, which is stored in the run history.
+    :param run: run statistics created by new_run
+    :return: summary: dictionary
+    """
+    wall_seconds = time.time() - run['started']
+    # the throughput leaves out the fixed cost of the run (start, scan of the backlog, saving the results)
+    processing_seconds = run['last_finished'] - run['first_started'] if run['first_started'] is not None else 0
+    stages = {}
+    for stage, histogram in run['stages'].items():
+        stages[stage] = {'count': sum(histogram),
+                         'p50': get_percentile(histogram, 50),
+                         'p90': get_percentile(histogram, 90),
+                         'p99': get_percentile(histogram, 99)}
+
+    summary = {'started': datetime.fromtimestamp(run['started']).strftime('%Y-%m-%d %H:%M:%S'),
+               'wall_seconds': round(wall_seconds, 3),
+               'documents': run['documents'],
+               'failed': run['failed'],
+               'processing_seconds': round(processing_seconds, 3),
+               'throughput': round(run['documents'] / processing_seconds * 3600, 2) if processing_seconds > 0 else 0,
+               'bytes_uploaded': run['bytes_uploaded'],
+               'errors': run['errors'],
+               'hedging': hedging.get_stats(),
+               'ker_strategies': run['ker_strategies'],
+               'stages': stages}
+
+    return summary
+
+
+def save_run(summary, history_file=None):
+    """
+    Appends the summary of a run to the run history.
+    :param summary: summary created by summarize_run
+    :param history_file: path to the history file, config.history_file by default
+    :return: None
+    """
+    if history_file is None:
+        history_file = config.history_file
+
+    with open(history_file, mode='a') as f:
+        f.write(json.dumps(summary, sort_keys=True))
+        f.write('\n')
+
+
+def load_runs(history_file=None):
+    """
+    Loads the summaries of previous runs.
+    :param history_file: path to the history file, config.history_file by default
+    :return: list of summaries, oldest first
+    """
+    if history_file is None:
+        history_file = config.history_file
+
+    if not os.path.isfile(history_file):
+        return []
+
+    runs = []
+    with open(history_file) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                runs.append(json.loads(line))
+
+    return runs
+
+
+def median(values):
+    """
+    Gets the median of a list of numbers.
+    :param values: list of numbers
+    :return: median
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def find_regressions(latest, baseline_runs, tolerance, min_documents=0):
+    """
+    Compares the latest run with the median of the baseline runs. Throughput lower or stage latency (p50, p90)
+    higher than the baseline by more than the tolerance is reported as a regression. The throughput of runs with
+    fewer than min_documents documents is not compared, a few documents don't keep the pipeline busy.
+    :param latest: summary of the latest run
+    :param baseline_runs: summaries of the previous runs
+    :param tolerance: allowed relative difference, e.g. 0.25 for 25 %
+    :param min_documents: minimal number of documents of the runs whose throughput is compared
+    :return: list of regression messages
+    """
+    regressions = []
+
+    throughputs = [run['throughput'] for run in baseline_runs if run['documents'] >= max(min_documents, 1)]
+    if latest['documents'] >= min_documents and len(throughputs) > 0:
+        baseline = median(throughputs)
+        if latest['throughput'] < baseline * (1 - tolerance):
+            regressions.append("throughput {} docs/h is lower than baseline {} docs/h".format(latest['throughput'],
+                                                                                              baseline))
+
+    for stage, latencies in latest['stages'].items():
+        for percentile in ('p50', 'p90'):
+            values = [run['stages'][stage][percentile] for run in baseline_runs
+                      if stage in run['stages'] and run['stages'][stage][percentile] is not None]
+            if len(values) == 0 or latencies[percentile] is None:
+                continue
+            baseline = median(values)
+            if latencies[percentile] > baseline * (1 + tolerance):
+                regressions.append("{} {} latency {} s is higher than baseline {} s".format(
+                    stage, percentile, latencies[percentile], baseline))
+
+    return regressions
+
+
+def report(history_file=None):
+    """
+    Prints the latest run and the regressions found by comparing it with the rolling baseline of previous runs.
+    :param history_file: path to the history file, config.history_file by default
+    :return: list of regression messages
+    """
+    runs = [run for run in load_runs(history_file) if run['documents'] > 0]
+    if len(runs) == 0:
+        print("There are no runs in the run history.")
+        return []
+
+    latest = runs[-1]
+    baseline_runs = runs[-config.history_baseline_runs - 1:-1]
+
+    print("Latest run: {started}, {documents} document(s), {failed} failed, {wall_seconds} s, "
+          "{throughput} docs/h, {bytes_uploaded} B uploaded".format(**latest))
+    errors = dict({'invalid': 0}, **latest['errors'])
+    print("Errors: invalid {invalid}, aleph {aleph}, ker {ker}, upload {upload}, other {other}".format(**errors))
+    if 'hedging' in latest:
+        print("KER hedging: {calls} call(s), {hedges} hedge(s), {hedge_wins} won by the hedge".format(
+            **latest['hedging']))
+    for stage, latencies in sorted(latest['stages'].items()):
+        print("{:<10} p50 {} s  p90 {} s  p99 {} s".format(stage, latencies['p50'], latencies['p90'],
+                                                           latencies['p99']))
+
+    if len(baseline_runs) == 0:
+        print("No previous runs to compare with.")
+        return []
+
+    regressions = find_regressions(latest, baseline_runs, config.history_tolerance,
+                                   min_documents=config.history_min_documents)
+    if len(regressions) == 0:
+        print("No regressions against the baseline of {} previous run(s).".format(len(baseline_runs)))
+    for regression in regressions:
+        print("REGRESSION:", regression)
+
+    return regressions
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Offline ISBN -> sysno index built from a bulk export of the Aleph catalogue.
+#
+# The index file is a header followed by fixed size records (13 bytes of ISBN-13, 9 bytes of sysno) sorted
+# by ISBN. It's opened via mmap and searched by bisection, so lookups don't need to load the index into memory.
+
+import config
+import mmap
+import os
+import re
+import struct
+import threading
+
+MAGIC = b'KRISBN01'
+HEADER = struct.Struct('>8sI')
+ISBN_LENGTH = 13
+SYSNO_LENGTH = 9
+RECORD_LENGTH = ISBN_LENGTH + SYSNO_LENGTH
+
+# line of the Aleph sequential format: 000012345 02000 L $$a80-7169-111-1 (váz.)
+ALEPH_SEQ_LINE = re.compile(r'^(\d{9}) 020.. L (.*)$')
+
+_lock = threading.Lock()
+_index = {}
+
+
+def isbn10_to_isbn13(isbn10):
+    """
+    Converts ISBN-10 to ISBN-13 (prefix 978 and new check digit).
+    :param isbn10: ISBN-10 without hyphens
+    :return: ISBN-13
+    """
+    core = '978' + isbn10[:9]
+    total = sum(int(digit) * (1 if position % 2 == 0 else 3) for position, digit in enumerate(core))
+
+    return core + str((10 - total % 10) % 10)
+
+
+def normalize_isbn(isbn):
+    """
+    Normalizes ISBN-10 or ISBN-13 to a 13 digits key. Hyphens, spaces and text following the ISBN
+    (e.g. '(váz.)') are removed.
+    :param isbn: ISBN string
+    :return: ISBN-13 or None, if the string doesn't contain a valid ISBN
+    """
+    if isbn is None:
+        return None
+
+    match = re.match(r'^\s*([0-9][0-9\- ]*[0-9Xx])', isbn)
+    if not match:
+        return None
+
+    digits = re.sub(r'[\- ]', '', match.group(1)).upper()
+
+    if len(digits) == 13 and digits.isdigit():
+        return digits
+    if len(digits) == 10 and digits[:9].isdigit():
+        return isbn10_to_isbn13(digits)
+
+    return None
+
+
+def get_subfields(field_value, separator='$$'):
+    """
+    Splits a field of the Aleph sequential format to subfields.
+    :param field_value: field content, e.g. '$$a80-7169-111-1$$qváz.'
+    :param separator: subfield separator
+    :return: list of tuples (subfield code, value)
+    """
+    return [(part[0], part[1:]) for part in field_value.split(separator) if len(part) > 0]
+
+
+def iter_aleph_sequential(lines):
+    """
+    Yields ISBNs and sysnos from field 020 of an Aleph sequential export.
+    :param lines: iterable of lines of the export
+    :return: generator of tuples (raw ISBN, sysno)
+    """
+    for line in lines:
+        match = ALEPH_SEQ_LINE.match(line.rstrip('\n'))
+        if not match:
+            continue
+        for code, value in get_subfields(match.group(2), separator=config.subfield_prefix):
+            if code == 'a':
+                yield value, match.group(1)
+
+
+def iter_marc(stream):
+    """
+    Yields ISBNs and sysnos (field 001) from field 020 of an ISO 2709 (MARC 21) export.
+    :param stream: binary stream of the export
+    :return: generator of tuples (raw ISBN, sysno)
+    """
+    while True:
+        leader = stream.read(24)
+        if len(leader) < 24:
+            return
+        record_length = int(leader[0:5])
+        base_address = int(leader[12:17])
+        record = leader + stream.read(record_length - 24)
+        directory = record[24:base_address - 1]
+
+        sysno = None
+        isbns = []
+        for position in range(0, len(directory), 12):
+            tag = directory[position:position + 3]
+            length = int(directory[position + 3:position + 7])
+            start = base_address + int(directory[position + 7:position + 12])
+            field = record[start:start + length - 1].decode('utf-8', errors='replace')
+            if tag == b'001':
+                sysno = field.strip().zfill(SYSNO_LENGTH)
+            elif tag == b'020':
+                isbns.extend(subfield[1:] for subfield in field.split('\x1f')[1:] if subfield.startswith('a'))
+
+        if sysno is not None:
+            for isbn in isbns:
+                yield isbn, sysno
+
+
+def build_index(pairs, index_file):
+    """
+    Builds the index file from ISBN and sysno pairs. ISBNs are normalized to ISBN-13, when an ISBN belongs
+    to several records, the lowest sysno is kept. The file is replaced atomically, so running lookups keep
+    using the old index until they reopen it.
+    :param pairs: iterable of tuples (raw ISBN, sysno)
+    :param index_file: path to the index file
+    :return: number of ISBNs in the index
+    """
+    records = set()
+    for isbn, sysno in pairs:
+        key = normalize_isbn(isbn)
+        if key is not None and len(sysno) == SYSNO_LENGTH:
+            records.add((key + sysno).encode('ascii'))
+
+    tmp_file = index_file + '.tmp'
+    count = 0
+    last_key = None
+    with open(tmp_file, mode='wb') as f:
+        f.write(HEADER.pack(MAGIC, 0))
+        for record in sorted(records):
+            if record[:ISBN_LENGTH] == last_key:
+                continue
+            last_key = record[:ISBN_LENGTH]
+            f.write(record)
+            count += 1
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count))
+
+    os.replace(tmp_file, index_file)
+
+    return count
+
+
+def import_export(export_file, index_file, export_format='aleph'):
+    """
+    Imports a bulk export of the catalogue into the index file.
+    :param export_file: path to the export
+    :param index_file: path to the index file
+    :param export_format: 'aleph' for the Aleph sequential format, 'marc' for ISO 2709
+    :return: number of ISBNs in the index
+    """
+    if export_format == 'aleph':
+        with open(export_file, encoding='utf-8', errors='replace') as f:
+            return build_index(iter_aleph_sequential(f), index_file)
+    elif export_format == 'marc':
+        with open(export_file, mode='rb') as f:
+            return build_index(iter_marc(f), index_file)
+    else:
+        raise ValueError("Invalid export format {}. Should be 'aleph' or 'marc' only".format(export_format))
+
+
+def open_index(index_file):
+    """
+    Opens the index file via mmap.
+    :param index_file: path to the index file
+    :return: tuple (mmap, number of records) or None, if the index file doesn't exist or is empty
+    """
+    if not os.path.isfile(index_file) or os.path.getsize(index_file) <= HEADER.size:
+        return None
+
+    with open(index_file, mode='rb') as f:
+        index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, count = HEADER.unpack_from(index_map)
+    if magic != MAGIC:
+        index_map.close()
+        raise IOError("File {} is not an ISBN index".format(index_file))
+
+    return index_map, count
+
+
+def search(index, isbn13):
+    """
+    Searches the sysno of an ISBN-13 in the open index.
+    :param index: tuple returned by open_index
+    :param isbn13: normalized ISBN
+    :return: sysno or None
+    """
+    index_map, count = index
+    key = isbn13.encode('ascii')
+    low, high = 0, count
+
+    while low < high:
+        middle = (low + high) // 2
+        start = HEADER.size + middle * RECORD_LENGTH
+        current = index_map[start:start + ISBN_LENGTH]
+        if current < key:
+            low = middle + 1
+        elif current > key:
+            high = middle
+        else:
+            return index_map[start + ISBN_LENGTH:start + RECORD_LENGTH].decode('ascii')
+
+    return None
+
+
+def lookup(isbn, index_file=None):
+    """
+    Looks up the sysno of the document by its ISBN in the offline index.
+    :param isbn: ISBN-10 or ISBN-13 of the document
+    :param index_file: path to the index file, config.isbn_index_file by default
+    :return: sysno or None, if the index doesn't exist or the ISBN is not in the index
+    """
+    if index_file is None:
+        index_file = getattr(config, 'isbn_index_file', None)
+    if index_file is None:
+        return None
+
+    isbn13 = normalize_isbn(isbn)
+    if isbn13 is None:
+        return None
+
+    with _lock:
+        if index_file not in _index:
+            _index[index_file] = open_index(index_file)
+        index = _index[index_file]
+
+    if index is None:
+        return None
+
+    return search(index, isbn13)
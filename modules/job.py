@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+class DocumentJob(object):
+    """
+    Record of one document passed through the processing stages. Every stage fills in its results, so the whole
+    state of the document travels in one small object instead of local lists and return values. __slots__ keep
+    the footprint small when many documents wait in the pipeline queues.
+    """
+    __slots__ = ('path', 'isbn', 'sysno', 'record_fields', 'toc_xml_files', 'toc_txt_files', 'duplicate_pages',
+                 'toc_location', 'keywords', 'toc_lines', 'update_file', 'pages', 'started', 'deadline', 'timings',
+                 'ker_strategy', 'redo', 'error', 'failed_stage', 'trace', 'bytes_uploaded')
+
+    def __init__(self, path):
+        self.path = path            # path to the document directory
+        self.isbn = None            # ISBN parsed from the directory name
+        self.sysno = None           # system number of the document record in Aleph
+        self.record_fields = None   # current keyword and TOC fields of the record, None when not fetched
+        self.toc_xml_files = None   # list of XML (ALTO) TOC pages
+        self.toc_txt_files = None   # list of TXT TOC pages
+        self.duplicate_pages = {}   # name of a removed duplicate TOC page -> name of the kept page
+        self.toc_location = None    # XML file, ZIP archive or text file sent to KER
+        self.ker_strategy = None    # how the pages were sent to KER: whole, subset, split or stored scores
+        self.keywords = None        # best keywords selected from the KER response
+        self.toc_lines = None       # normalized TOC lines
+        self.update_file = None     # path to the created Aleph update file, None when the record is unchanged
+        self.bytes_uploaded = 0     # bytes of the update file sent to the Aleph server
+        self.pages = 0              # number of TOC pages, used by the scheduler
+        self.started = None         # time the document entered the pipeline
+        self.deadline = None        # time by which the document has to be processed
+        self.timings = {}           # stage name -> duration in seconds
+        self.redo = None            # reprocessing: stages not using cached artifacts; None for waiting documents
+        self.error = None           # exception which stopped the processing
+        self.failed_stage = None    # name of the stage which raised the error
+        self.trace = None           # root span of the document trace, None when tracing is disabled
+
+    def __repr__(self):
+        return '<DocumentJob {} sysno={} error={!r}>'.format(self.path, self.sysno, self.error)
@@ -1,21 +1,30 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from modules import utility
+import config
+import json
 import os
+import re
 
+# TODO: There will be a function for getting a language from processed document
+KER_LANGUAGES = ['cs', 'en']    # which languages will be requested? # TODO:
 
-def get_keywords(toc_xml_location):
+
+def get_keywords(toc_xml_location, deadline=None):
     """
     Gets keywords from XML TOC files by calling utility function send_ker_request and returning the responses.
     :param toc_xml_location: path to the XML TOC file or ZIP file containing multiple XML TOC files
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
     :return: responses: list of responses returned by send_ker_function
     """
     # GETTING KEYWORDS
     print("Getting keywords from TOC files...")
-    # TODO: There will be a function for getting a language from processed document
-    languages = ['cs', 'en']    # which languages will be requested? # TODO:
+    languages = KER_LANGUAGES
 
-    responses = utility.send_ker_request(languages=languages, file=toc_xml_location, threshold=0.2, max_words=15)
+    # the request asks for a superset of the keywords, the selection is done by select_keywords
+    responses = utility.send_ker_request(languages=languages, file=toc_xml_location,
+                                         threshold=config.ker_request_threshold,
+                                         max_words=config.ker_request_max_words, deadline=deadline)
     print("Finished getting keywords from TOC files...")
 
     return responses
@@ -42,6 +51,149 @@ def map_keywords_to_scores(lang_response_dict):
     return keyword_map
 
 
+def get_scores_file(doc_path):
+    """
+    Gets the path to the file with all keywords and scores returned by KER for the document.
+    :param doc_path: path to the document directory
+    :return: path to the scores file
+    """
+    return os.path.join(doc_path, config.ker_scores_file)
+
+
+def get_pages_signature(toc_files):
+    """
+    Gets the signature of TOC pages sent to KER: names, sizes and modification times of the files.
+    :param toc_files: list of XML TOC pages
+    :return: list of [name, size, modification time]
+    """
+    signature = []
+    for toc_file in sorted(toc_files):
+        stat = os.stat(toc_file)
+        signature.append([os.path.basename(toc_file), stat.st_size, int(stat.st_mtime)])
+
+    return signature
+
+
+def get_request_params():
+    """
+    Gets the parameters of the KER request the stored scores are valid for.
+    :return: dictionary of the request parameters
+    """
+    params = {'threshold': config.ker_request_threshold, 'max_words': config.ker_request_max_words,
+              'plain_text': config.ker_send_plain_text,
+              'budget': [config.ker_budget_pages, config.ker_budget_bytes, config.ker_budget_strategy]}
+    # without a label, the scores stored by earlier versions stay valid
+    if config.ker_model is not None:
+        params['model'] = config.ker_model
+
+    return params
+
+
+def load_scored_keywords(doc_path, toc_files=None):
+    """
+    Loads keywords and scores stored by an earlier run. They are used only when they were returned for the same
+    TOC pages and the same KER request parameters.
+    :param doc_path: path to the document directory
+    :param toc_files: list of XML TOC pages of the document, or None to not check the pages
+    :return: dictionary of keywords with mapped scores for each language or None, if there are no usable scores
+    """
+    try:
+        with open(get_scores_file(doc_path), encoding='utf-8') as f:
+            stored = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if not isinstance(stored, dict) or stored.get('request') != get_request_params():
+        return None
+    if toc_files is not None and stored.get('pages') != get_pages_signature(toc_files):
+        return None
+
+    return {lang: dict((keyword, score) for keyword, score in scored)
+            for lang, scored in stored.get('keywords', {}).items()}
+
+
+def save_scored_keywords(doc_path, toc_files, mapped_keywords):
+    """
+    Stores all keywords and scores returned by KER in the document directory, so the keywords can be selected
+    again with another threshold or number of keywords without calling KER. The file is replaced atomically.
+    :param doc_path: path to the document directory
+    :param toc_files: list of XML TOC pages of the document
+    :param mapped_keywords: dictionary of keywords with mapped scores for each language
+    :return: path to the scores file
+    """
+    scores_file = get_scores_file(doc_path)
+    stored = {'request': get_request_params(),
+              'pages': get_pages_signature(toc_files),
+              'keywords': {lang: [[keyword, score] for keyword, score in scored.items()]
+                           for lang, scored in mapped_keywords.items()}}
+
+    tmp_file = scores_file + '.tmp'
+    with open(tmp_file, mode='w', encoding='utf-8') as f:
+        json.dump(stored, f, ensure_ascii=False)
+    os.replace(tmp_file, scores_file)
+
+    return scores_file
+
+
+def get_profile(doc_path, name=None):
+    """
+    Gets the keyword selection profile of the document: the named profile, otherwise the profile of the first rule
+    of config.keyword_profile_rules matching the document directory name, otherwise config.keyword_profile.
+    :param doc_path: path to the document directory
+    :param name: name of a profile in config.keyword_profiles or None
+    :return: dictionary with 'threshold' and 'max_words' of the profile
+    """
+    if name is None:
+        name = config.keyword_profile
+        for pattern, rule_profile in config.keyword_profile_rules:
+            if re.search(pattern, os.path.basename(os.path.normpath(doc_path))):
+                name = rule_profile
+                break
+
+    try:
+        return config.keyword_profiles[name]
+    except KeyError:
+        raise ValueError("Unknown keyword profile {}".format(name))
+
+
+def merge_scored_keywords(chunk_keywords):
+    """
+    Merges keywords and scores returned by KER for chunks of the TOC pages. A keyword found in several chunks keeps
+    its highest score, so the scores stay comparable with the scores of documents sent in one request.
+    :param chunk_keywords: list of dictionaries of keywords with mapped scores for each language, one per chunk
+    :return: dictionary of keywords with mapped scores for each language, ordered by score
+    """
+    merged = {}
+    for mapped_keywords in chunk_keywords:
+        for lang, scored in mapped_keywords.items():
+            merged_lang = merged.setdefault(lang, {})
+            for keyword, score in scored.items():
+                if keyword not in merged_lang or score > merged_lang[keyword]:
+                    merged_lang[keyword] = score
+
+    return {lang: dict(sorted(scored.items(), key=lambda item: item[1], reverse=True))
+            for lang, scored in merged.items()}
+
+
+def select_keywords(mapped_keywords, threshold, max_words):
+    """
+    Selects keywords of each language locally, the way KER does for the request parameters: keywords with score
+    of at least 'threshold', at most 'max_words' of them with the highest scores.
+    :param mapped_keywords: dictionary of keywords with mapped scores for each language
+    :param threshold: minimal score of a keyword
+    :param max_words: maximum number of keywords of each language
+    :return: dictionary of selected keywords with mapped scores for each language, ordered by score
+    """
+    selected = {}
+    for lang, scored in mapped_keywords.items():
+        # sorted is stable, keywords with equal scores keep the order returned by KER
+        ranked = sorted([(keyword, score) for keyword, score in scored.items() if score >= threshold],
+                        key=lambda item: item[1], reverse=True)
+        selected[lang] = dict(ranked[:max_words])
+
+    return selected
+
+
 def get_score_averages(keyword_score_dict):
     """
     Gets score averages of all keywords in a given language.
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# KER payload budget. KER latency grows faster than the size of its input, so documents with many TOC pages
+# (proceedings volumes) are not sent in one request: either a representative subset of the pages within the budget
+# is sent, or the pages are split into chunks within the budget, sent in parallel requests, and the scored keywords
+# of the chunks are merged (keywords.merge_scored_keywords).
+
+import config
+import os
+from modules import alto
+
+# strategies recorded for each document
+WHOLE = 'whole'
+SUBSET = 'subset'
+SPLIT = 'split'
+
+
+def get_page_size(toc_file):
+    """
+    Gets the size of a TOC page in the payload sent to KER: the size of its text when the text of the pages is sent
+    (config.ker_send_plain_text), otherwise the size of the XML page. A ZIP archive of several XML pages is
+    compressed, so their size is an upper bound of its size.
+    :param toc_file: XML TOC page
+    :return: size in bytes
+    """
+    if config.ker_send_plain_text:
+        # the same lines as alto.write_alto_text writes, each one ended by a newline
+        return sum(len(line.encode('utf-8')) + 1 for line in alto.iter_alto_lines(toc_file))
+
+    return os.path.getsize(toc_file)
+
+
+def get_page_sizes(toc_files):
+    """
+    Gets the sizes of the TOC pages in the payload sent to KER, see get_page_size.
+    :param toc_files: list of XML TOC pages
+    :return: dictionary of sizes in bytes by page
+    """
+    return dict((toc_file, get_page_size(toc_file)) for toc_file in toc_files)
+
+
+def fits_budget(toc_files, max_pages=None, max_bytes=None, sizes=None):
+    """
+    Checks whether the TOC pages fit the payload budget. A limit set to None is not checked.
+    :param toc_files: list of XML TOC pages
+    :param max_pages: maximum number of pages, config.ker_budget_pages by default
+    :param max_bytes: maximum size of the payload in bytes, config.ker_budget_bytes by default
+    :param sizes: sizes of the pages returned by get_page_sizes, measured when None
+    :return: True if the pages fit the budget
+    """
+    max_pages = config.ker_budget_pages if max_pages is None else max_pages
+    max_bytes = config.ker_budget_bytes if max_bytes is None else max_bytes
+
+    if max_pages is not None and len(toc_files) > max_pages:
+        return False
+    if max_bytes is not None:
+        sizes = get_page_sizes(toc_files) if sizes is None else sizes
+        if sum(sizes[toc_file] for toc_file in toc_files) > max_bytes:
+            return False
+
+    return True
+
+
+def select_subset(toc_files, max_pages=None, max_bytes=None, sizes=None):
+    """
+    Selects a representative subset of the TOC pages within the budget: pages spread evenly over the whole TOC,
+    always including the first and the last one, so every part of the volume is represented.
+    :param toc_files: list of XML TOC pages in page order
+    :param max_pages: maximum number of pages, config.ker_budget_pages by default
+    :param max_bytes: maximum size of the payload in bytes, config.ker_budget_bytes by default
+    :param sizes: sizes of the pages returned by get_page_sizes, measured when None
+    :return: list of selected pages in page order, at least one page
+    """
+    max_pages = config.ker_budget_pages if max_pages is None else max_pages
+    max_bytes = config.ker_budget_bytes if max_bytes is None else max_bytes
+    if max_bytes is not None and sizes is None:
+        sizes = get_page_sizes(toc_files)
+
+    count = len(toc_files) if max_pages is None else min(len(toc_files), max_pages)
+    while count > 1:
+        step = (len(toc_files) - 1) / float(count - 1)
+        subset = [toc_files[int(round(i * step))] for i in range(count)]
+        if fits_budget(subset, max_pages=max_pages, max_bytes=max_bytes, sizes=sizes):
+            return subset
+        count -= 1
+
+    return toc_files[:1]
+
+
+def split_pages(toc_files, max_pages=None, max_bytes=None, sizes=None):
+    """
+    Splits the TOC pages into consecutive chunks within the budget. A page bigger than the byte budget
+    makes a chunk of its own.
+    :param toc_files: list of XML TOC pages in page order
+    :param max_pages: maximum number of pages of a chunk, config.ker_budget_pages by default
+    :param max_bytes: maximum size of the payload of a chunk in bytes, config.ker_budget_bytes by default
+    :param sizes: sizes of the pages returned by get_page_sizes, measured when None
+    :return: list of chunks (lists of pages)
+    """
+    max_pages = config.ker_budget_pages if max_pages is None else max_pages
+    max_bytes = config.ker_budget_bytes if max_bytes is None else max_bytes
+    if max_bytes is not None and sizes is None:
+        sizes = get_page_sizes(toc_files)
+
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for toc_file in toc_files:
+        size = sizes[toc_file] if max_bytes is not None else 0
+        full = (max_pages is not None and len(chunk) >= max_pages) or \
+               (max_bytes is not None and chunk_bytes + size > max_bytes)
+        if len(chunk) > 0 and full:
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(toc_file)
+        chunk_bytes += size
+
+    if len(chunk) > 0:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def plan_payload(toc_files, strategy=None):
+    """
+    Plans the KER requests of a document.
+    :param toc_files: list of XML TOC pages in page order
+    :param strategy: SUBSET or SPLIT for documents over the budget, config.ker_budget_strategy by default
+    :return: tuple (strategy used, list of chunks of pages, one request per chunk)
+    """
+    # each page is measured once, the text of ALTO pages has to be extracted to be measured
+    sizes = get_page_sizes(toc_files) if config.ker_budget_bytes is not None else None
+    if fits_budget(toc_files, sizes=sizes):
+        return WHOLE, [toc_files]
+
+    strategy = strategy or config.ker_budget_strategy
+    if strategy == SUBSET:
+        return SUBSET, [select_subset(toc_files, sizes=sizes)]
+    if strategy == SPLIT:
+        return SPLIT, split_pages(toc_files, sizes=sizes)
+
+    raise ValueError("Invalid KER budget strategy {}. Should be '{}' or '{}' only".format(strategy, SUBSET, SPLIT))
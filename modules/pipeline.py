@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Streaming document pipeline: scan -> dedupe -> gather -> write -> upload. The gather stage runs the Aleph lookup
+# (resolve), KER extraction (extract) and TOC normalization (normalize) of a document concurrently.
+#
+# Every stage runs in its own thread(s) and passes the documents to the next stage through a bounded queue.
+# When a stage falls behind, the queue in front of it fills up and the stages before it block (backpressure),
+# so only a fixed number of documents is in the processing stages at any time, regardless of the size of the backlog.
+# The scan stage is the exception: to order the documents by priority it validates the whole backlog first and keeps
+# the path and page count of every valid document, then validates each document again when it's yielded.
+
+import config
+import os
+import queue
+import threading
+import time
+from modules import executor
+from modules import history
+from modules import quarantine
+from modules import scheduler
+from modules import tracing
+from modules import workflow
+from modules.errors import InvalidDocument
+from modules.job import DocumentJob
+
+# marks the end of the document stream in a queue
+_END = object()
+
+
+def scan_docs(dirs, costs, deadline=None, redo=None):
+    """
+    SCAN stage: validates the documents and yields a DocumentJob for each valid one in order of priority until
+    the batch window closes. Documents in quarantine are skipped. Invalid documents are yielded first, already
+    failed, so they pass the network stages untouched and are only reported.
+    :param dirs: iterable of document directories
+    :param costs: cost model returned by scheduler.load_costs
+    :param deadline: timestamp of the end of the batch window or None
+    :param redo: reprocessing of finished documents: set of stages not using cached artifacts (job.redo), or None
+    :return: generator of DocumentJob records
+    """
+    valid_dirs = []
+    quarantined = 0
+    for path in dirs:
+        if quarantine.is_quarantined(path):
+            quarantined += 1
+            continue
+        job = validate_job(DocumentJob(path))
+        if job.error is not None:
+            job.trace = start_trace(job)
+            yield job
+        else:
+            valid_dirs.append((path, job.pages))
+
+    if quarantined > 0:
+        print("Skipping {} document(s) in quarantine.".format(quarantined))
+    schedule = scheduler.order_dirs(valid_dirs)
+
+    for position, (path, pages) in enumerate(schedule):
+        if not scheduler.fits_deadline(deadline, scheduler.estimate_cost(costs, pages)):
+            print("Batch window is closing, {} document(s) left for the next run.".format(len(schedule) - position))
+            return
+        # the TOC inventory is taken again, only paths and page counts are kept for the whole backlog
+        job = DocumentJob(path)
+        job.redo = redo
+        job.trace = start_trace(job)
+        job = validate_job(job)
+        job.deadline = job.started + config.document_deadline
+        yield job
+
+
+def validate_job(job):
+    """
+    Runs the VALIDATE stage on the job and records its result.
+    :param job: DocumentJob of the scanned document
+    :return: job
+    """
+    job.started = time.time()
+    try:
+        with tracing.span('validate', parent=job.trace):
+            workflow.validate_doc(job)
+    except InvalidDocument as e:
+        job.error = e
+        job.failed_stage = 'validate'
+    finally:
+        job.timings['validate'] = time.time() - job.started
+
+    return job
+
+
+def start_trace(job):
+    """
+    Starts the trace of the document, it ends when the document leaves the pipeline.
+    :param job: DocumentJob of the scanned document
+    :return: root span of the trace or None, if tracing is disabled
+    """
+    return tracing.start_trace('document', {'document.name': os.path.basename(job.path)}, start=job.started)
+
+
+def end_trace(job):
+    """
+    Ends the trace of the document leaving the pipeline and exports it.
+    :param job: processed DocumentJob
+    :return: None
+    """
+    tracing.end_trace(job.trace, error=job.error,
+                      attributes={'document.pages': job.pages, 'aleph.sysno': job.sysno,
+                                  'document.failed_stage': job.failed_stage, 'ker.strategy': job.ker_strategy,
+                                  'document.duplicate_pages': len(job.duplicate_pages)})
+
+
+def get_stage_name(stage):
+    """
+    Gets the name of the stage from its function name (resolve_doc -> resolve).
+    :param stage: stage function
+    :return: name of the stage
+    """
+    return stage.__name__.replace('_doc', '')
+
+
+def get_processing_seconds(job):
+    """
+    Gets the processing time of the document: the sum of the times of its stages, without the time it waited
+    in the queues. The stages run by the gather stage are already part of its time.
+    :param job: processed DocumentJob
+    :return: processing time in seconds
+    """
+    gather_stages = [get_stage_name(stage) for stage in workflow.GATHER_STAGES]
+
+    return sum(seconds for stage, seconds in job.timings.items() if stage not in gather_stages)
+
+
+def _stage_worker(stage, inbox, outbox, remaining, lock, downstream_workers):
+    """
+    Runs the stage function on each job from the inbox and passes the job to the outbox. Documents which
+    failed in one of the previous stages are passed through untouched. The last worker of the stage to finish
+    sends the end marker to each worker of the next stage.
+    """
+    name = get_stage_name(stage)
+
+    while True:
+        job = inbox.get()
+        if job is _END:
+            break
+        if job.error is None:
+            started = time.time()
+            try:
+                with tracing.span(name, parent=job.trace):
+                    stage(job)
+            except Exception as e:
+                job.error = e
+                # a stage running sub-stages (gather) reports which of them failed
+                if job.failed_stage is None:
+                    job.failed_stage = name
+            finally:
+                job.timings[name] = time.time() - started
+        outbox.put(job)
+
+    with lock:
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            for i in range(downstream_workers):
+                outbox.put(_END)
+
+
+def _feed(jobs, outbox, downstream_workers):
+    """
+    Puts jobs from a generator to the first queue of the pipeline, blocking while the queue is full.
+    """
+    try:
+        for job in jobs:
+            outbox.put(job)
+    finally:
+        for i in range(downstream_workers):
+            outbox.put(_END)
+
+
+def run_stages(jobs, stages):
+    """
+    Runs the jobs through the stages connected by bounded queues.
+    :param jobs: iterable of DocumentJob records
+    :param stages: list of tuples (stage function, number of worker threads)
+    :return: generator of processed DocumentJob records, in order of completion
+    """
+    queue_size = config.pipeline_queue_size
+    queues = [queue.Queue(maxsize=queue_size) for i in range(len(stages) + 1)]
+    threads = [threading.Thread(target=_feed, args=(jobs, queues[0], stages[0][1]), daemon=True)]
+
+    for position, (stage, workers) in enumerate(stages):
+        downstream_workers = stages[position + 1][1] if position + 1 < len(stages) else 1
+        remaining = [workers]
+        lock = threading.Lock()
+        for i in range(workers):
+            threads.append(threading.Thread(target=_stage_worker,
+                                            args=(stage, queues[position], queues[position + 1], remaining, lock,
+                                                  downstream_workers),
+                                            daemon=True))
+
+    for thread in threads:
+        thread.start()
+
+    while True:
+        job = queues[-1].get()
+        if job is _END:
+            break
+        yield job
+
+    for thread in threads:
+        thread.join()
+
+
+def make_upload_stage():
+    """
+    Creates the UPLOAD stage. The SFTP connection to the Aleph server is opened with the first update file,
+    so runs which produce no update file never connect.
+    :return: tuple (stage function, function closing the connection)
+    """
+    session = {}
+
+    def upload_doc(job):
+        if job.update_file is None:
+            # the record is unchanged, there is nothing to upload
+            return
+        if 'sftp' not in session:
+            # paramiko (and cryptography with it) is imported only when there is something to upload
+            from modules import ssh
+            print("Opening connection to remote host", config.aleph_server)
+            client = ssh.create_ssh_client(server=config.aleph_server, user=config.aleph_user)
+            session['sftp'] = client.open_sftp()
+            session['sftp'].get_channel().settimeout(config.ssh_timeout)
+            session['sftp'].chdir(config.update_dir_location)
+        workflow.upload_update_file(session['sftp'], job.update_file)
+        job.bytes_uploaded = os.path.getsize(job.update_file)
+
+    def close():
+        if 'sftp' in session:
+            print("Closing connection to remote host", config.aleph_server)
+            session.pop('sftp').close()
+            print("Connection closed.")
+
+    return upload_doc, close
+
+
+def report_job(job, counters, costs, run_stats, upload):
+    """
+    Reports a document leaving the pipeline: updates the cost model (with processed documents only, failed ones
+    would make the estimates too low), run statistics and counters, ends its trace and records or clears its
+    failure.
+    :param job: processed DocumentJob
+    :param counters: dictionary with number of processed, failed, uploaded and unchanged documents
+    :param costs: cost model returned by scheduler.load_costs
+    :param run_stats: run statistics created by history.new_run
+    :param upload: True if the update files are uploaded
+    :return: None
+    """
+    name = os.path.basename(job.path)
+    if job.error is None:
+        scheduler.update_costs(costs, get_processing_seconds(job), job.pages)
+    history.record_doc(run_stats, job)
+    end_trace(job)
+    counters['processed'] += 1
+    if job.error is not None:
+        counters['failed'] += 1
+        failure = quarantine.record_failure(job.path, job.error)
+        print("Error:", job.error)
+        if failure['retry_after'] is None:
+            print(name, ": processing finished with errors ({}), the document is quarantined".format(
+                failure['class']))
+        else:
+            retry = time.strftime('%Y-%m-%d %H:%M', time.localtime(failure['retry_after']))
+            print(name, ": processing finished with errors ({}), the document will be retried after {}".format(
+                failure['class'], retry))
+    else:
+        quarantine.clear_failure(job.path)
+        if job.update_file is None:
+            counters['unchanged'] += 1
+        elif upload:
+            counters['uploaded'] += 1
+        print(name, ": processing finished successfully")
+
+
+def finish_run(costs, run_stats):
+    """
+    Stops the worker processes and saves the cost model, traces and run statistics at the end of a run.
+    :param costs: cost model returned by scheduler.load_costs
+    :param run_stats: run statistics created by history.new_run
+    :return: None
+    """
+    executor.shutdown()
+    tracing.flush()
+    scheduler.save_costs(costs)
+    history.save_run(history.summarize_run(run_stats))
+
+
+def run(dirs, deadline=None, upload=True, redo=None, upload_stage=None):
+    """
+    Processes the documents through the streaming pipeline and reports each one as soon as it leaves the pipeline.
+    :param dirs: iterable of document directories
+    :param deadline: timestamp of the end of the batch window or None
+    :param upload: if True, created update files are uploaded to the Aleph server
+    :param redo: reprocessing of finished documents: set of stages not using cached artifacts (job.redo), or None
+    :param upload_stage: tuple (stage function, function closing it) used instead of make_upload_stage, e.g.
+    the update batch of reprocess.make_batch_stage
+    :return: counters: dictionary with number of processed, failed, uploaded and unchanged documents
+    """
+    workers = config.pipeline_workers
+    stages = [(workflow.dedupe_doc, workers['dedupe']),
+              (workflow.gather_doc, workers['gather']),
+              (workflow.write_doc, workers['write'])]
+    close = None
+    if upload:
+        upload_doc, close = upload_stage or make_upload_stage()
+        # a single SFTP session is not thread safe, upload always runs in one thread
+        stages.append((upload_doc, 1))
+
+    counters = {'processed': 0, 'failed': 0, 'uploaded': 0, 'unchanged': 0}
+    costs = scheduler.load_costs()
+    run_stats = history.new_run()
+
+    try:
+        for job in run_stages(scan_docs(dirs, costs, deadline, redo=redo), stages):
+            report_job(job, counters, costs, run_stats, upload)
+    finally:
+        if close is not None:
+            close()
+        finish_run(costs, run_stats)
+
+    return counters
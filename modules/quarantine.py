@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Failure quarantine: a failed document gets a state file (config.failure_state) with the class of its failure
+# and the number of failed attempts. The document is skipped by the following runs until its backoff
+# (config.quarantine_backoff of the class, doubled with each further failure) passes. Classes without a backoff
+# are quarantined until the state file is removed (kerator.py quarantine --release).
+
+import config
+import json
+import os
+import re
+import time
+
+
+def classify_error(error):
+    """
+    Gets the failure class of the error which stopped the processing of a document.
+    :param error: exception stored in DocumentJob.error
+    :return: failure class: key of config.quarantine_backoff
+    """
+    failure_class = getattr(error, 'failure_class', None)
+    if failure_class is not None:
+        return failure_class
+
+    # the network libraries are imported lazily, their errors are recognized by the module they come from
+    if type(error).__module__.split('.')[0] in ('requests', 'urllib3', 'paramiko', 'socket', 'aiohttp', 'asyncssh'):
+        return 'network'
+
+    return 'other'
+
+
+def load_failure(path):
+    """
+    Loads the failure record of the document.
+    :param path: path to a document directory
+    :return: dictionary with failure class, number of attempts, time of the last failure, time after which the
+    document can be retried (None for permanent failures) and the error message, or None if the document didn't fail
+    """
+    try:
+        with open(os.path.join(path, config.failure_state)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def get_attempts(path):
+    """
+    Gets the number of failed processing attempts of the document.
+    :param path: path to a document directory
+    :return: number of failed attempts
+    """
+    failure = load_failure(path)
+
+    return failure['attempts'] if failure is not None else 0
+
+
+def get_backoff(failure_class, attempts):
+    """
+    Gets the time for which a document is quarantined after its attempt failed.
+    :param failure_class: failure class returned by classify_error
+    :param attempts: number of failed attempts including the last one
+    :return: backoff in seconds or None for a permanent failure
+    """
+    backoff = config.quarantine_backoff.get(failure_class, config.quarantine_backoff['other'])
+    if backoff is None:
+        return None
+
+    return min(backoff * 2 ** (attempts - 1), config.quarantine_max_backoff)
+
+
+def record_failure(path, error, now=None):
+    """
+    Records a failed attempt of the document and puts it to quarantine.
+    :param path: path to a document directory
+    :param error: exception which stopped the processing
+    :param now: time of the failure (time.time() timestamp)
+    :return: the stored failure record
+    """
+    if now is None:
+        now = time.time()
+
+    failure_class = classify_error(error)
+    attempts = get_attempts(path) + 1
+    backoff = get_backoff(failure_class, attempts)
+    failure = {'class': failure_class,
+               'attempts': attempts,
+               'last_failure': now,
+               'retry_after': now + backoff if backoff is not None else None,
+               'error': str(error)}
+
+    with open(os.path.join(path, config.failure_state), mode='w') as f:
+        json.dump(failure, f)
+
+    return failure
+
+
+def clear_failure(path):
+    """
+    Removes the failure record of the document, e.g. after it was processed successfully.
+    :param path: path to a document directory
+    :return: True if the document had a failure record
+    """
+    try:
+        os.remove(os.path.join(path, config.failure_state))
+        return True
+    except OSError:
+        return False
+
+
+def is_quarantined(path, now=None):
+    """
+    Checks whether the document should be skipped by the scan.
+    :param path: path to a document directory
+    :param now: current time (time.time() timestamp)
+    :return: bool (True/False)
+    """
+    failure = load_failure(path)
+    if failure is None:
+        return False
+    if failure['retry_after'] is None:
+        return True
+
+    return failure['retry_after'] > (now if now is not None else time.time())
+
+
+def iter_quarantine(path):
+    """
+    Yields failure records of documents in the OBSAHATOR's directory.
+    :param path: path to the digitized TOC root folder
+    :return: generator of tuples (path to a document directory, failure record)
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not re.match('DONE_', entry.name):
+                continue
+            failure = load_failure(entry.path)
+            if failure is not None:
+                yield entry.path, failure
+
+
+def report(path, now=None):
+    """
+    Prints documents with failure records: their failure class, attempts and the time of the next retry.
+    :param path: path to the digitized TOC root folder
+    :param now: current time (time.time() timestamp)
+    :return: number of documents in quarantine
+    """
+    if now is None:
+        now = time.time()
+
+    quarantined = 0
+    for doc_path, failure in sorted(iter_quarantine(path)):
+        if failure['retry_after'] is None:
+            retry = 'never'
+        elif failure['retry_after'] <= now:
+            retry = 'next run'
+        else:
+            retry = time.strftime('%Y-%m-%d %H:%M', time.localtime(failure['retry_after']))
+        if retry != 'next run':
+            quarantined += 1
+        print("{:<40} {:<10} {:>3} attempt(s)  retry: {:<16} {}".format(os.path.basename(doc_path), failure['class'],
+                                                                        failure['attempts'], retry, failure['error']))
+
+    print("{} document(s) in quarantine.".format(quarantined))
+
+    return quarantined
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import re
+from collections import deque
+from modules import tracing
 
 
 def strip_from_string(original_string, strip_string, mode):
@@ -232,11 +235,13 @@ def connect_missing(current_line, processed_lines, maximum_range):
         return None
 
 
-def get_toc_list(lines):
+def iter_toc_lines(lines):
     """
-    Gets TOC of the document in a form of a list of normalized and readable TOC lines from TOC pages of the document.
-    :param lines: list of TOC lines in a form of raw strings read from OCR result of the TOC page.
-    :return: preprocessed_toc: TOC of the document in a form of list of normalized and readable TOC lines
+    Yields normalized and readable TOC lines from raw lines of a TOC page of the document. Only the last few
+    normalized lines are kept for connecting multi-line chapter names, so the lines may come straight from
+    an open file.
+    :param lines: iterable of TOC lines in a form of raw strings read from OCR result of the TOC page.
+    :return: generator of normalized and readable TOC lines
     """
     # maybe some kind of regular expression matching?
     # rules:
@@ -248,8 +253,9 @@ def get_toc_list(lines):
     #       -> everything that is not an alphanumeric character or whitespace has to be stripped from the string
     #       -> everything that is less than 3 characters long and/or is not beginning on a number or capital character
     #       has to be stripped from the string
-    preprocessed_toc = []
-    normalized_lines = []
+    maximum_range = 4
+    # connect_missing looks at most maximum_range lines back
+    normalized_lines = deque(maxlen=maximum_range)
 
     for line in lines:
         if not re.match("\n", line):
@@ -258,7 +264,7 @@ def get_toc_list(lines):
             normalized_lines.append(current_line)
 
             preprocessed_line = connect_missing(current_line=current_line, processed_lines=normalized_lines,
-                                                maximum_range=4)
+                                                maximum_range=maximum_range)
 
             if preprocessed_line is None:
                 pass
@@ -269,13 +275,46 @@ def get_toc_list(lines):
                 if re.match("\d+", preprocessed_line):
                     continue
 
-                preprocessed_toc.append(line_no_pn)
+                yield line_no_pn
         else:
             pass
 
+
+def get_toc_list(lines):
+    """
+    Gets TOC of the document in a form of a list of normalized and readable TOC lines from TOC pages of the document.
+    :param lines: list of TOC lines in a form of raw strings read from OCR result of the TOC page.
+    :return: preprocessed_toc: TOC of the document in a form of list of normalized and readable TOC lines
+    """
+    preprocessed_toc = list(iter_toc_lines(lines))
+
     return preprocessed_toc
 
 
+def get_page_toc_list(txt_toc_file):
+    """
+    Gets the normalized TOC lines of one TOC page.
+    :param txt_toc_file: path to the TOC page in .txt format
+    :return: list of normalized TOC lines
+    """
+    with tracing.span('raw_toc.read', **{'file.path': txt_toc_file}) as span:
+        with open(txt_toc_file, 'r') as f:
+            span.set_attribute('file.size', os.fstat(f.fileno()).st_size)
+            toc_list = get_toc_list(f)
+        span.set_attribute('toc.lines', len(toc_list))
+        return toc_list
+
+
+def iter_raw_toc_contents(txt_toc_list):
+    """
+    Yields the TOC contents for each TOC file of the document, reading the files one at a time.
+    :param txt_toc_list: list o paths to the TOC pages of the processed document in .txt format
+    :return: generator of lists of normalized TOC lines, one list per TOC page
+    """
+    for file in txt_toc_list:
+        yield get_page_toc_list(file)
+
+
 def get_raw_toc_contents(txt_toc_list):
     """
     Gets the TOC contents for each TOC file of the document.
@@ -283,14 +322,7 @@ def get_raw_toc_contents(txt_toc_list):
     :return: preprocessed_tocs_list: list of string representations of the actual content of the documents TOC.
     """
 
-    preprocessed_tocs_list = []
-    for file in txt_toc_list:
-        # print(file)
-        f = open(file, 'r')
-        lines = f.readlines()
-        f.close()
-
-        preprocessed_tocs_list.append(get_toc_list(lines))
+    preprocessed_tocs_list = list(iter_raw_toc_contents(txt_toc_list))
 
     if len(preprocessed_tocs_list) == 0:
         raise RuntimeError("Failed to get the toc content list.")
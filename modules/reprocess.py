@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Reprocessing of finished documents, e.g. after KER got a new model or the keyword selection changed. Documents are
+# selected by their scan date, ISBN or collection and run through the pipeline again. The artifacts cached by earlier
+# runs (sysno, normalized TOC, text of the ALTO pages, KER keyword scores) are used unless the document is reprocessed
+# for their stage, so usually only the changed stages run. Update lines of the changed records are collected in one
+# update batch, which is uploaded to the Aleph server as a single file.
+
+import config
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from modules import isbn_index
+from modules import pipeline
+from modules import scheduler
+from modules import utility
+
+# stages which can be redone instead of using the artifacts cached by earlier runs
+REDO_STAGES = ['resolve', 'extract', 'normalize']
+
+
+def parse_date(value):
+    """
+    Parses a scan date given on the command line.
+    :param value: date in YYYY-MM-DD format
+    :return: datetime.date
+    """
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def read_isbn_list(isbn_file):
+    """
+    Reads a list of ISBNs, one per line. Empty lines and lines starting with # are skipped.
+    :param isbn_file: path to the file
+    :return: list of ISBNs
+    """
+    with open(isbn_file, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def get_collection_pattern(name):
+    """
+    Gets the regular expression of directory names of the documents of a collection.
+    :param name: name of a collection in config.collections
+    :return: regular expression
+    """
+    try:
+        return config.collections[name]
+    except KeyError:
+        raise ValueError("Unknown collection {}".format(name))
+
+
+def iter_finished_dirs(path):
+    """
+    Yields DONE_ directories which contain the 'finished state' hidden file.
+    :param path: path to the digitized TOC root folder
+    :return: generator of finished document directories
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if re.match('DONE_', entry.name) and os.path.isfile(os.path.join(entry.path, config.finished_state)):
+                yield os.path.join(path, entry.name)
+
+
+def select_dirs(path, since=None, until=None, isbns=None, collection=None):
+    """
+    Yields finished documents matching all given criteria. Documents without a parsable scan date are not selected
+    by a date range.
+    :param path: path to the digitized TOC root folder
+    :param since: first scan date (datetime.date) or None
+    :param until: last scan date (datetime.date) or None
+    :param isbns: iterable of ISBN-10 or ISBN-13 strings or None
+    :param collection: name of a collection in config.collections or None
+    :return: generator of document directories
+    """
+    pattern = get_collection_pattern(collection) if collection is not None else None
+    isbn_keys = None
+    if isbns is not None:
+        isbn_keys = set()
+        for isbn in isbns:
+            isbn_key = isbn_index.normalize_isbn(isbn)
+            if isbn_key is None:
+                raise ValueError("Invalid ISBN {}".format(isbn))
+            isbn_keys.add(isbn_key)
+
+    for doc_path in iter_finished_dirs(path):
+        name = os.path.basename(doc_path)
+        if pattern is not None and not re.search(pattern, name):
+            continue
+        if isbn_keys is not None and \
+                isbn_index.normalize_isbn(utility.get_isbn_from_dir_name(name)) not in isbn_keys:
+            continue
+        if since is not None or until is not None:
+            scanned = scheduler.parse_dir_date(name)
+            if scanned is None:
+                continue
+            if (since is not None and scanned.date() < since) or (until is not None and scanned.date() > until):
+                continue
+        yield doc_path
+
+
+def get_batch_file(now=None):
+    """
+    Gets the path to a new update batch.
+    :param now: time.time() timestamp of the run, now by default
+    :return: path to the batch in config.reprocess_dir
+    """
+    name = time.strftime('reprocess_%Y%m%d_%H%M%S', time.localtime(now)) + '_update'
+
+    return os.path.join(config.reprocess_dir, name)
+
+
+def make_batch_stage(batch_file):
+    """
+    Creates the UPLOAD stage of reprocessing: the update files of changed documents are appended to one update batch
+    instead of being uploaded one by one. The batch is written as batch_file.part and gets its name when it's
+    closed, so only complete batches are uploaded. Runs which change no record create no batch.
+    :param batch_file: path to the update batch
+    :return: tuple (stage function, function closing the batch)
+    """
+    lock = threading.Lock()
+    batch = {}
+
+    def upload_doc(job):
+        if job.update_file is None:
+            # the record is unchanged, there is nothing to add
+            return
+        with open(job.update_file) as f:
+            update = f.read()
+        # the asyncio engine runs the stage in several threads
+        with lock:
+            if 'file' not in batch:
+                os.makedirs(os.path.dirname(batch_file), exist_ok=True)
+                batch['file'] = open(batch_file + '.part', mode='w')
+            batch['file'].write(update)
+
+    def close():
+        with lock:
+            if 'file' in batch:
+                batch.pop('file').close()
+                os.replace(batch_file + '.part', batch_file)
+
+    return upload_doc, close
+
+
+def get_pending_batches():
+    """
+    Gets update batches which were not uploaded yet (the upload failed or the batches were written without uploading).
+    :return: list of paths to the batches, oldest first
+    """
+    if not os.path.isdir(config.reprocess_dir):
+        return []
+
+    return sorted(os.path.join(config.reprocess_dir, name) for name in os.listdir(config.reprocess_dir)
+                  if name.startswith('reprocess_') and name.endswith('_update'))
+
+
+def upload_batches(batch_files):
+    """
+    Uploads update batches to the update directory on the Aleph server. Each uploaded batch is renamed with
+    the finished state suffix, so it isn't uploaded again.
+    :param batch_files: list of paths to the batches
+    :return: None
+    """
+    # paramiko (and cryptography with it) is imported only when there is something to upload
+    from modules import ssh
+    print("Opening connection to remote host", config.aleph_server)
+    client = ssh.create_ssh_client(server=config.aleph_server, user=config.aleph_user)
+
+    try:
+        for batch_file in batch_files:
+            ssh.upload_files(client, [batch_file], config.update_dir_location)
+            os.replace(batch_file, batch_file + config.finished_state)
+            print("Uploaded update batch", os.path.basename(batch_file))
+    finally:
+        client.close()
+        print("Connection closed.")
+
+
+def run(dirs, deadline=None, upload=True, redo=None, engine='threads'):
+    """
+    Reprocesses finished documents and collects the update lines of the changed records in one update batch.
+    :param dirs: iterable of finished document directories
+    :param deadline: timestamp of the end of the batch window or None
+    :param upload: if True, the batch and the batches left by earlier runs are uploaded to the Aleph server
+    :param redo: iterable of stages (REDO_STAGES) which don't use the cached artifacts
+    :param engine: 'threads' (pipeline.run) or 'asyncio' (aio_pipeline.run)
+    :return: tuple (counters of pipeline.run, where 'uploaded' counts the documents added to the batch,
+    path to the batch or None, when no record changed)
+    """
+    redo = set(redo or ())
+    if not redo.issubset(REDO_STAGES):
+        raise ValueError("Invalid stages to redo {}. Should be {} only".format(
+            ', '.join(sorted(redo.difference(REDO_STAGES))), ', '.join(REDO_STAGES)))
+
+    if engine == 'asyncio':
+        # aiohttp and asyncssh are imported only by the asyncio engine
+        from modules import aio_pipeline
+        runner = aio_pipeline
+    else:
+        runner = pipeline
+
+    pending = get_pending_batches()
+    batch_file = get_batch_file()
+    counters = runner.run(dirs, deadline=deadline, upload=True, redo=redo,
+                          upload_stage=make_batch_stage(batch_file))
+    if not os.path.isfile(batch_file):
+        batch_file = None
+
+    batch_files = pending + ([batch_file] if batch_file is not None else [])
+    if upload and len(batch_files) > 0:
+        upload_batches(batch_files)
+
+    return counters, batch_file
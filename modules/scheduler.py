@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Orders the documents waiting for processing by priority and keeps the run inside the Aleph load window.
+
+import config
+import json
+import os
+import time
+from datetime import datetime
+from modules import quarantine
+from modules import utility
+
+
+def parse_dir_date(dir_name):
+    """
+    Parses the date part of the document directory name (DONE_DATE_ISBN).
+    :param dir_name: name of the document directory
+    :return: datetime of the document scan or None, if the date cannot be parsed
+    """
+    name_parts = utility.split_string(dir_name, numsplits=3, sep="_", ignore_extra=True)
+    date_part = name_parts[1]
+
+    if date_part is None:
+        return None
+
+    for date_format in config.dir_date_formats:
+        try:
+            return datetime.strptime(date_part, date_format)
+        except ValueError:
+            continue
+
+    return None
+
+
+def get_priority(path, pages, now=None):
+    """
+    Computes the priority of the document from its age, number of TOC pages and number of failed attempts,
+    weighted by config.scheduler_weights. Documents with higher priority are processed first.
+    :param path: path to a document directory
+    :param pages: number of TOC pages of the document
+    :param now: datetime used for computing the age of the document
+    :return: priority: float
+    """
+    if now is None:
+        now = datetime.now()
+
+    weights = config.scheduler_weights
+    scanned = parse_dir_date(os.path.basename(path))
+    age_days = (now - scanned).total_seconds() / 86400 if scanned is not None else 0
+
+    priority = (weights['age'] * age_days +
+                weights['pages'] * pages +
+                weights['retries'] * quarantine.get_attempts(path))
+
+    return priority
+
+
+def order_dirs(dirs):
+    """
+    Orders document directories by their priority, highest first.
+    :param dirs: iterable of tuples (path to a document directory, number of TOC pages)
+    :return: list of tuples (path, number of TOC pages)
+    """
+    now = datetime.now()
+    schedule = []
+    for path, pages in dirs:
+        schedule.append((get_priority(path, pages, now), path, pages))
+
+    schedule.sort(key=lambda item: item[0], reverse=True)
+
+    return [(path, pages) for priority, path, pages in schedule]
+
+
+def load_costs():
+    """
+    Loads the per-document cost model saved by previous runs.
+    :return: dictionary with estimated seconds per cost unit and number of samples
+    """
+    try:
+        with open(config.scheduler_cost_file) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {'unit_seconds': config.scheduler_default_unit_seconds, 'samples': 0}
+
+
+def save_costs(costs):
+    """
+    Saves the per-document cost model for the following runs.
+    :param costs: dictionary returned by load_costs
+    :return: None
+    """
+    with open(config.scheduler_cost_file, mode='w') as f:
+        json.dump(costs, f)
+
+
+def estimate_cost(costs, pages):
+    """
+    Estimates how many seconds the processing of a document will take. One cost unit is the document itself
+    and another one each of its TOC pages.
+    :param costs: dictionary returned by load_costs
+    :param pages: number of TOC pages of the document
+    :return: estimated processing time in seconds
+    """
+    return costs['unit_seconds'] * (1 + pages)
+
+
+def update_costs(costs, seconds, pages):
+    """
+    Updates the cost model with the measured processing time of a document (exponentially weighted average).
+    :param costs: dictionary returned by load_costs
+    :param seconds: measured processing time of the document
+    :param pages: number of TOC pages of the document
+    :return: None
+    """
+    alpha = config.scheduler_smoothing
+    unit_seconds = seconds / (1 + pages)
+    if costs['samples'] == 0:
+        costs['unit_seconds'] = unit_seconds
+    else:
+        costs['unit_seconds'] = alpha * unit_seconds + (1 - alpha) * costs['unit_seconds']
+    costs['samples'] += 1
+
+
+def parse_deadline(deadline=None, budget=None):
+    """
+    Converts the end of the batch window to a timestamp.
+    :param deadline: wall clock time HH:MM; if it has already passed today, the next day is used
+    :param budget: number of minutes from now
+    :return: deadline as a time.time() timestamp or None, if neither is given
+    """
+    if budget is not None:
+        return time.time() + budget * 60
+
+    if deadline is not None:
+        now = datetime.now()
+        end = datetime.combine(now.date(), datetime.strptime(deadline, '%H:%M').time())
+        if end <= now:
+            end = datetime.fromtimestamp(end.timestamp() + 86400)
+        return end.timestamp()
+
+    return None
+
+
+def fits_deadline(deadline, estimate):
+    """
+    Checks whether a document with a given estimated cost can be finished before the deadline.
+    :param deadline: timestamp returned by parse_deadline or None
+    :param estimate: estimated processing time in seconds
+    :return: bool (True/False)
+    """
+    if deadline is None:
+        return True
+
+    return time.time() + estimate + config.scheduler_reserve_seconds <= deadline
@@ -1,8 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import paramiko
+import posixpath
 import config
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from modules import tracing
+
+# size of one SFTP write, the same as paramiko's put uses
+SFTP_CHUNK_SIZE = 32768
 
 
 def create_ssh_client(server, user):
@@ -15,7 +23,8 @@ def create_ssh_client(server, user):
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(policy=paramiko.AutoAddPolicy())
     client.load_system_host_keys()
-    client.connect(server, username=user)
+    client.connect(server, username=user, timeout=config.ssh_timeout, banner_timeout=config.ssh_timeout,
+                   auth_timeout=config.ssh_timeout)
     return client
 
 
@@ -38,3 +47,64 @@ def send_update_to_server(client, update_file, remote_location):
     sftp.close()
 
     return None
+
+
+def _put_files(sftp, update_files, remote_location, pipelined=True, confirm=True):
+    # uploads the files one by one over one SFTP session, returns the number of sent bytes; pipelined writes
+    # don't wait for their acknowledgements, a confirmed file is checked by a stat of its size
+    sent = 0
+    for update_file in update_files:
+        remote_path = posixpath.join(remote_location, os.path.basename(update_file))
+        with tracing.span('sftp.put', kind=tracing.KIND_CLIENT, **{'file.path': update_file,
+                                                                    'sftp.remote_path': remote_path}) as span:
+            with open(update_file, mode='rb') as f:
+                with sftp.open(remote_path, mode='wb') as remote_file:
+                    remote_file.set_pipelined(pipelined)
+                    shutil.copyfileobj(f, remote_file, SFTP_CHUNK_SIZE)
+                if confirm:
+                    size = sftp.stat(remote_path).st_size
+                    if size != f.tell():
+                        raise IOError("Size mismatch of uploaded {}: {} != {}".format(remote_path, size, f.tell()))
+                sent += f.tell()
+                span.set_attribute('sftp.bytes', f.tell())
+    return sent
+
+
+def upload_files(client, update_files, remote_location, strategy='sequential', channels=4):
+    """
+    Uploads Aleph update files to a remote location on the server.
+    sequential - one SFTP session, every write waits for its acknowledgement and every file is confirmed by a stat
+    before the next one is sent
+    pipelined - one SFTP session, writes are not acknowledged one by one and files are not confirmed, so each file
+    costs only the round trips of its open and close
+    multichannel - 'channels' SFTP sessions over the same SSH connection, each sending its share of the files
+    in its own thread (one SFTP session can't wait for responses from several threads), with pipelined writes
+    and confirmed files
+    :param client: SSH client instance
+    :param update_files: list of paths to update files
+    :param remote_location: path to a remote location on the server
+    :param strategy: 'sequential', 'pipelined' or 'multichannel'
+    :param channels: number of SFTP sessions of the multichannel strategy
+    :return: number of uploaded bytes
+    """
+    if strategy in ('sequential', 'pipelined'):
+        pipelined = strategy == 'pipelined'
+        sftp = client.open_sftp()
+        try:
+            return _put_files(sftp, update_files, remote_location, pipelined=pipelined, confirm=not pipelined)
+        finally:
+            sftp.close()
+
+    elif strategy == 'multichannel':
+        sessions = [client.open_sftp() for i in range(channels)]
+        try:
+            with ThreadPoolExecutor(max_workers=channels) as executor:
+                return sum(executor.map(lambda session, part: _put_files(session, part, remote_location), sessions,
+                                        [update_files[i::channels] for i in range(channels)]))
+        finally:
+            for sftp in sessions:
+                sftp.close()
+
+    else:
+        raise ValueError("Invalid upload strategy {}. Should be 'sequential', 'pipelined' or 'multichannel' "
+                         "only".format(strategy))
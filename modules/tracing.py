@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Per-document tracing: every document gets one trace with spans for its pipeline stages, the HTTP calls to Aleph
+# and KER, the TOC file reads and the SFTP upload. Finished traces are appended to config.trace_file as OTLP JSON
+# lines (one ExportTraceServiceRequest per line, the format of the OpenTelemetry file exporter), so no collector
+# is needed and slow documents can be inspected after the run.
+#
+# The current span is a context variable: it's separate for each thread and each asyncio task (asyncio.to_thread
+# passes it on). Code running in thread pools or other processes gets the parent span explicitly.
+# Without config.trace_file, spans are not created at all.
+
+import config
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = contextvars.ContextVar('kerator_span', default=None)
+_lock = threading.Lock()
+# trace id -> list of finished spans waiting for the end of the trace
+_finished = {}
+
+
+class Span(object):
+    """
+    One timed operation of a trace. Ids are stored as hex strings, times as time.time() timestamps.
+    """
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start', 'end', 'attributes', 'status',
+                 'message')
+
+    def __init__(self, name, trace_id, parent_id=None, kind=KIND_INTERNAL, attributes=None, start=None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = start or time.time()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+        self.message = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = STATUS_ERROR
+        self.message = str(error)
+        self.attributes['exception.type'] = type(error).__name__
+
+
+class NullSpan(object):
+    """
+    Span returned when tracing is disabled or there is no trace to add to, it records nothing.
+    """
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, error):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def is_enabled():
+    """
+    Checks whether traces are exported.
+    :return: True if config.trace_file is set
+    """
+    return getattr(config, 'trace_file', None) is not None
+
+
+def current_span():
+    """
+    Gets the span currently open in this thread or asyncio task.
+    :return: Span or None
+    """
+    return _current.get()
+
+
+def get_context():
+    """
+    Gets the current span as a picklable context, for passing the trace to a worker process.
+    :return: tuple (trace id, span id) or None
+    """
+    span = current_span()
+    if span is None:
+        return None
+
+    return span.trace_id, span.span_id
+
+
+def start_trace(name, attributes=None, start=None):
+    """
+    Starts a new trace with its root span.
+    :param name: name of the root span
+    :param attributes: dictionary of span attributes
+    :param start: start of the trace (time.time() timestamp), now by default
+    :return: root Span or None, if tracing is disabled
+    """
+    if not is_enabled():
+        return None
+
+    return Span(name, os.urandom(16).hex(), attributes=attributes, start=start)
+
+
+def end_trace(root, error=None, attributes=None):
+    """
+    Ends the root span of a trace and exports all finished spans of the trace.
+    :param root: root Span returned by start_trace, or None
+    :param error: exception which stopped the traced work or None
+    :param attributes: dictionary of attributes added to the root span
+    :return: None
+    """
+    if root is None:
+        return
+
+    root.attributes.update(attributes or {})
+    if error is not None:
+        root.set_error(error)
+    _finish(root)
+
+    with _lock:
+        spans = _finished.pop(root.trace_id, [])
+    export(spans)
+
+
+@contextmanager
+def span(name, parent=None, kind=KIND_INTERNAL, **attributes):
+    """
+    Opens a span of the trace as the current span of this thread or asyncio task. Errors raised in the block are
+    recorded in the span and raised again.
+    :param name: name of the span
+    :param parent: parent Span, tuple returned by get_context, or None for the current span
+    :param kind: KIND_INTERNAL or KIND_CLIENT for calls of remote services
+    :param attributes: span attributes
+    :return: context manager yielding the Span, or NULL_SPAN when there is no trace
+    """
+    if parent is None:
+        parent = current_span()
+    if parent is None or not is_enabled():
+        yield NULL_SPAN
+        return
+
+    if isinstance(parent, tuple):
+        trace_id, parent_id = parent
+    else:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+
+    new_span = Span(name, trace_id, parent_id=parent_id, kind=kind, attributes=attributes)
+    token = _current.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.set_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        _finish(new_span)
+
+
+def _finish(finished_span):
+    finished_span.end = time.time()
+    with _lock:
+        _finished.setdefault(finished_span.trace_id, []).append(finished_span)
+
+
+def flush():
+    """
+    Exports finished spans of traces which haven't ended (spans of worker processes, interrupted runs).
+    :return: None
+    """
+    with _lock:
+        spans = [finished_span for trace_spans in _finished.values() for finished_span in trace_spans]
+        _finished.clear()
+    export(spans)
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _attributes(attributes):
+    return [{'key': key, 'value': _value(value)} for key, value in attributes.items() if value is not None]
+
+
+def to_otlp(spans):
+    """
+    Converts spans to an OTLP JSON ExportTraceServiceRequest.
+    :param spans: list of finished spans
+    :return: dictionary of the request
+    """
+    otlp_spans = []
+    for finished_span in spans:
+        status = {'code': finished_span.status}
+        if finished_span.message is not None:
+            status['message'] = finished_span.message
+        otlp_spans.append({'traceId': finished_span.trace_id,
+                           'spanId': finished_span.span_id,
+                           'parentSpanId': finished_span.parent_id or '',
+                           'name': finished_span.name,
+                           'kind': finished_span.kind,
+                           'startTimeUnixNano': str(int(finished_span.start * 1e9)),
+                           'endTimeUnixNano': str(int(finished_span.end * 1e9)),
+                           'attributes': _attributes(finished_span.attributes),
+                           'status': status})
+
+    resource = {'attributes': _attributes({'service.name': 'kerator', 'process.pid': os.getpid()})}
+    return {'resourceSpans': [{'resource': resource,
+                               'scopeSpans': [{'scope': {'name': 'kerator'}, 'spans': otlp_spans}]}]}
+
+
+def export(spans, trace_file=None):
+    """
+    Appends spans to the trace file as one JSON line. The line is written by a single append, so the lines of
+    the pipeline and of the worker processes don't interleave.
+    :param spans: list of finished spans
+    :param trace_file: path to the trace file, config.trace_file by default
+    :return: None
+    """
+    if len(spans) == 0:
+        return
+    trace_file = trace_file or config.trace_file
+
+    line = (json.dumps(to_otlp(spans), ensure_ascii=False) + '\n').encode('utf-8')
+    fd = os.open(trace_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def call_traced(context, function, *args):
+    """
+    Runs a function under the trace context of the caller, in a worker process, and exports its spans.
+    :param context: tuple returned by get_context
+    :param function: module level function
+    :param args: arguments of the function
+    :return: result of the function
+    """
+    parent = Span(None, context[0])
+    parent.span_id = context[1]
+    token = _current.set(parent)
+    try:
+        return function(*args)
+    finally:
+        _current.reset(token)
+        flush()
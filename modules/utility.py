@@ -4,8 +4,19 @@
 import os
 import config
 import json
-import requests
+import mimetypes
+import mmap
+import time
+import uuid
 import zipfile
+from modules import executor
+from modules import hedging
+from modules import balancer
+from modules import tracing
+from modules.errors import DocumentTimeout
+from modules.errors import KerResponseError
+from modules.errors import KerUnavailable
+from modules.errors import RequestCancelled
 
 
 def create_dict_from_response(lang, response):
@@ -55,6 +66,10 @@ def parse_response_to_dict(response_dict):
             print("Failed to parse response from KER: ", e, " | ",lang , response)
             lang = None
             response = None
+
+    if len(response_dict) > 0 and len(processed_responses) == 0:
+        raise KerResponseError("None of the KER responses could be parsed")
+
     return processed_responses
 
 
@@ -82,37 +97,212 @@ def split_string(s, numsplits, default=None, sep=None, ignore_extra=False):
     return parts
 
 
-def send_ker_request(languages, file, threshold=0.2, max_words=15):
+def get_isbn_from_dir_name(dir_name):
+    """
+    Gets ISBN of the document from the name of its directory (DONE_DATE_ISBN).
+    :param dir_name: name of the document directory
+    :return: isbn: ISBN part of the directory name
+    """
+    # numsplits = 3 - because name of the directory now consists of 3 parts (DONE_DATE_ISBN)
+    name_parts = split_string(dir_name, numsplits=3, sep="_", ignore_extra=True)
+
+    # isbn part of the sting should be on third position in the list of name parts
+    return name_parts[2]
+
+
+def map_payload(file):
+    """
+    Maps the file sent to KER to memory, so all requests for the document read the same pages of the file
+    instead of copying its content.
+    :param file: path to the file
+    :return: payload: read-only mmap of the file (empty bytes for an empty file)
+    """
+    with open(file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def close_payload(payload):
+    """
+    Closes the memory mapped payload created by map_payload.
+    :param payload: payload returned by map_payload
+    :return: None
+    """
+    if isinstance(payload, mmap.mmap):
+        try:
+            payload.close()
+        except BufferError:
+            # a chunk is still referenced by the HTTP client, the map is closed when it's garbage collected
+            pass
+
+
+def iter_multipart_body(payload, boundary, filename, field='file', chunk_size=65536, cancelled=None):
+    """
+    Yields a multipart/form-data request body with a single file field. The file content is yielded
+    as memoryview slices of the payload, so it is never copied into the body.
+    :param payload: buffer with the file content (mmap or bytes)
+    :param boundary: multipart boundary
+    :param filename: name of the file sent in the form field
+    :param field: name of the form field
+    :param chunk_size: maximum size of one yielded chunk in bytes
+    :param cancelled: hedging.Cancellation (or threading.Event) which stops the body (and so the request) when set
+    :return: generator of body chunks
     """
-    Sends a request for keyword extraction to KER and returns the response
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    yield ('--{}\r\n'
+           'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+           'Content-Type: {}\r\n\r\n').format(boundary, field, filename, content_type).encode('utf-8')
+
+    view = memoryview(payload)
+    try:
+        for offset in range(0, len(view), chunk_size):
+            if cancelled is not None and cancelled.is_set():
+                raise RequestCancelled("Request cancelled")
+            yield view[offset:offset + chunk_size]
+    finally:
+        view.release()
+
+    yield '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+
+
+def get_call_timeout(timeout, deadline=None):
+    """
+    Gets the (connect, read) timeout of a network call, shortened so the call can't outlive the deadline
+    of the document. requests applies the read timeout to each read from the socket, not to the whole call, so
+    a response trickling in slower than the timeout can still run past the deadline; the next stage then stops
+    the document (check_deadline).
+    :param timeout: configured (connect, read) timeout in seconds
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+    :return: (connect, read) timeout in seconds
+    """
+    if deadline is None:
+        return timeout
+
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise DocumentTimeout("Document processing deadline exceeded")
+
+    connect, read = timeout
+
+    return min(connect, remaining), min(read, remaining)
+
+
+def check_deadline(deadline, stage):
+    """
+    Raises DocumentTimeout when the deadline of the document passed before the given stage started.
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+    :param stage: name of the stage
+    :return: None
+    """
+    if deadline is not None and time.time() >= deadline:
+        raise DocumentTimeout("Document processing deadline exceeded before stage {}".format(stage))
+
+
+def get_ker_params(language, threshold, max_words):
+    """
+    Gets the query parameters of a KER request.
+    :param language: language used for keyword extraction
+    :param threshold: decimal indicating minimal score the keyword can have to be selected as a keyword
+    :param max_words: number indicating maximum number of keywords extracted from the file
+    :return: list of query parameters
+    """
+    return ['language='+language, 'threshold='+str(threshold), 'maximum-words='+str(max_words)]
+
+
+def send_ker_request(languages, file, threshold=0.2, max_words=15, deadline=None):
+    """
+    Sends a request for keyword extraction to KER and returns the response. The file is memory mapped once
+    and streamed to KER for each language with chunked transfer encoding. When config.kerator_api is a list
+    of KER replicas, each request goes to the replica picked by the load balancer. A replica refusing connections
+    or answering with a server error (KerUnavailable) is skipped until all replicas were tried.
     :param languages: list of languages that will be used for keyword extraction
     :param file: file on which the keyword extraction will be done
     :param threshold: decimal indicating minimal score the keyword can have to be selected as a keyword
     :param max_words: number indicating maximum number of keywords extracted from the file
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
     :return: response: response from KER (json)
     """
+    # imported lazily, requests is only needed when a document is actually sent to KER
+    import requests
+
     params_sets = {}
     responses = {}
     for l in languages:
-        params = ['language='+l, 'threshold='+str(threshold), 'maximum-words='+str(max_words)]
-        params_sets[l] = params
-
-    for lang, p_set in params_sets.items():
-        sep = '&'
-        files = {'file': open(file, 'rb')}
-        param_string = sep.join(p_set)
-        api_url = config.kerator_api
-        request_url = api_url + param_string
+        params_sets[l] = get_ker_params(l, threshold, max_words)
 
-        r = requests.post(request_url, files=files)
-        responses[lang] = r
+    ker_balancer = balancer.get_ker_balancer()
+    trace_parent = tracing.current_span()
+    payload = map_payload(file)
+    try:
+        for lang, p_set in params_sets.items():
+            sep = '&'
+            param_string = sep.join(p_set)
+
+            def attempt(cancelled, param_string=param_string, lang=lang):
+                failed_endpoints = []
+                while True:
+                    # an expired deadline raises before a replica is picked, it doesn't count as its failure
+                    timeout = get_call_timeout(config.kerator_timeout, deadline)
+                    lease = ker_balancer.lease(exclude=failed_endpoints)
+                    # a cancelled (hedged) request frees its endpoint at once, not after its read timeout
+                    cancelled.on_cancel(lambda lease=lease: lease.release(None))
+                    api_url = lease.endpoint
+                    request_url = api_url + param_string
+                    boundary = uuid.uuid4().hex
+                    headers = {'Content-Type': 'multipart/form-data; boundary=' + boundary}
+                    body = iter_multipart_body(payload, boundary=boundary, filename=os.path.basename(file),
+                                               chunk_size=config.ker_upload_chunk_size, cancelled=cancelled)
+                    # hedged attempts run in other threads, the span is added to the trace explicitly
+                    with tracing.span('ker.request', parent=trace_parent, kind=tracing.KIND_CLIENT,
+                                      **{'http.request.method': 'POST', 'url.full': request_url,
+                                         'http.request.body.size': len(payload), 'ker.language': lang}) as span:
+                        try:
+                            r = requests.post(request_url, data=body, headers=headers, timeout=timeout)
+                        except RequestCancelled:
+                            lease.release(None)
+                            raise
+                        except requests.ConnectionError as e:
+                            lease.release(False)
+                            failed_endpoints.append(api_url)
+                            # a replica which refuses connections is skipped, until all replicas were tried
+                            if len(failed_endpoints) < len(ker_balancer.endpoints):
+                                span.set_error(e)
+                                continue
+                            raise
+                        except Exception:
+                            lease.release(False)
+                            raise
+                        lease.release(r.status_code < 500)
+                        span.set_attribute('http.response.status_code', r.status_code)
+                        span.set_attribute('http.response.body.size', len(r.content))
+                        if r.status_code >= 500:
+                            # a failing replica is skipped like one refusing connections; the error lets the
+                            # hedged duplicate win and sends the document to the network quarantine
+                            failed_endpoints.append(api_url)
+                            error = KerUnavailable("KER {} responded with HTTP {}".format(api_url, r.status_code))
+                            if len(failed_endpoints) < len(ker_balancer.endpoints):
+                                span.set_error(error)
+                                continue
+                            raise error
+                        return r
+
+            try:
+                # slow calls are duplicated when hedging is enabled, both read the same memory mapped payload
+                r = hedging.hedged_call(attempt)
+            except requests.Timeout as e:
+                raise DocumentTimeout("KER did not respond in time: {}".format(e))
+            responses[lang] = r
+    finally:
+        close_payload(payload)
 
     return responses
 
 
 def zip_tocs(toc_files, zip_name, location):
     """
-    Creates a zip file of TOC files of the document.
+    Creates a zip file of TOC files of the document. An archive left by an earlier run is replaced, so it holds
+    only the given files (e.g. not the pages deduplicated since).
     :param toc_files: list of TOC files of the document.
     :param zip_name: name of the zip file that will be created
     :param location: path to the directory in which the zip file will be created
@@ -120,13 +310,11 @@ def zip_tocs(toc_files, zip_name, location):
     """
     zip_path = os.path.join(location, zip_name) + '.zip'
     print("Opening zip file ", os.path.basename(zip_path), "...")
-    zip_file = zipfile.ZipFile(zip_path, mode='a')
-    files_in_zip = zip_file.namelist()
-    print("ZIP CONTENTS")
-    print(files_in_zip)
+    # the archive is written aside and replaces the old one when complete
+    zip_file = zipfile.ZipFile(zip_path + '.tmp', mode='w')
     try:
         for toc_file in toc_files:
-            if os.path.basename(toc_file) in files_in_zip:
+            if os.path.basename(toc_file) in zip_file.namelist():
                 print("File ", os.path.basename(toc_file), " already zipped. Skipping...")
                 continue
 
@@ -135,6 +323,7 @@ def zip_tocs(toc_files, zip_name, location):
     finally:
         print("Closing archive ", os.path.basename(zip_path), "...")
         zip_file.close()
+    os.replace(zip_path + '.tmp', zip_path)
 
     return zip_path
 
@@ -183,7 +372,7 @@ def construct_aleph_string(doc_sysno, word_list=None, mode='keyword'):
     return aleph_string
 
 
-def get_xml_location(toc_files_list, doc_path):
+def get_xml_location(toc_files_list, doc_path, zip_name=None):
     """
     Gets xml location from the xml files list based on it's length. If length is 0, location will be set to None,
     if it's greater than 1, files will be zipped into an archive and xml_files_location will be set to to location
@@ -192,6 +381,7 @@ def get_xml_location(toc_files_list, doc_path):
 
     :param toc_files_list: list that should contain path/paths to a xml TOC files in processed directory
     :param doc_path: path to the processed document
+    :param zip_name: name of the archive without the .zip extension, tocs_DOCUMENT by default
     :return: path to the location of the XML files that will be processed by KER or None
     """
     xml_location = None
@@ -203,10 +393,9 @@ def get_xml_location(toc_files_list, doc_path):
     if len(toc_files_list) > 1:
         print("Document has more than 1 TOC file...")
         print("Creating archive for TOC files...")
-        zip_file_path = zip_tocs(toc_files=toc_files_list,
-                                 zip_name='tocs_' + os.path.basename(doc_path),
-                                 location=doc_path
-                                 )
+        # compression runs in the process pool, the worker reads the TOC files itself
+        zip_name = zip_name or 'tocs_' + os.path.basename(doc_path)
+        zip_file_path = executor.call_cpu(zip_tocs, toc_files_list, zip_name, doc_path)
         print("Finished creating archive... Archive created: {}".format(os.path.basename(zip_file_path)))
         xml_location = zip_file_path
 
@@ -4,11 +4,38 @@
 import config
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from modules import alto
+from modules import artifacts
+from modules import authority
 from modules import utility
 from modules import keywords
 from modules import catalogue
+from modules import dedupe
+from modules import executor
+from modules import isbn_index
+from modules import payload
 from modules import raw_toc
-from modules import ssh
+from modules import quarantine
+from modules import tracing
+from modules.errors import InvalidDocument
+from modules.errors import MissingTocFiles
+
+
+def iter_dirs(path):
+    """
+    Yields directories available for keyword and TOC processing one by one, without listing the whole
+    OBSAHATOR's directory into memory first. Only DONE_ directories which do not contain 'finished state' hidden
+    file indicating that the document has been already processed, will be yielded.
+    :param path: path to the digitized TOC root folder
+    :return: generator of document directories available for keyword and TOC processing
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if re.match('DONE_', entry.name) and not os.path.isfile(os.path.join(entry.path,
+                                                                                 config.finished_state)):
+                yield os.path.join(config.obsahator_dir, entry.name)
 
 
 def get_dirs(path):
@@ -19,22 +46,81 @@ def get_dirs(path):
     :param path: path to the digitized TOC root folder
     :return: list of document directories available for keyword and TOC processing
     """
-    done_dirs = [os.path.join(config.obsahator_dir, directory) for directory in os.listdir(path)
-                 if re.match('DONE_', directory) and not os.path.isfile(os.path.join(path, directory,
-                                                                                     config.finished_state))]
+    done_dirs = list(iter_dirs(path))
 
     return done_dirs
 
 
-def preprocess_keywords(toc_xml_location, doc_path):
+def get_update_files(dirs):
+    """
+    Returns list of Aleph update files created in the given document directories, which were not uploaded
+    to the Aleph server yet.
+    :param dirs: list of document directories
+    :return: list of paths to Aleph update files
+    """
+    update_files = [os.path.join(path, filename) for path in dirs for filename in os.listdir(path)
+                    if filename.endswith('_update')]
+
+    return update_files
+
+
+def iter_update_files(dirs):
+    """
+    Yields Aleph update files created in the given document directories, which were not uploaded to the Aleph
+    server yet.
+    :param dirs: iterable of document directories
+    :return: generator of paths to Aleph update files
+    """
+    for path in dirs:
+        for update_file in get_update_files([path]):
+            yield update_file
+
+
+def get_status(path):
+    """
+    Counts the DONE_ directories in the OBSAHATOR's directory by their processing state.
+    :param path: path to the digitized TOC root folder
+    :return: dictionary with number of finished, failed, quarantined, pending and waiting-for-upload documents
+    """
+    status = {'finished': 0, 'error': 0, 'quarantined': 0, 'pending': 0, 'to_upload': 0}
+
+    for directory in os.listdir(path):
+        if not re.match('DONE_', directory):
+            continue
+        doc_path = os.path.join(path, directory)
+        if os.path.isfile(os.path.join(doc_path, config.finished_state)):
+            status['finished'] += 1
+        elif os.path.isfile(os.path.join(doc_path, config.error_state)):
+            status['error'] += 1
+        elif quarantine.is_quarantined(doc_path):
+            status['quarantined'] += 1
+        elif len(get_update_files([doc_path])) > 0:
+            status['to_upload'] += 1
+        else:
+            status['pending'] += 1
+
+    return status
+
+
+def preprocess_keywords(toc_xml_location, doc_path, deadline=None):
     """
     Gets the keywords of the processed document.
     :param toc_xml_location: location of the XML OCR results which are sent to KER
     :param doc_path: path to the document directory
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
     :return: dictionary of keywords with mapped keyword scores
     """
-    responses_dict = keywords.get_keywords(toc_xml_location=toc_xml_location)
+    responses_dict = keywords.get_keywords(toc_xml_location=toc_xml_location, deadline=deadline)
+
+    return read_keywords(responses_dict)
 
+
+def read_keywords(responses_dict):
+    """
+    Reads the keywords and their scores from the KER responses.
+    :param responses_dict: dictionary of KER responses (objects with the response text in .text) for each language
+    :return: dictionary of keywords with mapped keyword scores
+    """
     # PROCESS RESPONSE FOR EACH LANGUAGE AND RETURN DICT
     processed_responses = utility.parse_response_to_dict(response_dict=responses_dict)
 
@@ -80,11 +166,16 @@ def write_aleph_update_file(strings_list, document_sysno, location, doc_path):
     return file_path
 
 
-def process_xml_toc(toc_xml_location, path):
+def process_xml_toc(toc_xml_location, path, deadline=None, toc_xml_files=None, profile=None):
     """
-    Processes XML TOC files of the document.
-    :param toc_xml_location: path to a XML TOC file or a zip file containing multiple XML TOC files.
+    Processes XML TOC files of the document. All keywords and scores returned by KER are stored in the document
+    directory, the keywords are selected by the keyword profile of the document.
+    :param toc_xml_location: path to a XML TOC file, a zip file containing multiple XML TOC files or a text file
+    with the text of XML TOC files.
     :param path: path to a document directory
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+    :param toc_xml_files: list of XML TOC pages the scores are stored for, or None to not store the scores
+    :param profile: name of the keyword profile, by default the profile of the document (keywords.get_profile)
     :return: list of best keywords for the processed document
     """
 
@@ -92,12 +183,27 @@ def process_xml_toc(toc_xml_location, path):
         raise IOError("File not found:", toc_xml_location)
 
     # pre-process keywords (get them from KER, map keywords to scores
-    mapped_keywords = preprocess_keywords(toc_xml_location=toc_xml_location, doc_path=path)
+    mapped_keywords = preprocess_keywords(toc_xml_location=toc_xml_location, doc_path=path, deadline=deadline)
+    if toc_xml_files is not None:
+        keywords.save_scored_keywords(path, toc_xml_files, mapped_keywords)
 
-    # select the best keywords for document
-    best_keywords_list = keywords.select_best_keywords(mapped_keywords=mapped_keywords, doc_path=path)
+    return select_doc_keywords(mapped_keywords, path, profile=profile)
+
+
+def select_doc_keywords(mapped_keywords, path, profile=None):
+    """
+    Selects the best keywords of the document from all keywords and scores returned by KER.
+    :param mapped_keywords: dictionary of keywords with mapped scores for each language
+    :param path: path to a document directory
+    :param profile: name of the keyword profile, by default the profile of the document (keywords.get_profile)
+    :return: list of best keywords for the processed document
+    """
+    selection = keywords.get_profile(path, name=profile)
+    mapped_keywords = keywords.select_keywords(mapped_keywords, threshold=selection['threshold'],
+                                               max_words=selection['max_words'])
 
-    return best_keywords_list
+    # select the best keywords for document
+    return keywords.select_best_keywords(mapped_keywords=mapped_keywords, doc_path=path)
 
 
 def process_txt_toc(toc_txt_files, path):
@@ -110,31 +216,145 @@ def process_txt_toc(toc_txt_files, path):
 
     final_toc_list = []
 
-    toc_items_list = raw_toc.get_raw_toc_contents(txt_toc_list=toc_txt_files)
-
-    for toc_list in toc_items_list:
+    # pages are normalized in the process pool, only their paths and normalized lines are passed
+    for toc_list in executor.map_cpu(raw_toc.get_page_toc_list, toc_txt_files):
         if isinstance(toc_list, list):
-            for toc_item in toc_list:
-                final_toc_list.append(toc_item)
+            final_toc_list.extend(toc_list)
         else:
             raise TypeError(toc_list, "not a list.")
 
+    if len(toc_txt_files) == 0:
+        raise RuntimeError("Failed to get the toc content list.")
+
+    return final_toc_list
+
+
+def process_alto_toc(toc_xml_files, path):
+    """
+    Processes text of XML (ALTO) TOC files of the document, used when the TXT TOC files are missing.
+    :param toc_xml_files: list of .xml toc files of the processed document
+    :param path: path to a document directory
+    :return: list of normalized and readable TOC lines for the document
+    """
+    final_toc_list = []
+
+    for toc_list in executor.map_cpu(get_alto_toc_list, toc_xml_files):
+        final_toc_list.extend(toc_list)
+
     return final_toc_list
 
 
-def get_document_sysno(doc_path):
+def get_alto_toc_list(toc_xml_file):
+    """
+    Gets the normalized TOC lines of one XML (ALTO) TOC page.
+    :param toc_xml_file: path to the .xml toc file
+    :return: list of normalized TOC lines
+    """
+    lines = (line + '\n' for line in alto.iter_alto_lines(toc_xml_file))
+
+    return raw_toc.get_toc_list(lines)
+
+
+def get_document_sysno(doc_path, deadline=None):
     """
     Get sysno (system number) of the processed document from its record in Aleph library system.
     :param doc_path: path to a document directory
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
     :return: sysno: system number of the document
     """
+    sysno, record_fields = get_document_record(doc_path, deadline=deadline)
+
+    return sysno
+
+
+def get_document_record(doc_path, deadline=None):
+    """
+    Get sysno (system number) of the processed document and the current keyword and TOC fields of its record
+    in Aleph library system.
+    :param doc_path: path to a document directory
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+    :return: tuple (sysno, fields of the record or None, when the sysno was found in the offline index and
+    unchanged records are not skipped)
+    """
+    queries = iter_record_queries(doc_path)
+    query, record = next_record_query(queries)
+    while query is not None:
+        name, aleph_url = query
+        query, record = next_record_query(queries, catalogue.fetch_query(name, aleph_url, deadline=deadline))
+
+    return record
+
+
+def iter_record_queries(doc_path):
+    """
+    Resolves the sysno of the document and the current keyword and TOC fields of its record. The X-server queries
+    are yielded to the caller, which sends back their responses, so the threaded pipeline and the asyncio engine
+    resolve documents the same way and differ only in how they send the queries.
+    :param doc_path: path to a document directory
+    :return: generator of tuples (span name, URL of the query) getting tuples (HTTP status code, text of
+    the response); its return value is the tuple returned by get_document_record
+    """
+    dir_name = os.path.basename(doc_path)
+    isbn = utility.get_isbn_from_dir_name(dir_name)
+
+    # the offline index built from the bulk Aleph export is consulted first, X-server only on a miss
+    sysno = isbn_index.lookup(isbn)
+    if sysno is not None:
+        print("Document: {}\tSysno: {} (offline index)".format(dir_name, sysno))
+        if not config.aleph_skip_unchanged:
+            return sysno, None
+        # the update is compared with the current record, one query by the sysno instead of find and present
+        aleph_url = catalogue.get_find_doc_url(sysno)
+        status_code, response_text = yield 'aleph.find_doc', aleph_url
+        return sysno, catalogue.read_record_fields(sysno, status_code, response_text, aleph_url)
 
     print("Getting document set number...")
-    set_number = catalogue.get_set_number(os.path.basename(doc_path))
-    print("Document: {}\tSet number: {}".format(os.path.basename(doc_path), set_number))
+    aleph_url = catalogue.get_find_url(isbn)
+    status_code, response_text = yield 'aleph.find', aleph_url
+    set_number = catalogue.read_set_number(isbn, status_code, response_text, aleph_url)
+    print("Document: {}\tSet number: {}".format(dir_name, set_number))
     print("Getting document sysno...")
-    sysno = catalogue.get_document_sysno(set_number=set_number)
-    return sysno
+    aleph_url = catalogue.get_present_url(set_number)
+    status_code, response_text = yield 'aleph.present', aleph_url
+    return catalogue.read_document_record(status_code, response_text, aleph_url)
+
+
+def next_record_query(queries, response=None):
+    """
+    Sends the response of the last X-server query to the resolution of the document and gets the next query.
+    :param queries: generator returned by iter_record_queries
+    :param response: tuple (HTTP status code, text of the response) of the last query, None for the first query
+    :return: tuple (next query or None, result of the resolution when there is no next query, else None)
+    """
+    # StopIteration can't pass through asyncio.to_thread, the end of the resolution is returned instead
+    try:
+        return (next(queries) if response is None else queries.send(response)), None
+    except StopIteration as stop:
+        return None, stop.value
+
+
+def inventory_toc_pages(path):
+    """
+    Gets lists of XML and TXT toc files of the document in one pass over the document directory.
+    :param path: path to a document directory
+    :return: tuple (list of paths to .xml TOC files, list of paths to .txt TOC files), sorted by file name
+    """
+    toc_xml_files = []
+    toc_txt_files = []
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not re.match(config.toc_prefix, entry.name) or not entry.is_file():
+                continue
+            if entry.name.endswith(config.toc_xml_suffix):
+                toc_xml_files.append(entry.path)
+            elif entry.name.endswith(config.toc_txt_suffix):
+                toc_txt_files.append(entry.path)
+
+    toc_xml_files.sort()
+    toc_txt_files.sort()
+
+    return toc_xml_files, toc_txt_files
 
 
 def get_toc_pages(path, toc_type=None):
@@ -150,16 +370,12 @@ def get_toc_pages(path, toc_type=None):
     if toc_type is None:
         raise ValueError("You need to provide a value for toc_type: 'txt'/'xml': current toc_type:", toc_type)
 
+    toc_xml_files, toc_txt_files = inventory_toc_pages(path)
+
     if toc_type == 'xml':
-        toc_files = [os.path.join(path, filename) for filename in os.listdir(path) if re.match(config.toc_prefix,
-                                                                                               filename) and
-                     filename.endswith(config.toc_xml_suffix)]
-        return toc_files
+        return toc_xml_files
     elif toc_type == 'txt':
-        toc_files = [os.path.join(path, filename) for filename in os.listdir(path) if re.match(config.toc_prefix,
-                                                                                               filename) and
-                     filename.endswith(config.toc_txt_suffix)]
-        return toc_files
+        return toc_txt_files
 
 
 def check_toc_files_presence(file_list, path):
@@ -179,91 +395,422 @@ def check_toc_files_presence(file_list, path):
     return present
 
 
-def get_xml_files_location(xml_files_list, path):
+def get_text_location(xml_files_list, path, suffix=''):
+    """
+    Gets the location of a plain text file with the text of XML TOC files of the processed document, which is sent
+    to KER instead of the ALTO XML files.
+    :param xml_files_list: list of XML TOC files of the document
+    :param path: path to a document directory
+    :param suffix: suffix of the file name, distinguishes the files of a subset or chunks of the pages
+    :return: location of the text file
+    """
+    if len(xml_files_list) == 0:
+        raise RuntimeError("Document {} doesn't have XML TOC files.".format(os.path.basename(path)))
+
+    text_file = os.path.join(path, config.ker_text_prefix + os.path.basename(path) + suffix + '.txt')
+    # the text written by an earlier run is used when it was extracted from the same pages
+    key = {'pages': keywords.get_pages_signature(xml_files_list)}
+    if artifacts.load_artifact(path, 'text' + suffix, key) == os.path.basename(text_file) and \
+            os.path.isfile(text_file):
+        print("Using text of {} XML TOC file(s) extracted by an earlier run...".format(len(xml_files_list)))
+        return text_file
+
+    print("Extracting text of {} XML TOC file(s)...".format(len(xml_files_list)))
+    alto.write_alto_text(alto_files=xml_files_list, text_file=text_file)
+    artifacts.save_artifact(path, 'text' + suffix, key, os.path.basename(text_file))
+
+    return text_file
+
+
+def get_xml_files_location(xml_files_list, path, suffix=''):
     """
     Gets the location of the XML TOC file or ZIP archive of multiple TOC filesof the processed document,
     by calling the utility function get_xml_location and returning its returned value.
     :param xml_files_list: list of XML TOC files of the document
     :param path: path to a document directory
+    :param suffix: suffix of the archive name, distinguishes the archives of a subset or chunks of the pages
     :return: location of the TOC XML file or an archive of multiple TOC XML files
     """
     try:
         # GET location of the XML TOC files
-        toc_xml_location = utility.get_xml_location(toc_files_list=xml_files_list, doc_path=path)
+        toc_xml_location = utility.get_xml_location(toc_files_list=xml_files_list, doc_path=path,
+                                                    zip_name='tocs_' + os.path.basename(path) + suffix)
         return toc_xml_location
     except RuntimeError as e:
         # raise e
         raise RuntimeError("Unable to get the location of XML files for document {}".format(os.path.basename(path)), e)
 
 
-def process_doc(path):
+def validate_doc(job):
+    """
+    VALIDATE stage: local checks of the document, which run during the scan before any network stage. Parses
+    the directory name and inventories the TOC files of the document.
+    :param job: DocumentJob of the processed document
+    :return: None
     """
-    Basic KEYWORD AND TOC processing workflow. Tries to process a document, returns aleph update file location
-    or raises an exception when one of the processes in workflow fails.
+    name = os.path.basename(job.path)
+    isbn = utility.get_isbn_from_dir_name(name)
+    if not isbn or not re.match(r'^[0-9Xx\-]+$', isbn):
+        raise InvalidDocument("Directory name {} doesn't end with an ISBN".format(name))
+    job.isbn = isbn
+
+    job.toc_xml_files, job.toc_txt_files = inventory_toc_pages(job.path)
+    job.pages = len(job.toc_xml_files)
+
+    if len(job.toc_xml_files) == 0:
+        raise MissingTocFiles("Document {} doesn't have XML TOC files.".format(name))
+    if len(job.toc_txt_files) == 0 and not config.alto_synthesize_toc:
+        raise MissingTocFiles("There are 0 TXT toc files for document {}".format(name))
+
+
+def dedupe_doc(job):
+    """
+    DEDUPE stage: removes TOC pages scanned more than once, so they are neither sent to KER nor written to the TOC
+    field twice.
+    :param job: DocumentJob of the processed document
+    :return: None
+    """
+    if not config.dedupe_pages:
+        return
+
+    utility.check_deadline(job.deadline, 'dedupe')
+    job.toc_xml_files, job.toc_txt_files, job.duplicate_pages = dedupe.dedupe_pages(job.toc_xml_files,
+                                                                                    job.toc_txt_files)
+    for duplicate, kept in sorted(job.duplicate_pages.items()):
+        print("TOC page {} duplicates page {}, skipping it...".format(duplicate, kept))
+
+
+def uses_cache(job, stage):
+    """
+    Checks whether the stage may use the artifacts cached by an earlier run of the document: every stage except
+    the ones the document is reprocessed for.
+    :param job: DocumentJob of the processed document
+    :param stage: name of the stage
+    :return: True if the cached artifacts may be used
+    """
+    return job.redo is None or stage not in job.redo
+
+
+def load_cached_sysno(job):
+    """
+    Uses the sysno cached for the ISBN of the document by an earlier run. Only reprocessed documents use it, the
+    cached sysno comes without the current fields of the record which regular runs compare the update with.
+    :param job: DocumentJob of the processed document
+    :return: True if the cached sysno was used
+    """
+    if job.redo is None or 'resolve' in job.redo:
+        return False
+
+    sysno = artifacts.load_artifact(job.path, 'sysno', {'isbn': job.isbn})
+    if sysno is None:
+        return False
+
+    print("Document: {}\tSysno: {} (cached)".format(os.path.basename(job.path), sysno))
+    job.sysno, job.record_fields = sysno, None
+    return True
+
+
+def cache_sysno(job):
+    """
+    Caches the sysno of the document for its ISBN.
+    :param job: DocumentJob of the resolved document
+    :return: None
+    """
+    artifacts.save_artifact(job.path, 'sysno', {'isbn': job.isbn}, job.sysno)
+
+
+def resolve_doc(job):
+    """
+    RESOLVE stage: gets the sysno of the document from Aleph. Reprocessed documents use the sysno cached by
+    an earlier run.
+    :param job: DocumentJob of the processed document
+    :return: None
+    """
+    utility.check_deadline(job.deadline, 'resolve')
+    if load_cached_sysno(job):
+        return
+
+    job.sysno, job.record_fields = get_document_record(doc_path=job.path, deadline=job.deadline)
+    cache_sysno(job)
+
+
+def get_ker_location(xml_files_list, path, suffix=''):
+    """
+    Gets the location of the payload sent to KER for XML TOC pages of the document: a plain text file
+    (config.ker_send_plain_text) or the XML file or ZIP archive of the pages.
+    :param xml_files_list: list of XML TOC files sent in one request
+    :param path: path to a document directory
+    :param suffix: suffix of the file name, distinguishes the files of a subset or chunks of the pages
+    :return: location of the payload
+    """
+    if config.ker_send_plain_text:
+        return get_text_location(xml_files_list=xml_files_list, path=path, suffix=suffix)
+
+    return get_xml_files_location(xml_files_list=xml_files_list, path=path, suffix=suffix)
+
+
+def extract_chunks(locations, path, deadline=None):
+    """
+    Sends payloads with chunks of XML TOC pages of the document to KER in parallel requests.
+    :param locations: list of payload locations, one per chunk
     :param path: path to a document directory
-    :return: update_file_loc: path to an aleph update file created as a result of the document processing
+    :param deadline: time by which the document has to be processed (time.time() timestamp) or None
+    :return: list of dictionaries of keywords with mapped scores for each language, one per chunk
+    """
+    # the chunks are sent from other threads, their spans are added to the span of the stage explicitly
+    trace_parent = tracing.current_span()
+
+    def extract_chunk(number, location):
+        with tracing.span('ker.chunk', parent=trace_parent, **{'ker.chunk': number}):
+            return preprocess_keywords(toc_xml_location=location, doc_path=path, deadline=deadline)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(locations), config.ker_split_workers))) as executor:
+        futures = [executor.submit(extract_chunk, number, location)
+                   for number, location in enumerate(locations, start=1)]
+
+    return [future.result() for future in futures]
+
+
+def plan_extract(job):
+    """
+    First part of the EXTRACT stage: uses the keyword scores stored for the same TOC pages, or plans the KER
+    requests within the payload budget (payload.plan_payload) and prepares their payloads. The strategy
+    is recorded in job.ker_strategy.
+    :param job: DocumentJob of the processed document
+    :return: list of payload locations, one per KER request; empty when the stored scores were used and
+    job.keywords is already set
+    """
+    utility.check_deadline(job.deadline, 'extract')
+    path = job.path
+    print("LENGTH - TOC FILES:", len(job.toc_xml_files))
+
+    mapped_keywords = None
+    if uses_cache(job, 'extract'):
+        mapped_keywords = keywords.load_scored_keywords(path, job.toc_xml_files)
+    if mapped_keywords is not None:
+        print("Using stored keyword scores of the document {}...".format(os.path.basename(path)))
+        job.ker_strategy = 'stored'
+        job.keywords = select_doc_keywords(mapped_keywords, path)
+        return []
+
+    job.ker_strategy, chunks = payload.plan_payload(job.toc_xml_files)
+    if job.ker_strategy == payload.WHOLE:
+        job.toc_location = get_ker_location(job.toc_xml_files, path)
+        return [job.toc_location]
+
+    if job.ker_strategy == payload.SUBSET:
+        print("Document is over the KER payload budget, sending {} of {} TOC pages...".format(
+            len(chunks[0]), len(job.toc_xml_files)))
+        job.toc_location = get_ker_location(chunks[0], path, suffix='_subset')
+        return [job.toc_location]
+
+    print("Document is over the KER payload budget, sending {} TOC pages in {} requests...".format(
+        len(job.toc_xml_files), len(chunks)))
+    return [get_ker_location(chunk, path, suffix='_part{}'.format(number))
+            for number, chunk in enumerate(chunks, start=1)]
+
+
+def finish_extract(job, chunk_keywords):
+    """
+    Last part of the EXTRACT stage: merges the keywords returned by KER for the payloads, stores their scores and
+    selects the best keywords of the document.
+    :param job: DocumentJob of the processed document
+    :param chunk_keywords: list of dictionaries of keywords with mapped scores for each language, one per payload
+    :return: None
     """
+    if len(chunk_keywords) == 1:
+        mapped_keywords = chunk_keywords[0]
+    else:
+        mapped_keywords = keywords.merge_scored_keywords(chunk_keywords)
 
+    keywords.save_scored_keywords(job.path, job.toc_xml_files, mapped_keywords)
+    job.keywords = select_doc_keywords(mapped_keywords, job.path)
+
+
+def extract_doc(job):
+    """
+    EXTRACT stage: sends XML TOC pages of the document to KER and selects the best keywords. When KER already
+    returned keywords for the same TOC pages, the stored scores are used without calling KER (unless the document
+    is reprocessed for the extract stage). Documents over
+    the KER payload budget are sent as a subset of their pages or in chunks (payload.plan_payload); the strategy
+    is recorded in job.ker_strategy.
+    :param job: DocumentJob of the processed document
+    :return: None
+    """
+    locations = plan_extract(job)
+    if len(locations) == 0:
+        return
+
+    if len(locations) == 1:
+        chunk_keywords = [preprocess_keywords(toc_xml_location=locations[0], doc_path=job.path,
+                                              deadline=job.deadline)]
+    else:
+        chunk_keywords = extract_chunks(locations, job.path, deadline=job.deadline)
+
+    finish_extract(job, chunk_keywords)
+
+
+def normalize_doc(job):
+    """
+    NORMALIZE stage: gets normalized TOC lines from TXT TOC pages of the document. The TOC lines normalized
+    by an earlier run from the same pages are used, unless the document is reprocessed for this stage.
+    :param job: DocumentJob of the processed document
+    :return: None
+    """
+    utility.check_deadline(job.deadline, 'normalize')
+    path = job.path
+
+    # TOC lines are synthesized from the ALTO XML pages, when OCR didn't leave the TXT ones
+    synthesize = len(job.toc_txt_files) == 0 and config.alto_synthesize_toc and len(job.toc_xml_files) > 0
+    if not synthesize:
+        utility.check_txt_files_presence(job.toc_txt_files, path)
+
+    key = {'source': 'alto' if synthesize else 'txt',
+           'pages': keywords.get_pages_signature(job.toc_xml_files if synthesize else job.toc_txt_files)}
+    if uses_cache(job, 'normalize'):
+        job.toc_lines = artifacts.load_artifact(path, 'toc', key)
+        if job.toc_lines is not None:
+            print("Using TOC normalized by an earlier run...")
+            return
+
+    if synthesize:
+        print("Document has no TXT TOC files, using text of XML TOC files...")
+        job.toc_lines = process_alto_toc(job.toc_xml_files, path)
+    else:
+        job.toc_lines = process_txt_toc(job.toc_txt_files, path)
+    artifacts.save_artifact(path, 'toc', key, job.toc_lines)
+
+
+def write_doc(job):
+    """
+    WRITE stage: maps keywords to the authority vocabulary, constructs Aleph strings for keywords and TOC
+    and writes the changed ones to an Aleph update file. When the record already has the same keywords and TOC,
+    no update file is created and the document is marked as finished. All the strings are cached as the 'record'
+    artifact, a finished document resolved without the fields of its record is compared with them instead.
+    :param job: DocumentJob of the processed document
+    :return: None
+    """
+    utility.check_deadline(job.deadline, 'write')
     aleph_update_strings = []
+    terms = authority.map_keywords(job.keywords)
+    if len(terms) > 0:
+        aleph_update_strings.append(utility.construct_aleph_string(doc_sysno=job.sysno, word_list=terms,
+                                                                   mode='keyword'))
+    aleph_update_strings.append(utility.construct_aleph_string(doc_sysno=job.sysno, word_list=job.toc_lines,
+                                                               mode='toc'))
+
+    if config.aleph_skip_unchanged and job.record_fields is None:
+        last_strings = get_last_update_strings(job)
+        if last_strings is not None and all(aleph_string in last_strings for aleph_string in aleph_update_strings):
+            print("Document {} has the same keywords and TOC as its last update, no update is needed.".format(
+                os.path.basename(job.path)))
+            return
+
+    # the update file may hold only the changed strings, the whole record is kept for the next comparison
+    artifacts.save_artifact(job.path, 'record', {'sysno': job.sysno}, aleph_update_strings)
+    if config.aleph_skip_unchanged and job.record_fields is not None:
+        current_strings = get_record_strings(job.sysno, job.record_fields)
+        aleph_update_strings = [aleph_string for aleph_string in aleph_update_strings
+                                if aleph_string not in current_strings]
+        if len(aleph_update_strings) == 0:
+            print("Record {} already has the same keywords and TOC, no update is needed.".format(job.sysno))
+            write_status_file(config.finished_state, job.path)
+            return
+
+    job.update_file = write_aleph_update_file(strings_list=aleph_update_strings, document_sysno=job.sysno,
+                                              location=job.path, doc_path=job.path)
+
+
+def get_last_update_strings(job):
+    """
+    Gets the Aleph strings of the keywords and TOC the record of a finished document was last updated with: the
+    'record' artifact cached by write_doc or, for documents written before it was cached, their last update file.
+    :param job: DocumentJob of the processed document
+    :return: list of Aleph strings or None, if the document isn't finished or has neither of them
+    """
+    if not os.path.isfile(os.path.join(job.path, config.finished_state)):
+        return None
 
-    try:
-        # get document sysno
-        sysno = get_document_sysno(doc_path=path)
-        # print("Document: {}\tSysno: {}".format(os.path.basename(path)), sysno)
-    except RuntimeError as e:
-        raise e
+    last_strings = artifacts.load_artifact(job.path, 'record', {'sysno': job.sysno})
+    if last_strings is not None:
+        return last_strings
 
-    try:
-        # get toc pages for each type
-        toc_xml_files = get_toc_pages(path=path, toc_type='xml')
-        toc_txt_files = get_toc_pages(path=path, toc_type='txt')
-        print("LENGTH - TOC FILES:", len(toc_xml_files))
-    except RuntimeError as e:
-        raise e
+    update_file = os.path.join(job.path, job.sysno + '_update')
+    if not os.path.isfile(update_file):
+        return None
 
-    try:
-        toc_xml_location = get_xml_files_location(xml_files_list=toc_xml_files, path=path)
-    except RuntimeError as e:
-        raise e
-    
-    try:
-        # process XML TOC
-        toc_keywords_list = process_xml_toc(toc_xml_location, path)
-    except RuntimeError as e:
-        raise e
-   
-    try:
-        # check TXT files presence
-        utility.check_txt_files_presence(toc_txt_files, path)
-    except IOError as e:
-        raise e
+    with open(update_file) as f:
+        return [line.rstrip('\n') for line in f]
 
-    try:
-        toc_contents_list = process_txt_toc(toc_txt_files, path)
-    except RuntimeError as e:
-        raise e
 
-    try:
-        aleph_string_keywords = utility.construct_aleph_string(doc_sysno=sysno,
-                                                               word_list=toc_keywords_list, mode='keyword')
-        aleph_update_strings.append(aleph_string_keywords)
-    except RuntimeError as e:
-        raise e
+def get_record_strings(sysno, record_fields):
+    """
+    Constructs Aleph strings from the current keyword and TOC fields of the record, in the same form as the strings
+    of the update file, so they can be compared.
+    :param sysno: system number of the document record
+    :param record_fields: fields returned by catalogue.read_document_record
+    :return: list of Aleph strings of the current record
+    """
+    current_strings = []
+    keywords = catalogue.get_subfield_values(record_fields, config.keywords_field_number, config.keywords_subfield)
+    if len(keywords) > 0:
+        current_strings.append(utility.construct_aleph_string(doc_sysno=sysno, word_list=keywords, mode='keyword'))
+    tocs = catalogue.get_subfield_values(record_fields, config.tocs_field_number, config.tocs_subfield)
+    if len(tocs) > 0:
+        current_strings.append(utility.construct_aleph_string(doc_sysno=sysno, word_list=tocs, mode='toc'))
 
-    try:
-        aleph_string_toc_contents = utility.construct_aleph_string(doc_sysno=sysno,
-                                                                   word_list=toc_contents_list, mode='toc')
-        aleph_update_strings.append(aleph_string_toc_contents)
-    except RuntimeError as e:
-        raise e
+    return current_strings
+
+
+# stages which depend only on the validated job and fill in disjoint fields of it
+GATHER_STAGES = [resolve_doc, extract_doc, normalize_doc]
 
+
+def _run_timed(stage, job, trace_parent=None):
+    started = time.time()
     try:
-        update_file_loc = write_aleph_update_file(strings_list=aleph_update_strings, document_sysno=sysno,
-                                                  location=path, doc_path=path)
-    except RuntimeError as e:
-        raise e
+        with tracing.span(stage.__name__.replace('_doc', ''), parent=trace_parent):
+            stage(job)
+    finally:
+        job.timings[stage.__name__.replace('_doc', '')] = time.time() - started
+
+
+def gather_doc(job):
+    """
+    GATHER stage: runs the independent stages of the document (Aleph lookup, KER extraction and TOC normalization)
+    concurrently and waits for all of them, so the document takes about as long as its slowest stage. The time
+    of each stage is recorded in job.timings. When a stage fails, job.failed_stage is set to its name and its error
+    is raised once the other stages have finished.
+    :param job: DocumentJob of the processed document
+    :return: None
+    """
+    # the stages run in other threads, their spans are added to the span of this stage explicitly
+    trace_parent = tracing.current_span()
+    with ThreadPoolExecutor(max_workers=len(GATHER_STAGES)) as executor:
+        futures = [(stage, executor.submit(_run_timed, stage, job, trace_parent)) for stage in GATHER_STAGES]
+
+    for stage, future in futures:
+        if future.exception() is not None:
+            job.failed_stage = stage.__name__.replace('_doc', '')
+            raise future.exception()
+
 
-    return update_file_loc
+def upload_update_file(sftp, update_file):
+    """
+    UPLOAD stage: copies the Aleph update file to the update directory on the Aleph server and marks the document
+    as finished.
+    :param sftp: open SFTP session to the Aleph server
+    :param update_file: path to an Aleph update file
+    :return: None
+    """
+    filename = os.path.basename(update_file)
+    remote_path = os.path.join(config.update_dir_location, filename)
+    print("Copying file {} to remote directory {}".format(update_file, remote_path))
+    with tracing.span('sftp.put', kind=tracing.KIND_CLIENT, **{'file.path': update_file,
+                                                                'sftp.remote_path': remote_path}) as span:
+        span.set_attribute('sftp.bytes', os.path.getsize(update_file))
+        sftp.put(update_file, remote_path)
+    write_status_file(config.finished_state, os.path.dirname(update_file))
 
 
 def write_status_file(status, path):
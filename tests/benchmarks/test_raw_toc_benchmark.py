@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Microbenchmarks of the TOC parser, reported as lines per second in the extra info of each benchmark.
+#
+# run: python -m pytest tests/benchmarks --benchmark-only
+
+import contextlib
+import glob
+import io
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from modules import raw_toc
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'corpus', 'raw_toc')
+
+
+def read_corpus_lines():
+    lines = []
+    for page in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt'))):
+        with open(page, encoding='utf-8') as f:
+            lines.extend(f.readlines())
+    return lines
+
+
+LINES = read_corpus_lines()
+
+
+def run_per_line(function, lines):
+    for line in lines:
+        function(line)
+
+
+def quiet(function, *args):
+    # raw_toc prints every processed line, printing is not what is measured
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+@pytest.mark.parametrize('function', [raw_toc.normalize_toc_string, raw_toc.strip_leading_chars,
+                                      raw_toc.strip_page_numbers, raw_toc.remove_dots,
+                                      raw_toc.replace_non_alphanumeric_chars, raw_toc.remove_whitespaces,
+                                      raw_toc.has_number_ending],
+                         ids=lambda function: function.__name__)
+def test_line_function(benchmark, function):
+    benchmark(quiet, run_per_line, function, LINES)
+    benchmark.extra_info['lines_per_second'] = round(len(LINES) / benchmark.stats.stats.mean)
+
+
+def test_get_toc_list(benchmark):
+    benchmark(quiet, raw_toc.get_toc_list, LINES)
+    benchmark.extra_info['lines_per_second'] = round(len(LINES) / benchmark.stats.stats.mean)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmark of the upload of Aleph update files over SFTP, against the in-process SFTP server behind a shaped
+# link. Files and bytes per second are reported in the extra info of each benchmark. The strategies of
+# ssh.upload_files differ in round trips: 'sequential' waits for the acknowledgement of every write and confirms every
+# file, 'pipelined' doesn't wait for writes nor confirm, 'multichannel' pipelines writes over several sessions.
+#
+# run: python -m pytest tests/benchmarks/test_sftp_benchmark.py --benchmark-only
+
+import os
+import random
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('paramiko')
+
+from modules import ssh
+from tests.sftp_server import SFTPServerStandIn
+
+FILES = 20
+# one-way latency in seconds and bandwidth in bytes per second of each direction
+LINKS = {
+    'lan': (0.0005, None),
+    'wan': (0.01, 2 * 1024 * 1024),
+}
+
+
+def get_update_file_sizes(count, seed=1):
+    # an update file has a 653 line with up to 15 keywords and a 505 line with the TOC: mostly a few kB,
+    # long TOCs of proceedings and collected works reach tens of kB
+    generator = random.Random(seed)
+    return [int(min(max(generator.lognormvariate(8.0, 0.8), 300), 64 * 1024)) for i in range(count)]
+
+
+@pytest.fixture(scope='module')
+def update_files(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('update_files')
+    paths = []
+    for position, size in enumerate(get_update_file_sizes(FILES)):
+        path = directory / '{:09d}_update'.format(position)
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture(scope='module')
+def sftp_server(tmp_path_factory):
+    server = SFTPServerStandIn(str(tmp_path_factory.mktemp('aleph_update_dir')))
+    yield server
+    server.close()
+
+
+@pytest.mark.parametrize('link', sorted(LINKS))
+@pytest.mark.parametrize('strategy', ['sequential', 'pipelined', 'multichannel'])
+def test_upload(benchmark, sftp_server, update_files, strategy, link):
+    latency, bandwidth = LINKS[link]
+    client, shaped_link = sftp_server.connect(latency=latency, bandwidth=bandwidth)
+
+    try:
+        sent = benchmark.pedantic(ssh.upload_files, args=(client, update_files, '/'),
+                                  kwargs={'strategy': strategy, 'channels': 4}, rounds=2, iterations=1)
+    finally:
+        client.close()
+        shaped_link.close()
+
+    assert sent == sum(os.path.getsize(path) for path in update_files)
+    benchmark.extra_info['files_per_second'] = round(len(update_files) / benchmark.stats.stats.mean, 1)
+    benchmark.extra_info['bytes_per_second'] = round(sent / benchmark.stats.stats.mean)
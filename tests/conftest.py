@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+import os
+import sys
+
+# modules are imported as 'from modules import ...', the same way kerator.py imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# without a local config.py, the modules are tested with the example configuration
+try:
+    importlib.import_module('config')
+except ImportError:
+    sys.modules['config'] = importlib.import_module('config_example')
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# In-process SFTP server standing in for the Aleph host: paramiko's server interface on a loopback socket,
+# storing uploaded files in a local directory. Clients connect through a shaped link, which delays and throttles
+# the traffic in both directions, so upload strategies can be compared for LAN and WAN conditions.
+
+import heapq
+import os
+import socket
+import threading
+import time
+
+import paramiko
+
+USER = 'kerator'
+PASSWORD = 'kerator'
+
+
+class StubServer(paramiko.ServerInterface):
+    """
+    Accepts the test user and the SFTP subsystem.
+    """
+
+    def check_auth_password(self, username, password):
+        if username == USER and password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class StubHandle(paramiko.SFTPHandle):
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+    """
+    Serves files of a local root directory, remote paths are relative to it.
+    """
+
+    def __init__(self, server, root, *args, **kwargs):
+        super(StubSFTPServer, self).__init__(server, *args, **kwargs)
+        self.root = root
+
+    def get_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def canonicalize(self, path):
+        return '/' + path.lstrip('/')
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self.get_path(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        mode = 'r+b' if flags & (os.O_WRONLY | os.O_RDWR) else 'rb'
+        handle = StubHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.get_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def list_folder(self, path):
+        try:
+            names = os.listdir(self.get_path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.get_path(path), name)), name)
+                for name in names]
+
+
+class ShapedLink(object):
+    """
+    TCP relay between the client and the server which delivers data after 'latency' seconds in each direction
+    and at most 'bandwidth' bytes per second. Without latency and bandwidth it's a plain loopback relay.
+    """
+
+    def __init__(self, target, latency=0.0, bandwidth=None):
+        self.target = target
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.address = self.listener.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, address = self.listener.accept()
+            except OSError:
+                return
+            server = socket.create_connection(self.target)
+            for source, sink in ((client, server), (server, client)):
+                queue = []
+                condition = threading.Condition()
+                threading.Thread(target=self._read, args=(source, queue, condition), daemon=True).start()
+                threading.Thread(target=self._write, args=(sink, queue, condition), daemon=True).start()
+
+    def _read(self, source, queue, condition):
+        sequence = 0
+        while True:
+            try:
+                data = source.recv(65536)
+            except OSError:
+                data = b''
+            with condition:
+                heapq.heappush(queue, (time.time() + self.latency, sequence, data))
+                condition.notify()
+            sequence += 1
+            if not data:
+                return
+
+    def _write(self, sink, queue, condition):
+        while True:
+            with condition:
+                while not queue:
+                    condition.wait()
+                deliver_at, sequence, data = heapq.heappop(queue)
+            delay = deliver_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if not data:
+                try:
+                    sink.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                return
+            if self.bandwidth:
+                time.sleep(len(data) / float(self.bandwidth))
+            try:
+                sink.sendall(data)
+            except OSError:
+                return
+
+    def close(self):
+        self.listener.close()
+
+
+class SFTPServerStandIn(object):
+    """
+    SFTP server on a loopback socket, storing uploaded files in 'root'.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.address = self.listener.getsockname()
+        self.transports = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, StubSFTPServer, self.root)
+            transport.start_server(server=StubServer())
+            self.transports.append(transport)
+
+    def connect(self, latency=0.0, bandwidth=None):
+        """
+        Connects an SSH client to the server through a shaped link.
+        :param latency: one-way delay in seconds
+        :param bandwidth: bytes per second in each direction or None
+        :return: tuple (paramiko.SSHClient, ShapedLink)
+        """
+        link = ShapedLink(self.address, latency=latency, bandwidth=bandwidth)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(link.address[0], port=link.address[1], username=USER, password=PASSWORD,
+                       look_for_keys=False, allow_agent=False)
+        return client, link
+
+    def close(self):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+
+import pytest
+
+import config
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+
+from modules import aio_pipeline  # noqa: E402
+from modules import isbn_index  # noqa: E402
+
+ALTO = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<alto xmlns="http://www.loc.gov/standards/alto/ns-v2#"><Layout><Page ID="p001"><PrintSpace>'
+        '<TextBlock ID="b1"><TextLine><String CONTENT="Úvod"/><SP/><String CONTENT="7"/></TextLine>'
+        '<TextLine><String CONTENT="Elektrochemie"/><SP/><String CONTENT="roztoků"/><SP/>'
+        '<String CONTENT="11"/></TextLine></TextBlock></PrintSpace></Page></Layout></alto>')
+FIND = '<find><set_number>000123</set_number><no_records>000000001</no_records></find>'
+PRESENT = '<present><record><doc_number>000012345</doc_number><metadata><oai_marc/></metadata></record></present>'
+FIND_DOC = ('<find-doc><record><metadata><oai_marc><varfield id="653" i1=" " i2=" ">'
+            '<subfield label="a">elektrochemie</subfield><subfield label="a">roztoky</subfield></varfield>'
+            '</oai_marc></metadata></record></find-doc>')
+
+
+async def start_servers(calls):
+    async def aleph(request):
+        calls.append(request.query['op'])
+        return web.Response(text={'find': FIND, 'find-doc': FIND_DOC}.get(request.query['op'], PRESENT))
+
+    async def ker(request):
+        calls.append('ker-' + request.query['language'])
+        await request.read()
+        return web.json_response({'keywords': ['elektrochemie', 'roztoky'], 'keyword_scores': [0.8, 0.4]})
+
+    app = web.Application()
+    app.router.add_get('/X/', aleph)
+    app.router.add_get('/X', aleph)
+    app.router.add_post('/ker', ker)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    for option, value in (('scheduler_cost_file', 'costs.json'), ('history_file', 'history.jsonl'),
+                          ('isbn_index_file', 'isbn.bin'), ('authority_index_file', 'authority.bin')):
+        monkeypatch.setattr(config, option, str(tmp_path / value), raising=False)
+    monkeypatch.setattr(config, 'cpu_workers', 0, raising=False)
+    monkeypatch.setattr(config, 'trace_file', None, raising=False)
+    doc_path = tmp_path / 'DONE_20240101_8071693111'
+    doc_path.mkdir()
+    (doc_path / 'toc_001.xml').write_text(ALTO, encoding='utf-8')
+    (doc_path / 'toc_001.txt').write_text('Úvod 7\nElektrochemie roztoků 11\n', encoding='utf-8')
+    return tmp_path, str(doc_path)
+
+
+def test_engine_processes_document(workdir, monkeypatch):
+    tmp_path, doc_path = workdir
+    calls = []
+
+    async def run():
+        runner, port = await start_servers(calls)
+        monkeypatch.setattr(config, 'aleph_api', 'http://127.0.0.1:{}/X'.format(port), raising=False)
+        monkeypatch.setattr(config, 'kerator_api', 'http://127.0.0.1:{}/ker?'.format(port), raising=False)
+        try:
+            return await aio_pipeline.run_async([doc_path], upload=False)
+        finally:
+            await runner.cleanup()
+
+    counters = asyncio.run(run())
+
+    assert counters == {'processed': 1, 'failed': 0, 'uploaded': 0, 'unchanged': 0}
+    assert sorted(calls) == ['find', 'ker-cs', 'ker-en', 'present']
+    with open(os.path.join(doc_path, '000012345_update'), encoding='utf-8') as f:
+        update = f.read()
+    assert 'elektrochemie' in update and 'Elektrochemie roztoků' in update
+    with open(config.history_file) as f:
+        assert json.loads(f.readline())['ker_strategies'] == {'whole': 1}
+
+
+def test_engine_compares_record_of_sysno_from_offline_index(workdir, monkeypatch):
+    pytest.importorskip('xmltodict')
+    tmp_path, doc_path = workdir
+    monkeypatch.setattr(config, 'aleph_skip_unchanged', True)
+    isbn_index.build_index([('80-7169-311-1', '000012345')], config.isbn_index_file)
+    calls = []
+
+    async def run():
+        runner, port = await start_servers(calls)
+        monkeypatch.setattr(config, 'aleph_api', 'http://127.0.0.1:{}/X'.format(port), raising=False)
+        monkeypatch.setattr(config, 'kerator_api', 'http://127.0.0.1:{}/ker?'.format(port), raising=False)
+        try:
+            return await aio_pipeline.run_async([doc_path], upload=False)
+        finally:
+            await runner.cleanup()
+
+    counters = asyncio.run(run())
+
+    assert counters['processed'] == 1
+    assert sorted(calls) == ['find-doc', 'ker-cs', 'ker-en']
+    # the record already has the keywords, only the TOC is updated
+    with open(os.path.join(doc_path, '000012345_update'), encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 1 and lines[0].startswith('000012345 505')
+
+
+def test_engine_uploads_over_one_sftp_session(workdir, monkeypatch):
+    asyncssh = pytest.importorskip('asyncssh')
+    from tests.sftp_server import PASSWORD, USER, SFTPServerStandIn
+
+    tmp_path, doc_path = workdir
+    remote = tmp_path / 'remote'
+    remote.mkdir()
+    monkeypatch.setattr(config, 'update_dir_location', '/', raising=False)
+    update_files = []
+    for number in range(3):
+        update_file = tmp_path / 'DONE_2024020{}_8071693111'.format(number) / '00001234{}_update'.format(number)
+        update_file.parent.mkdir()
+        update_file.write_text('00001234{} 653   L $$aelektrochemie\n'.format(number), encoding='utf-8')
+        update_files.append(str(update_file))
+    server = SFTPServerStandIn(str(remote))
+
+    async def run():
+        async with aio_pipeline.AsyncEngine(upload=True) as engine:
+            engine.ssh = await asyncssh.connect(server.address[0], port=server.address[1], username=USER,
+                                                password=PASSWORD, known_hosts=None)
+            engine.sftp = await engine.ssh.start_sftp_client()
+            await asyncio.gather(*[engine.upload_update_file(update_file) for update_file in update_files])
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.close()
+
+    assert sorted(os.listdir(str(remote))) == ['000012340_update', '000012341_update', '000012342_update']
+    for update_file in update_files:
+        assert os.path.isfile(os.path.join(os.path.dirname(update_file), config.finished_state))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+import config
+from modules import alto
+from modules import workflow
+from modules.job import DocumentJob
+
+NAMESPACES = ['http://www.loc.gov/standards/alto/ns-v2#', 'http://www.loc.gov/standards/alto/ns-v3#',
+              'http://www.loc.gov/standards/alto/ns-v4#', None]
+
+
+def make_alto(blocks, namespace=NAMESPACES[0]):
+    # blocks: list of TextBlocks, each a list of TextLines, each a list of words
+    xmlns = ' xmlns="{}"'.format(namespace) if namespace is not None else ''
+    body = ''
+    for block in blocks:
+        body += '<TextBlock>'
+        for line in block:
+            body += '<TextLine HPOS="10" VPOS="20">'
+            body += '<SP/>'.join('<String CONTENT="{}" WC="0.9"/>'.format(word) for word in line)
+            body += '</TextLine>'
+        body += '</TextBlock>'
+    return ('<?xml version="1.0" encoding="UTF-8"?><alto{}><Layout><Page ID="p001"><PrintSpace>{}'
+            '</PrintSpace></Page></Layout></alto>').format(xmlns, body)
+
+
+PAGE = [[['Obsah']], [['Úvod', '7'], ['Elektrochemie', 'roztoků', '11']], [['Rejstřík', '112']]]
+
+
+@pytest.fixture
+def page_file(tmp_path):
+    def write(name, blocks, namespace=NAMESPACES[0]):
+        path = tmp_path / name
+        path.write_text(make_alto(blocks, namespace), encoding='utf-8')
+        return str(path)
+    return write
+
+
+def test_lines_in_reading_order_across_blocks(page_file):
+    lines = list(alto.iter_alto_lines(page_file('toc_001.xml', PAGE)))
+
+    assert lines == ['Obsah', 'Úvod 7', 'Elektrochemie roztoků 11', 'Rejstřík 112']
+
+
+@pytest.mark.parametrize('namespace', NAMESPACES)
+def test_namespace_versions(page_file, namespace):
+    assert list(alto.iter_alto_lines(page_file('toc_001.xml', PAGE, namespace))) == \
+        ['Obsah', 'Úvod 7', 'Elektrochemie roztoků 11', 'Rejstřík 112']
+
+
+def test_empty_pages(tmp_path, page_file):
+    empty = page_file('toc_001.xml', [[[]], []])
+    page = page_file('toc_002.xml', PAGE[1:2])
+    assert list(alto.iter_alto_lines(empty)) == []
+
+    text_file = alto.write_alto_text([empty, page], str(tmp_path / 'text.txt'))
+    with open(text_file, encoding='utf-8') as f:
+        assert f.read() == 'Úvod 7\nElektrochemie roztoků 11\n'
+
+    with pytest.raises(RuntimeError):
+        alto.write_alto_text([empty], str(tmp_path / 'empty.txt'))
+
+
+def test_text_location_is_reused_for_the_same_pages(tmp_path, page_file):
+    pages = [page_file('toc_001.xml', PAGE)]
+
+    text_file = workflow.get_text_location(pages, str(tmp_path))
+    assert os.path.basename(text_file) == config.ker_text_prefix + tmp_path.name + '.txt'
+    modified = os.path.getmtime(text_file) - 10
+    os.utime(text_file, (modified, modified))
+
+    assert workflow.get_text_location(pages, str(tmp_path)) == text_file
+    assert os.path.getmtime(text_file) == modified
+    with pytest.raises(RuntimeError):
+        workflow.get_text_location([], str(tmp_path))
+
+
+def test_toc_is_synthesized_from_alto_without_txt_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'cpu_workers', 0, raising=False)
+    monkeypatch.setattr(config, 'alto_synthesize_toc', True, raising=False)
+    doc_path = tmp_path / 'DONE_20240101_8071693111'
+    doc_path.mkdir()
+    (doc_path / 'toc_001.xml').write_text(make_alto(PAGE), encoding='utf-8')
+    (tmp_path / 'toc_001.txt').write_text('Obsah\nÚvod 7\nElektrochemie roztoků 11\nRejstřík 112\n', encoding='utf-8')
+    job = DocumentJob(str(doc_path))
+    job.toc_xml_files = [str(doc_path / 'toc_001.xml')]
+    job.toc_txt_files = []
+
+    workflow.normalize_doc(job)
+
+    assert len(job.toc_lines) > 0
+    # the same lines as from a TXT page with the text of the ALTO page
+    assert job.toc_lines == workflow.process_txt_toc([str(tmp_path / 'toc_001.txt')], str(tmp_path))
+
+    monkeypatch.setattr(config, 'alto_synthesize_toc', False, raising=False)
+    job.toc_lines = None
+    with pytest.raises(IOError):
+        workflow.normalize_doc(job)
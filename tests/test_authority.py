@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import config
+from modules import authority
+
+AUTHORITY_SEQ = """\
+000000001 15007 L $$aChemie
+000000001 45007 L $$aChemistry
+000000002 15007 L $$aAnalytická chemie
+000000002 45007 L $$aChemical analysis
+000000003 15007 L $$aDějiny
+000000003 45007 L $$aHistory
+"""
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    export_file = tmp_path / 'authority.seq'
+    export_file.write_text(AUTHORITY_SEQ, encoding='utf-8')
+    path = str(tmp_path / 'authority.bin')
+    assert authority.import_export(str(export_file), path) == 3
+    return path
+
+
+def test_normalize_term():
+    assert authority.normalize_term(' Analytická  CHEMIE, ') == 'analytická chemie'
+
+
+@pytest.mark.parametrize('keyword, terms', [
+    ('chemistry', ['Chemie']),
+    ('Chemical Analysis', ['Analytická chemie']),
+    ('history of chemistry', ['Dějiny', 'Chemie']),
+    ('chemical', []),
+])
+def test_match_terms(index_file, keyword, terms):
+    index = authority.open_index(index_file)
+
+    assert authority.match_terms(index, keyword) == terms
+
+
+def test_map_keywords_keeps_unmatched_keywords(index_file, monkeypatch):
+    monkeypatch.setattr(config, 'authority_keep_unmatched', True)
+
+    assert authority.map_keywords(['chemie', 'Chemistry', 'elektrolyt'], index_file) == ['Chemie', 'elektrolyt']
+
+
+def test_map_keywords_drops_unmatched_keywords(index_file, monkeypatch):
+    monkeypatch.setattr(config, 'authority_keep_unmatched', False)
+
+    assert authority.map_keywords(['elektrolyt', 'history'], index_file) == ['Dějiny']
+
+
+def test_map_keywords_without_index(tmp_path):
+    assert authority.map_keywords(['elektrolyt'], str(tmp_path / 'missing.bin')) == ['elektrolyt']
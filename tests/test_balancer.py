@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import config
+from modules import balancer
+from modules import quarantine
+from modules import utility
+from modules.balancer import Balancer
+from modules.errors import KerUnavailable
+
+ENDPOINTS = ['http://ker1/?', 'http://ker2/?', 'http://ker3/?']
+
+
+def test_acquire_prefers_less_outstanding_requests():
+    balancer = Balancer(ENDPOINTS[:2])
+    busy = balancer.acquire()
+
+    assert balancer.acquire() != busy
+
+
+def test_failing_endpoint_is_ejected():
+    balancer = Balancer(ENDPOINTS)
+    for i in range(config.ker_eject_failures):
+        balancer.acquire(exclude=ENDPOINTS[1:])
+        balancer.release(ENDPOINTS[0], ok=False)
+
+    assert all(balancer.acquire() != ENDPOINTS[0] for i in range(20))
+
+
+def test_success_resets_failures():
+    balancer = Balancer(ENDPOINTS)
+    balancer.acquire(exclude=ENDPOINTS[1:])
+    balancer.release(ENDPOINTS[0], ok=False)
+    balancer.acquire(exclude=ENDPOINTS[1:])
+    balancer.release(ENDPOINTS[0], ok=True)
+
+    assert balancer.get_state()[ENDPOINTS[0]]['failures'] == 0
+
+
+def test_cancelled_request_does_not_change_health():
+    balancer = Balancer(ENDPOINTS)
+    endpoint = balancer.acquire()
+    balancer.release(endpoint, ok=None)
+
+    assert balancer.get_state()[endpoint] == {'outstanding': 0, 'failures': 0, 'ejected_until': 0}
+
+
+def test_all_endpoints_ejected_picks_first_to_return():
+    balancer = Balancer(ENDPOINTS[:1])
+    for i in range(config.ker_eject_failures):
+        balancer.release(balancer.acquire(), ok=False)
+
+    assert balancer.acquire() == ENDPOINTS[0]
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.content = b'{}'
+
+
+@pytest.fixture
+def ker_replicas(tmp_path, monkeypatch):
+    requests = pytest.importorskip('requests')
+    monkeypatch.setattr(config, 'kerator_api', ENDPOINTS[:2], raising=False)
+    monkeypatch.setattr(config, 'ker_hedging', False, raising=False)
+    monkeypatch.setattr(balancer, '_balancers', {})
+    # the first replica is picked first
+    monkeypatch.setattr(balancer.random, 'sample', lambda population, k: list(population)[:k])
+    toc_file = tmp_path / 'toc.txt'
+    toc_file.write_text('Elektrochemie roztoků 11\n', encoding='utf-8')
+    statuses = {}
+    posted = []
+
+    def post(url, data=None, headers=None, timeout=None):
+        endpoint = url[:len(ENDPOINTS[0])]
+        posted.append(endpoint)
+        return FakeResponse(statuses[endpoint])
+
+    monkeypatch.setattr(requests, 'post', post)
+    return str(toc_file), statuses, posted
+
+
+def test_server_error_is_retried_on_other_replica(ker_replicas):
+    toc_file, statuses, posted = ker_replicas
+    statuses.update({ENDPOINTS[0]: 503, ENDPOINTS[1]: 200})
+
+    responses = utility.send_ker_request(['cs'], toc_file)
+
+    assert responses['cs'].status_code == 200
+    assert posted == ENDPOINTS[:2]
+    state = balancer.get_ker_balancer().get_state()
+    assert state[ENDPOINTS[0]]['failures'] == 1 and state[ENDPOINTS[1]]['failures'] == 0
+
+
+def test_server_error_of_all_replicas_is_network_failure(ker_replicas):
+    toc_file, statuses, posted = ker_replicas
+    statuses.update({ENDPOINTS[0]: 500, ENDPOINTS[1]: 502})
+
+    with pytest.raises(KerUnavailable) as e:
+        utility.send_ker_request(['cs'], toc_file)
+
+    assert sorted(posted) == ENDPOINTS[:2]
+    assert quarantine.classify_error(e.value) == 'network'
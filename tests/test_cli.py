@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import config
+import kerator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs a command in a fresh interpreter with the example configuration and prints the heavy modules it imported
+LAZY_IMPORTS = '''
+import importlib, sys
+sys.modules['config'] = importlib.import_module('config_example')
+import config
+config.obsahator_dir = sys.argv[2]
+import kerator
+kerator.main([sys.argv[1]])
+print(' '.join(sorted(name for name in ('requests', 'xmltodict', 'paramiko') if name in sys.modules)))
+'''
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    called = []
+    monkeypatch.setattr(kerator, 'COMMANDS', dict((name, lambda args, name=name: called.append((name, args)) or 0)
+                                                  for name in kerator.COMMANDS))
+    return called
+
+
+@pytest.mark.parametrize('argv', [
+    ['run'], ['scan'], ['process'], ['upload'], ['status'], ['report'], ['quarantine', '--release', 'DONE_1'],
+    ['reprocess', '--all', '--redo', 'extract', '--no-upload'], ['keywords', 'DONE_1', '--threshold', '0.3'],
+    ['import-isbn-index', 'export.seq', '--format', 'marc'], ['import-authority', 'auth.tsv', '--format', 'tsv'],
+])
+def test_each_subcommand_is_dispatched(commands, argv):
+    assert kerator.main(argv) == 0
+    assert [name for name, args in commands] == [argv[0]]
+
+
+def test_no_subcommand_means_run(commands):
+    kerator.main(['--budget', '30'])
+
+    name, args = commands[0]
+    assert name == 'run'
+    assert args.budget == 30 and args.deadline is None
+
+
+def test_engine_defaults_by_command(commands, monkeypatch):
+    monkeypatch.setattr(config, 'pipeline_engine', 'threads', raising=False)
+    monkeypatch.setattr(config, 'reprocess_engine', 'asyncio', raising=False)
+
+    kerator.main(['process'])
+    kerator.main(['reprocess', '--all'])
+    kerator.main(['reprocess', '--all', '--engine', 'threads'])
+
+    assert [args.engine for name, args in commands] == ['threads', 'asyncio', 'threads']
+
+
+def test_deadline_and_budget_are_mutually_exclusive(commands):
+    with pytest.raises(SystemExit):
+        kerator.main(['run', '--deadline', '05:30', '--budget', '30'])
+    assert commands == []
+
+
+@pytest.mark.parametrize('command', ['status', 'scan'])
+def test_light_commands_do_not_import_network_libraries(tmp_path, command):
+    output = subprocess.run([sys.executable, '-c', LAZY_IMPORTS, command, str(tmp_path)], cwd=ROOT, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    assert output.splitlines()[-1] == ''
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+import config
+from modules import balancer
+from modules import catalogue
+from modules import utility
+from modules.errors import DocumentTimeout
+
+
+def test_call_is_capped_at_remaining_budget():
+    assert utility.get_call_timeout((5, 120)) == (5, 120)
+
+    connect, read = utility.get_call_timeout((5, 120), deadline=time.time() + 30)
+
+    assert connect == 5
+    assert 29 < read <= 30
+    assert max(utility.get_call_timeout((5, 120), deadline=time.time() + 2)) <= 2
+
+
+def test_expired_deadline_stops_stage():
+    utility.check_deadline(None, 'write')
+    utility.check_deadline(time.time() + 60, 'write')
+
+    with pytest.raises(DocumentTimeout):
+        utility.check_deadline(time.time() - 1, 'write')
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    requests = pytest.importorskip('requests')
+    sent = []
+
+    def send(url, **kwargs):
+        sent.append(url)
+        raise requests.Timeout("Read timed out")
+
+    monkeypatch.setattr(requests, 'get', send)
+    monkeypatch.setattr(requests, 'post', send)
+    monkeypatch.setattr(config, 'ker_hedging', False, raising=False)
+    monkeypatch.setattr(config, 'kerator_api', 'http://ker1/?', raising=False)
+    monkeypatch.setattr(balancer, '_balancers', {})
+    return sent
+
+
+def test_expired_deadline_raises_before_request_is_sent(tmp_path, requests):
+    toc_file = tmp_path / 'toc.txt'
+    toc_file.write_text('Elektrochemie roztoků 11\n', encoding='utf-8')
+
+    with pytest.raises(DocumentTimeout):
+        catalogue.fetch_query('aleph.find', 'http://aleph/X?op=find', deadline=time.time() - 1)
+    with pytest.raises(DocumentTimeout):
+        utility.send_ker_request(['cs'], str(toc_file), deadline=time.time() - 1)
+
+    assert requests == []
+    # the replica isn't blamed for the expired deadline
+    assert balancer.get_ker_balancer().get_state()['http://ker1/?']['failures'] == 0
+
+
+def test_timeout_of_call_is_document_timeout(tmp_path, requests):
+    toc_file = tmp_path / 'toc.txt'
+    toc_file.write_text('Elektrochemie roztoků 11\n', encoding='utf-8')
+
+    with pytest.raises(DocumentTimeout):
+        catalogue.fetch_query('aleph.find', 'http://aleph/X?op=find', deadline=time.time() + 60)
+    with pytest.raises(DocumentTimeout):
+        utility.send_ker_request(['cs'], str(toc_file), deadline=time.time() + 60)
+
+    assert requests == ['http://aleph/X?op=find', 'http://ker1/?' + '&'.join(utility.get_ker_params('cs', 0.2, 15))]
+
+
+def test_asyncio_call_is_limited_as_a_whole():
+    pytest.importorskip('aiohttp')
+    from modules import aio_pipeline
+
+    timeout = aio_pipeline.get_client_timeout((5, 120), deadline=time.time() + 30)
+
+    assert timeout.sock_connect == 5 and 29 < timeout.sock_read <= 30
+    assert 29 < timeout.total <= 30
+    assert aio_pipeline.get_client_timeout((5, 120)).total is None
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import zipfile
+
+from modules import dedupe
+from modules import utility
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', 'raw_toc')
+
+PAGE = ("Obsah Úvod 7 Kapitola 1 Elektrochemie roztoků a rozhraní 11 Kapitola 2 Vodivost elektrolytů 35 "
+        "Kapitola 3 Elektrodové děje a polarizace 58 Kapitola 4 Galvanické články 81 Rejstřík 112")
+# the same page scanned again, with a few OCR errors
+RESCANNED_PAGE = ("Obsah Uvod 7 Kapitola 1 Elektrochemie roztoků a rozhraní 11 Kapitola 2 Vodivost elektrolytu 35 "
+                  "Kapitola 3 Elektrodové děje a polarizace 58 Kapitola 4 Galvanické články 81 Rejstřík 112")
+
+
+def read_corpus_pages():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt'))):
+        with open(path, encoding='utf-8') as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
+
+
+def test_find_duplicates_exact_and_near():
+    pages = [('toc_001', PAGE), ('toc_002', PAGE.upper()), ('toc_003', RESCANNED_PAGE)]
+
+    assert dedupe.find_duplicates(pages) == {'toc_002': 'toc_001', 'toc_003': 'toc_001'}
+
+
+def test_find_duplicates_keeps_different_pages():
+    assert dedupe.find_duplicates(read_corpus_pages()) == {}
+
+
+def test_dedupe_pages_removes_both_files_of_duplicate(tmp_path):
+    for name, text in (('toc_001', PAGE), ('toc_002', RESCANNED_PAGE)):
+        (tmp_path / (name + '.txt')).write_text(text, encoding='utf-8')
+        (tmp_path / (name + '.xml')).write_text('<alto/>', encoding='utf-8')
+    toc_xml_files = [str(tmp_path / 'toc_001.xml'), str(tmp_path / 'toc_002.xml')]
+    toc_txt_files = [str(tmp_path / 'toc_001.txt'), str(tmp_path / 'toc_002.txt')]
+
+    toc_xml_files, toc_txt_files, duplicates = dedupe.dedupe_pages(toc_xml_files, toc_txt_files)
+
+    assert toc_xml_files == [str(tmp_path / 'toc_001.xml')]
+    assert toc_txt_files == [str(tmp_path / 'toc_001.txt')]
+    assert duplicates == {'toc_002': 'toc_001'}
+
+
+def test_zip_of_deduplicated_pages_replaces_old_archive(tmp_path):
+    pages = []
+    for number in range(3):
+        page = tmp_path / 'toc_{:03d}.xml'.format(number + 1)
+        page.write_text(PAGE, encoding='utf-8')
+        pages.append(str(page))
+    utility.zip_tocs(pages, 'tocs_doc', str(tmp_path))
+
+    # the last page was dropped as a duplicate since the earlier run
+    zip_path = utility.zip_tocs(pages[:2], 'tocs_doc', str(tmp_path))
+
+    with zipfile.ZipFile(zip_path) as zip_file:
+        assert zip_file.namelist() == ['toc_001.xml', 'toc_002.xml']
+    assert not os.path.exists(zip_path + '.tmp')
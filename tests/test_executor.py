@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+
+import pytest
+
+import config
+from modules import executor
+from modules import raw_toc
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', 'raw_toc')
+
+
+@pytest.fixture
+def pool_workers(monkeypatch, tmp_path):
+    # worker processes import 'config' themselves, the example configuration is made importable under that name
+    (tmp_path / 'config.py').write_text('from config_example import *\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(config, 'cpu_workers', 2)
+    monkeypatch.setattr(config, 'cpu_chunk_size', 2)
+    yield
+    executor.shutdown()
+
+
+def test_map_cpu_matches_calling_thread(pool_workers):
+    pages = sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt')))
+
+    assert executor.map_cpu(raw_toc.get_page_toc_list, pages) == [raw_toc.get_page_toc_list(page) for page in pages]
+
+
+def test_call_cpu_raises_worker_errors(pool_workers, tmp_path):
+    with pytest.raises(IOError):
+        executor.call_cpu(raw_toc.get_page_toc_list, str(tmp_path / 'missing.txt'))
+
+
+def test_disabled_pool_runs_in_calling_thread(monkeypatch):
+    monkeypatch.setattr(config, 'cpu_workers', 0)
+
+    assert executor.get_pool() is None
+    assert executor.call_cpu(len, 'toc') == 3
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from modules import workflow
+from modules.job import DocumentJob
+
+
+def slow_doc(job):
+    time.sleep(0.2)
+
+
+def lookup_doc(job):
+    time.sleep(0.2)
+    job.sysno = '000000001'
+
+
+def broken_doc(job):
+    raise RuntimeError("KER is down")
+
+
+def test_gather_doc_runs_stages_concurrently(monkeypatch):
+    monkeypatch.setattr(workflow, 'GATHER_STAGES', [slow_doc, lookup_doc, slow_doc])
+    job = DocumentJob('DONE_20240101_8071693111')
+
+    started = time.time()
+    workflow.gather_doc(job)
+
+    assert time.time() - started < 0.5
+    assert job.sysno == '000000001'
+    assert set(job.timings) == {'slow', 'lookup'}
+
+
+def test_gather_doc_reports_failed_stage_after_others_finish(monkeypatch):
+    monkeypatch.setattr(workflow, 'GATHER_STAGES', [lookup_doc, broken_doc])
+    job = DocumentJob('DONE_20240101_8071693111')
+
+    with pytest.raises(RuntimeError):
+        workflow.gather_doc(job)
+
+    assert job.failed_stage == 'broken'
+    assert job.sysno == '000000001'
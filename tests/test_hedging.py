@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+import config
+from modules import balancer
+from modules import hedging
+
+
+@pytest.fixture(autouse=True)
+def hedging_state(monkeypatch):
+    monkeypatch.setattr(config, 'ker_hedging', True, raising=False)
+    monkeypatch.setattr(config, 'ker_hedge_percentile', 95, raising=False)
+    monkeypatch.setattr(config, 'ker_hedge_min_samples', 20, raising=False)
+    monkeypatch.setattr(config, 'ker_hedge_max_ratio', 1.0, raising=False)
+    hedging._latencies.clear()
+    monkeypatch.setattr(hedging, '_stats', {'calls': 0, 'hedges': 0, 'hedge_wins': 0})
+    yield
+    hedging._latencies.clear()
+
+
+def observe(latencies):
+    for seconds in latencies:
+        hedging.record_latency(seconds)
+
+
+def make_attempt(durations, cancellations=None, errors=()):
+    """
+    Attempt whose n-th run takes durations[n] seconds (waiting ends early when it's cancelled) and returns n.
+    """
+    runs = []
+
+    def attempt(cancelled):
+        number = len(runs)
+        runs.append(cancelled)
+        if cancellations is not None:
+            cancelled.on_cancel(lambda: cancellations.append(number))
+        time.sleep(durations[number])
+        if number in errors:
+            raise RuntimeError("attempt {} failed".format(number))
+        return number
+
+    return attempt, runs
+
+
+def test_hedge_delay_is_percentile_of_recent_latencies():
+    observe([i / 1000.0 for i in range(1, 20)])
+    assert hedging.get_hedge_delay() is None
+
+    observe([i / 1000.0 for i in range(20, 101)])
+    assert hedging.get_hedge_delay() == 0.095
+
+
+def test_fast_call_is_not_hedged():
+    observe([0.2] * 20)
+    attempt, runs = make_attempt([0.01])
+
+    assert hedging.hedged_call(attempt) == 0
+    assert len(runs) == 1
+    assert hedging.get_stats() == {'calls': 1, 'hedges': 0, 'hedge_wins': 0}
+
+
+def test_slow_call_is_hedged_and_first_result_wins():
+    observe([0.01] * 20)
+    cancellations = []
+    attempt, runs = make_attempt([0.5, 0.01], cancellations=cancellations)
+
+    started = time.time()
+    assert hedging.hedged_call(attempt) == 1
+
+    assert time.time() - started < 0.3
+    assert cancellations == [0]
+    assert hedging.get_stats() == {'calls': 1, 'hedges': 1, 'hedge_wins': 1}
+    # the cancelled attempt finishes later, its latency is not recorded
+    time.sleep(0.6)
+    assert len(hedging._latencies) == 21
+
+
+def test_failed_hedge_falls_back_to_primary():
+    observe([0.01] * 20)
+    attempt, runs = make_attempt([0.2, 0.0], errors=(1,))
+
+    assert hedging.hedged_call(attempt) == 0
+    assert hedging.get_stats() == {'calls': 1, 'hedges': 1, 'hedge_wins': 0}
+
+
+def test_hedges_are_capped_by_max_ratio(monkeypatch):
+    monkeypatch.setattr(config, 'ker_hedge_max_ratio', 0.5, raising=False)
+    observe([0.01] * 20)
+    attempt, runs = make_attempt([0.1, 0.1, 0.0, 0.1])
+
+    # the first hedge would be 1 of 1 calls, the second 2 of 3
+    hedging.hedged_call(attempt)
+    assert hedging.get_stats()['hedges'] == 0
+    hedging.hedged_call(attempt)
+    hedging.hedged_call(attempt)
+
+    assert len(runs) == 4
+    assert hedging.get_stats() == {'calls': 3, 'hedges': 1, 'hedge_wins': 1}
+
+
+def test_cancelled_lease_frees_endpoint_once():
+    ker_balancer = balancer.Balancer(['http://ker1/', 'http://ker2/'])
+    cancellation = hedging.Cancellation()
+    lease = ker_balancer.lease()
+    cancellation.on_cancel(lambda: lease.release(None))
+
+    cancellation.set()
+    assert ker_balancer.get_state()[lease.endpoint]['outstanding'] == 0
+
+    # the late result of the request changes neither the count nor the health of the endpoint
+    lease.release(False)
+    assert ker_balancer.get_state()[lease.endpoint] == {'outstanding': 0, 'failures': 0, 'ejected_until': 0}
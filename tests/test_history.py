@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+import config
+from modules import history
+from modules.job import DocumentJob
+
+
+def make_run(throughput, p50, p90=None, documents=100):
+    return {'started': '2024-01-01 02:00:00', 'wall_seconds': 3600.0, 'documents': documents, 'failed': 0,
+            'throughput': throughput, 'bytes_uploaded': 0,
+            'errors': {'invalid': 0, 'aleph': 0, 'ker': 0, 'upload': 0, 'other': 0},
+            'ker_strategies': {},
+            'stages': {'extract': {'count': documents, 'p50': p50, 'p90': p90 or p50 * 2, 'p99': p50 * 4}}}
+
+
+@pytest.fixture
+def history_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'history_baseline_runs', 3, raising=False)
+    monkeypatch.setattr(config, 'history_tolerance', 0.25, raising=False)
+    monkeypatch.setattr(config, 'history_min_documents', 20, raising=False)
+    return str(tmp_path / 'history.jsonl')
+
+
+def save_runs(history_file, runs):
+    for run in runs:
+        history.save_run(run, history_file=history_file)
+
+
+def test_histogram_buckets_grow_by_ratio():
+    histogram = history.new_histogram()
+    for seconds in (0.0005, 0.001, 0.00125, 0.0013, 1000000):
+        history.add_to_histogram(histogram, seconds)
+
+    assert histogram[0] == 2
+    assert histogram[1] == 1
+    assert histogram[2] == 1
+    assert histogram[history.BUCKET_COUNT - 1] == 1
+
+
+def test_percentiles_are_upper_bounds_of_buckets():
+    histogram = history.new_histogram()
+    assert history.get_percentile(histogram, 50) is None
+
+    for seconds in [0.1] * 90 + [1.0] * 9 + [10.0]:
+        history.add_to_histogram(histogram, seconds)
+
+    p50 = history.get_percentile(histogram, 50)
+    p90 = history.get_percentile(histogram, 90)
+    p99 = history.get_percentile(histogram, 99)
+    assert 0.1 <= p50 < 0.1 * history.BUCKET_RATIO
+    assert p90 == p50
+    assert 1.0 <= p99 < 1.0 * history.BUCKET_RATIO
+    assert 10.0 <= history.get_percentile(histogram, 100) < 10.0 * history.BUCKET_RATIO
+
+
+def test_median():
+    assert history.median([3, 1, 2]) == 2
+    assert history.median([4, 1, 3, 2]) == 2.5
+
+
+def test_regression_against_median_of_recent_runs(history_file):
+    # the oldest run is outside the baseline of the last 3 runs, its slow extraction doesn't count
+    save_runs(history_file, [make_run(100, 20.0), make_run(100, 1.0), make_run(90, 1.2), make_run(110, 0.9),
+                             make_run(70, 1.6)])
+
+    regressions = history.report(history_file)
+
+    assert len(regressions) == 3
+    assert regressions[0].startswith("throughput 70 docs/h is lower than baseline 100 docs/h")
+    assert any(regression.startswith("extract p50 latency 1.6 s") for regression in regressions)
+
+
+def test_no_regression_within_tolerance(history_file):
+    save_runs(history_file, [make_run(100, 1.0), make_run(90, 1.2), make_run(110, 0.9), make_run(80, 1.24)])
+
+    assert history.report(history_file) == []
+
+
+def test_too_few_baseline_runs(history_file):
+    save_runs(history_file, [make_run(10, 100.0)])
+    assert history.report(history_file) == []
+
+    # runs without documents are not part of the baseline
+    save_runs(history_file, [make_run(0, 1.0, documents=0), make_run(100, 1.0, documents=0)])
+    assert history.report(history_file) == []
+
+
+def test_small_run_throughput_is_not_compared(history_file):
+    save_runs(history_file, [make_run(100, 1.0), make_run(90, 1.0), make_run(110, 1.0),
+                             make_run(5, 1.0, documents=3)])
+
+    assert history.report(history_file) == []
+
+
+def make_job(started, update_file=None, bytes_uploaded=0):
+    job = DocumentJob('DONE_20240101_8071693111')
+    job.started = started
+    job.timings = {'write': 0.1, 'upload': 0.1}
+    job.update_file = update_file
+    job.bytes_uploaded = bytes_uploaded
+    return job
+
+
+def test_throughput_over_processing_time_and_sent_bytes(tmp_path):
+    run = history.new_run()
+    # the run started long before its documents, e.g. by a slow scan of the backlog
+    run['started'] -= 3600
+    now = time.time()
+    update_file = tmp_path / '000012345_update'
+    update_file.write_text('000012345 653   L $$aelektrochemie\n', encoding='utf-8')
+    history.record_doc(run, make_job(now - 2, str(update_file), bytes_uploaded=35))
+    # update file appended to a reprocess batch which was not uploaded
+    history.record_doc(run, make_job(now - 1, str(update_file)))
+
+    summary = history.summarize_run(run)
+
+    assert 1.9 < summary['processing_seconds'] < 3
+    assert summary['throughput'] > 2000
+    assert summary['bytes_uploaded'] == 35
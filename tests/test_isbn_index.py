@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+
+import config
+from modules import catalogue
+from modules import isbn_index
+from modules import workflow
+
+ALEPH_EXPORT = """000012345 02000 L $$a80-7169-311-1$$qváz.
+000012345 24510 L $$aElektrochemie
+000012346 02000 L $$a978-80-7080-123-4 (brož.)
+000012346 02000 L $$a0-8044-2957-X
+"""
+
+
+def make_marc_record(fields):
+    # ISO 2709 record: leader, directory of 12 bytes entries, fields ended by the field terminator
+    directory = b''
+    data = b''
+    for tag, value in fields:
+        field = value.encode('utf-8') + b'\x1e'
+        directory += tag + str(len(field)).zfill(4).encode('ascii') + str(len(data)).zfill(5).encode('ascii')
+        data += field
+    base_address = 24 + len(directory) + 1
+    length = base_address + len(data) + 1
+    leader = str(length).zfill(5).encode('ascii') + b'nam a22' + str(base_address).zfill(5).encode('ascii') + \
+        b'   4500'
+    return leader + directory + b'\x1e' + data + b'\x1d'
+
+
+@pytest.mark.parametrize('isbn, isbn13', [
+    ('80-7169-311-1', '9788071693116'),
+    ('80 7169 311 1 (váz.)', '9788071693116'),
+    ('0-8044-2957-X', '9780804429573'),
+    ('0-8044-2957-x', '9780804429573'),
+    ('978-80-7080-123-4', '9788070801234'),
+    ('ISBN 80-7169-311-1', None),
+    ('80-7169-31', None),
+    (None, None),
+])
+def test_normalize_isbn(isbn, isbn13):
+    assert isbn_index.normalize_isbn(isbn) == isbn13
+
+
+def test_iter_aleph_sequential():
+    pairs = list(isbn_index.iter_aleph_sequential(io.StringIO(ALEPH_EXPORT)))
+
+    assert pairs == [('80-7169-311-1', '000012345'), ('978-80-7080-123-4 (brož.)', '000012346'),
+                     ('0-8044-2957-X', '000012346')]
+
+
+def test_iter_marc():
+    export = make_marc_record([(b'001', '12345'), (b'020', '  \x1fa80-7169-311-1\x1fqváz.'),
+                               (b'245', '10\x1faElektrochemie')]) + \
+        make_marc_record([(b'001', '000012346'), (b'020', '  \x1fa0-8044-2957-X'),
+                          (b'020', '  \x1fz978-80-7080-123-4')]) + \
+        make_marc_record([(b'020', '  \x1fa80-7169-311-1')])
+
+    pairs = list(isbn_index.iter_marc(io.BytesIO(export)))
+
+    # the invalid ISBN (z) and the record without a sysno are left out
+    assert pairs == [('80-7169-311-1', '000012345'), ('0-8044-2957-X', '000012346')]
+
+
+def test_build_index_keeps_lowest_sysno_of_repeated_isbn(tmp_path):
+    index_file = str(tmp_path / 'isbn.bin')
+
+    count = isbn_index.build_index([('80-7169-311-1', '000012399'), ('978-80-7169-311-6', '000012345'),
+                                    ('0-8044-2957-X', '000000001'), ('no isbn', '000000002')], index_file)
+
+    assert count == 2
+    assert isbn_index.lookup('80-7169-311-1', index_file=index_file) == '000012345'
+
+
+def test_search_first_last_hit_and_miss(tmp_path):
+    index_file = str(tmp_path / 'isbn.bin')
+    pairs = [('978-80-{:05d}-00-0'.format(number), '{:09d}'.format(number)) for number in range(100)]
+    keys = sorted(isbn_index.normalize_isbn(isbn) for isbn, sysno in pairs)
+    isbn_index.build_index(pairs, index_file)
+
+    index = isbn_index.open_index(index_file)
+    try:
+        assert index[1] == 100
+        assert isbn_index.search(index, keys[0]) == '000000000'
+        assert isbn_index.search(index, keys[-1]) == '000000099'
+        assert isbn_index.search(index, keys[42]) == '000000042'
+        assert isbn_index.search(index, '9780000000000') is None
+        assert isbn_index.search(index, '9799999999999') is None
+    finally:
+        index[0].close()
+
+    assert isbn_index.lookup('978-80-00042-00-0', index_file=index_file) == '000000042'
+    assert isbn_index.lookup('978-80-99999-00-0', index_file=index_file) is None
+
+
+def test_missing_index_falls_back_to_aleph(tmp_path, monkeypatch):
+    pytest.importorskip('xmltodict')
+    monkeypatch.setattr(config, 'isbn_index_file', str(tmp_path / 'missing.bin'), raising=False)
+    responses = {'aleph.find': '<find><set_number>000123</set_number><no_records>000000001</no_records></find>',
+                 'aleph.present': '<present><record><doc_number>000012345</doc_number><metadata><oai_marc/>'
+                                  '</metadata></record></present>'}
+    queries = []
+
+    def fetch_query(name, aleph_url, deadline=None):
+        queries.append(name)
+        return 200, responses[name]
+
+    monkeypatch.setattr(catalogue, 'fetch_query', fetch_query)
+
+    sysno, record_fields = workflow.get_document_record(str(tmp_path / 'DONE_20240101_8071693111'))
+
+    assert isbn_index.lookup('8071693111') is None
+    assert queries == ['aleph.find', 'aleph.present']
+    assert sysno == '000012345' and record_fields == {}
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from modules.job import DocumentJob
+
+
+def test_document_job_defaults():
+    job = DocumentJob('/input/DONE_20240101_8071693111')
+
+    assert job.path == '/input/DONE_20240101_8071693111'
+    assert job.sysno is None
+    assert job.error is None
+    assert job.timings == {}
+
+
+def test_document_job_has_no_instance_dict():
+    job = DocumentJob('/input/DONE_20240101_8071693111')
+
+    assert not hasattr(job, '__dict__')
+    with pytest.raises(AttributeError):
+        job.unknown_stage_result = 1
+
+
+def test_document_jobs_do_not_share_timings():
+    first = DocumentJob('first')
+    second = DocumentJob('second')
+    first.timings['resolve'] = 1.0
+
+    assert second.timings == {}
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import config
+from modules import keywords
+from modules import workflow
+
+SCORED = {'cs': {'elektrochemie': 0.9, 'roztoky': 0.15, 'vodivost': 0.6, 'polarizace': 0.6, 'články': 0.3},
+          'en': {'electrochemistry': 0.4, 'conductivity': 0.1}}
+
+
+def write_pages(tmp_path):
+    toc_files = []
+    for name in ('toc_001.xml', 'toc_002.xml'):
+        (tmp_path / name).write_text('<alto/>', encoding='utf-8')
+        toc_files.append(str(tmp_path / name))
+    return toc_files
+
+
+def test_select_keywords_applies_threshold_and_top_k():
+    selected = keywords.select_keywords(SCORED, threshold=0.2, max_words=3)
+
+    assert list(selected['cs'].items()) == [('elektrochemie', 0.9), ('vodivost', 0.6), ('polarizace', 0.6)]
+    assert selected['en'] == {'electrochemistry': 0.4}
+
+
+def test_stored_scores_are_reused_for_the_same_pages(tmp_path):
+    toc_files = write_pages(tmp_path)
+    keywords.save_scored_keywords(str(tmp_path), toc_files, SCORED)
+
+    assert keywords.load_scored_keywords(str(tmp_path), toc_files) == SCORED
+    assert keywords.load_scored_keywords(str(tmp_path), toc_files[:1]) is None
+
+
+def test_stored_scores_are_dropped_for_other_request(tmp_path, monkeypatch):
+    toc_files = write_pages(tmp_path)
+    keywords.save_scored_keywords(str(tmp_path), toc_files, SCORED)
+    monkeypatch.setattr(config, 'ker_request_max_words', config.ker_request_max_words + 1, raising=False)
+
+    assert keywords.load_scored_keywords(str(tmp_path), toc_files) is None
+
+
+def test_profile_rules_select_profile_by_directory(monkeypatch):
+    monkeypatch.setattr(config, 'keyword_profiles', {'default': {'threshold': 0.2, 'max_words': 15},
+                                                     'short': {'threshold': 0.5, 'max_words': 5}}, raising=False)
+    monkeypatch.setattr(config, 'keyword_profile_rules', [(r'_97880', 'short')], raising=False)
+
+    assert keywords.get_profile('/in/DONE_20240101_9788071693115')['max_words'] == 5
+    assert keywords.get_profile('/in/DONE_20240101_8071693111')['max_words'] == 15
+    assert keywords.get_profile('/in/DONE_20240101_9788071693115', name='default')['max_words'] == 15
+
+
+def test_extract_uses_stored_scores_without_ker(tmp_path, monkeypatch):
+    from modules.job import DocumentJob
+    toc_files = write_pages(tmp_path)
+    keywords.save_scored_keywords(str(tmp_path), toc_files, SCORED)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("KER must not be called")
+
+    monkeypatch.setattr(keywords, 'get_keywords', fail)
+    job = DocumentJob(str(tmp_path))
+    job.toc_xml_files = toc_files
+    workflow.extract_doc(job)
+
+    assert job.keywords == ['elektrochemie', 'vodivost', 'polarizace', 'články']
+    assert job.toc_location is None
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+import config
+from modules import keywords
+from modules import payload
+from modules import workflow
+from modules.job import DocumentJob
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(config, 'ker_budget_pages', 4, raising=False)
+    monkeypatch.setattr(config, 'ker_budget_bytes', 1000, raising=False)
+    monkeypatch.setattr(config, 'ker_budget_strategy', payload.SPLIT, raising=False)
+    # the pages are measured as XML files, see test_text_payload_is_measured_by_its_text
+    monkeypatch.setattr(config, 'ker_send_plain_text', False, raising=False)
+
+
+def write_pages(tmp_path, sizes):
+    toc_files = []
+    for number, size in enumerate(sizes, start=1):
+        toc_file = tmp_path / 'toc_{:03d}.xml'.format(number)
+        toc_file.write_bytes(b'x' * size)
+        toc_files.append(str(toc_file))
+    return toc_files
+
+
+def names(toc_files):
+    return [os.path.basename(toc_file) for toc_file in toc_files]
+
+
+def test_document_within_budget_is_sent_whole(tmp_path, budget):
+    toc_files = write_pages(tmp_path, [100] * 4)
+
+    assert payload.plan_payload(toc_files) == (payload.WHOLE, [toc_files])
+
+
+def test_subset_is_spread_over_the_whole_toc(tmp_path, budget):
+    toc_files = write_pages(tmp_path, [100] * 10)
+
+    strategy, chunks = payload.plan_payload(toc_files, strategy=payload.SUBSET)
+
+    assert strategy == payload.SUBSET
+    assert names(chunks[0]) == ['toc_001.xml', 'toc_004.xml', 'toc_007.xml', 'toc_010.xml']
+
+
+def test_subset_shrinks_to_the_byte_budget(tmp_path, budget):
+    toc_files = write_pages(tmp_path, [400] * 6)
+
+    assert names(payload.select_subset(toc_files)) == ['toc_001.xml', 'toc_006.xml']
+
+
+def test_split_respects_pages_and_bytes(tmp_path, budget):
+    toc_files = write_pages(tmp_path, [100, 100, 100, 100, 100, 700, 500, 1500, 100])
+
+    strategy, chunks = payload.plan_payload(toc_files)
+
+    assert strategy == payload.SPLIT
+    assert [names(chunk) for chunk in chunks] == [['toc_001.xml', 'toc_002.xml', 'toc_003.xml', 'toc_004.xml'],
+                                                  ['toc_005.xml', 'toc_006.xml'], ['toc_007.xml'], ['toc_008.xml'],
+                                                  ['toc_009.xml']]
+
+
+def test_text_payload_is_measured_by_its_text(tmp_path, budget, monkeypatch):
+    monkeypatch.setattr(config, 'ker_send_plain_text', True, raising=False)
+    # about 1500 bytes of XML with 17 bytes of text each
+    page = '<alto><Layout><Page><PrintSpace><TextBlock>{}<TextLine><String CONTENT="Elektrochemie"/><SP/>' \
+           '<String CONTENT="11"/></TextLine></TextBlock></PrintSpace></Page></Layout></alto>'.format(' ' * 1350)
+    toc_files = []
+    for number in range(1, 4):
+        toc_file = tmp_path / 'toc_{:03d}.xml'.format(number)
+        toc_file.write_text(page, encoding='utf-8')
+        toc_files.append(str(toc_file))
+
+    assert os.path.getsize(toc_files[0]) > config.ker_budget_bytes
+    assert payload.get_page_size(toc_files[0]) == len('Elektrochemie 11\n')
+    assert payload.plan_payload(toc_files) == (payload.WHOLE, [toc_files])
+
+
+def test_merge_keeps_highest_score():
+    merged = keywords.merge_scored_keywords([{'cs': {'elektrochemie': 0.5, 'vodivost': 0.4}},
+                                             {'cs': {'elektrochemie': 0.7, 'polarizace': 0.6}, 'en': {'cell': 0.3}}])
+
+    assert list(merged['cs'].items()) == [('elektrochemie', 0.7), ('polarizace', 0.6), ('vodivost', 0.4)]
+    assert merged['en'] == {'cell': 0.3}
+
+
+def test_extract_sends_chunks_and_merges_keywords(tmp_path, budget, monkeypatch):
+    toc_files = write_pages(tmp_path, [100] * 6)
+    requests = []
+
+    def preprocess_keywords(toc_xml_location, doc_path, deadline=None):
+        requests.append(os.path.basename(toc_xml_location))
+        return {'cs': {'kapitola {}'.format(len(requests)): 0.5}}
+
+    monkeypatch.setattr(config, 'ker_send_plain_text', False, raising=False)
+    # the archives are zipped in the calling thread
+    monkeypatch.setattr(config, 'cpu_workers', 0, raising=False)
+    monkeypatch.setattr(workflow, 'preprocess_keywords', preprocess_keywords)
+    job = DocumentJob(str(tmp_path))
+    job.toc_xml_files = toc_files
+    workflow.extract_doc(job)
+
+    assert job.ker_strategy == payload.SPLIT
+    assert sorted(requests) == ['tocs_{}_part1.zip'.format(tmp_path.name), 'tocs_{}_part2.zip'.format(tmp_path.name)]
+    assert sorted(job.keywords) == ['kapitola 1', 'kapitola 2']
+    assert keywords.load_scored_keywords(str(tmp_path), toc_files) is not None
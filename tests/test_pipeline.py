@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import pytest
+
+import config
+from modules import pipeline
+from modules.job import DocumentJob
+
+
+@pytest.fixture
+def queue_size(monkeypatch):
+    monkeypatch.setattr(config, 'pipeline_queue_size', 1, raising=False)
+    monkeypatch.setattr(config, 'trace_file', None, raising=False)
+
+
+def run_in_thread(jobs, stages):
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(pipeline.run_stages(jobs, stages)), daemon=True)
+    thread.start()
+    return thread, results
+
+
+def make_jobs(count, produced=None):
+    for number in range(count):
+        if produced is not None:
+            produced.append(number)
+        yield DocumentJob('DONE_2024010{}_8071693111'.format(number))
+
+
+def test_full_queue_stops_the_scan(queue_size):
+    release = threading.Event()
+    produced = []
+
+    def write_doc(job):
+        release.wait(5)
+
+    thread, results = run_in_thread(make_jobs(10, produced), [(write_doc, 1)])
+    time.sleep(0.3)
+
+    # one job in the blocked stage, one in its queue and one waiting to be put to the queue
+    assert len(produced) == 3
+    release.set()
+    thread.join(5)
+    assert len(results) == 10
+
+
+def test_end_marker_reaches_every_worker(queue_size):
+    def extract_doc(job):
+        time.sleep(0.001)
+
+    def write_doc(job):
+        job.sysno = '000012345'
+
+    thread, results = run_in_thread(make_jobs(20), [(extract_doc, 3), (write_doc, 2)])
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert len(results) == 20 and all(job.sysno == '000012345' for job in results)
+
+
+def test_failed_jobs_pass_the_stages_untouched(queue_size):
+    called = []
+
+    def resolve_doc(job):
+        called.append(job.path)
+
+    def write_doc(job):
+        raise ValueError("Cannot write")
+
+    failed = DocumentJob('DONE_20240101_8071693111')
+    failed.error = RuntimeError("Invalid document")
+    failed.failed_stage = 'validate'
+
+    results = list(pipeline.run_stages([failed, DocumentJob('DONE_20240102_8071693111')],
+                                       [(resolve_doc, 2), (write_doc, 1)]))
+
+    assert called == ['DONE_20240102_8071693111']
+    assert failed in results and failed.timings == {} and failed.failed_stage == 'validate'
+    other = [job for job in results if job is not failed][0]
+    assert other.failed_stage == 'write' and isinstance(other.error, ValueError)
+    assert sorted(other.timings) == ['resolve', 'write']
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import config
+from modules import quarantine
+from modules.errors import DocumentNotFound
+from modules.errors import DocumentTimeout
+from modules.errors import MissingTocFiles
+
+
+@pytest.fixture
+def doc_path(tmp_path):
+    path = tmp_path / 'DONE_20240101_8071693111'
+    path.mkdir()
+    return str(path)
+
+
+@pytest.mark.parametrize('error, failure_class', [
+    (DocumentNotFound("No document found"), 'not_found'),
+    (MissingTocFiles("No XML TOC files"), 'no_toc'),
+    (DocumentTimeout("Deadline exceeded"), 'timeout'),
+    (KeyError('keywords'), 'other'),
+])
+def test_classify_error(error, failure_class):
+    assert quarantine.classify_error(error) == failure_class
+
+
+def test_backoff_doubles_up_to_maximum(monkeypatch):
+    monkeypatch.setattr(config, 'quarantine_backoff', {'timeout': 60, 'other': 60})
+    monkeypatch.setattr(config, 'quarantine_max_backoff', 200)
+
+    assert [quarantine.get_backoff('timeout', attempts) for attempts in (1, 2, 3, 4)] == [60, 120, 200, 200]
+
+
+def test_transient_failure_is_quarantined_until_backoff_passes(doc_path, monkeypatch):
+    monkeypatch.setattr(config, 'quarantine_backoff', {'timeout': 60, 'other': 60})
+
+    quarantine.record_failure(doc_path, DocumentTimeout("Deadline exceeded"), now=1000)
+    failure = quarantine.record_failure(doc_path, DocumentTimeout("Deadline exceeded"), now=2000)
+
+    assert failure['attempts'] == 2
+    assert quarantine.get_attempts(doc_path) == 2
+    assert quarantine.is_quarantined(doc_path, now=2100)
+    assert not quarantine.is_quarantined(doc_path, now=2120)
+
+
+def test_permanent_failure_is_quarantined_until_released(doc_path, monkeypatch):
+    monkeypatch.setattr(config, 'quarantine_backoff', {'no_toc': None, 'other': 60})
+
+    failure = quarantine.record_failure(doc_path, MissingTocFiles("No XML TOC files"), now=1000)
+
+    assert failure['retry_after'] is None
+    assert quarantine.is_quarantined(doc_path, now=10 ** 10)
+    assert quarantine.clear_failure(doc_path)
+    assert not quarantine.is_quarantined(doc_path)
+    assert quarantine.get_attempts(doc_path) == 0
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Golden corpus of OCR TOC pages: each corpus/raw_toc/<name>.txt page has the expected get_toc_list output
+# in <name>.json. When a change of the TOC parser changes an output on purpose, regenerate the .json file.
+
+import glob
+import json
+import os
+
+import pytest
+
+from modules import raw_toc
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', 'raw_toc')
+PAGES = sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt')))
+
+
+def read_expected(page):
+    with open(os.path.splitext(page)[0] + '.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('page', PAGES, ids=[os.path.basename(page) for page in PAGES])
+def test_get_toc_list(page):
+    with open(page, encoding='utf-8') as f:
+        lines = f.readlines()
+
+    assert raw_toc.get_toc_list(lines) == read_expected(page)
+
+
+@pytest.mark.parametrize('page', PAGES, ids=[os.path.basename(page) for page in PAGES])
+def test_get_toc_list_from_open_file(page):
+    with open(page, encoding='utf-8') as f:
+        assert raw_toc.get_toc_list(f) == read_expected(page)
+
+
+def test_get_raw_toc_contents():
+    assert raw_toc.get_raw_toc_contents(PAGES) == [read_expected(page) for page in PAGES]
+
+
+def test_get_raw_toc_contents_without_pages():
+    with pytest.raises(RuntimeError):
+        raw_toc.get_raw_toc_contents([])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Property-based tests of the TOC line normalization functions.
+
+import re
+
+import pytest
+
+hypothesis = pytest.importorskip('hypothesis')
+from hypothesis import given
+from hypothesis import strategies as st
+
+from modules import raw_toc
+
+# TOC lines: letters, digits, OCR noise, dots, tabs and spaces
+toc_lines = st.text(alphabet=st.sampled_from(list('aZčŘ019 .\t-•»—|:()\n')), max_size=60)
+page_numbers = st.integers(min_value=0, max_value=9999).map(str)
+
+
+@given(toc_lines)
+def test_normalize_toc_string_output_characters(line):
+    normalized = raw_toc.normalize_toc_string(line)
+
+    assert '\t' not in normalized
+    assert '..' not in normalized
+    assert re.search(r'\s{2,}', normalized) is None
+    assert re.search(r'[^\s\w\-\.]', normalized) is None
+
+
+@given(toc_lines)
+def test_normalize_toc_string_does_not_add_words(line):
+    normalized = raw_toc.normalize_toc_string(line)
+
+    assert set(re.findall(r'\w', normalized)) <= set(re.findall(r'\w', line))
+
+
+@given(toc_lines)
+def test_strip_leading_chars_returns_suffix(line):
+    assert line.endswith(raw_toc.strip_leading_chars(line))
+
+
+@given(toc_lines.filter(lambda line: re.match(r'\W', line)))
+def test_strip_leading_chars_removes_leading_non_word_chars(line):
+    assert re.match(r'\W', raw_toc.strip_leading_chars(line)) is None
+
+
+@given(toc_lines)
+def test_strip_page_numbers_returns_prefix(line):
+    assert line.startswith(raw_toc.strip_page_numbers(line))
+
+
+@given(toc_lines.filter(lambda line: re.match(r'.*(\s+\d+)$', line) is None))
+def test_strip_page_numbers_keeps_lines_without_page_number(line):
+    assert raw_toc.strip_page_numbers(line) == line
+
+
+@given(st.text(alphabet=st.sampled_from(list('aZčŘ .-')), min_size=1, max_size=40).filter(
+    lambda title: re.search(r'[aZčŘ]$', title)), page_numbers)
+def test_strip_page_numbers_removes_page_number(title, page_number):
+    assert raw_toc.strip_page_numbers(title + ' ' + page_number) == title
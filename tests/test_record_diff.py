@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+import config
+from modules import catalogue
+from modules import isbn_index
+from modules import workflow
+from modules.job import DocumentJob
+
+PRESENT_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<present>
+<record>
+<doc_number>000012345</doc_number>
+<metadata>
+<oai_marc>
+<fixfield id="001">000012345</fixfield>
+<varfield id="245" i1="1" i2="0"><subfield label="a">Elektrochemie</subfield></varfield>
+<varfield id="505" i1="0" i2=" "><subfield label="a">Úvod -- Elektrochemie roztoků</subfield></varfield>
+<varfield id="653" i1=" " i2=" "><subfield label="a">elektrochemie</subfield><subfield label="a">roztoky</subfield></varfield>
+</oai_marc>
+</metadata>
+</record>
+</present>
+"""
+
+
+def test_parse_record_fields():
+    pytest.importorskip('xmltodict')
+
+    doc_numbers, fields = catalogue.parse_record_fields(PRESENT_RESPONSE, ['653', '505'])
+
+    assert doc_numbers == ['000012345']
+    assert sorted(fields) == ['505', '653']
+    assert catalogue.get_subfield_values(fields, '653', 'a') == ['elektrochemie', 'roztoky']
+    assert catalogue.get_subfield_values(fields, '505', 'a') == ['Úvod -- Elektrochemie roztoků']
+
+
+def make_job(tmp_path, keywords):
+    path = tmp_path / 'DONE_20240101_8071693111'
+    path.mkdir()
+    job = DocumentJob(str(path))
+    job.sysno = '000012345'
+    job.keywords = keywords
+    job.toc_lines = ['Úvod', 'Elektrochemie roztoků']
+    job.record_fields = {'653': [[('a', 'elektrochemie'), ('a', 'roztoky')]],
+                         '505': [[('a', 'Úvod -- Elektrochemie roztoků')]]}
+    return job
+
+
+def test_write_doc_skips_unchanged_record(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'aleph_skip_unchanged', True)
+    job = make_job(tmp_path, ['elektrochemie', 'roztoky'])
+
+    workflow.write_doc(job)
+
+    assert job.update_file is None
+    assert os.path.isfile(os.path.join(job.path, config.finished_state))
+
+
+def test_write_doc_writes_only_changed_fields(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'aleph_skip_unchanged', True)
+    job = make_job(tmp_path, ['elektrochemie', 'elektrody'])
+
+    workflow.write_doc(job)
+
+    with open(job.update_file) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 1
+    assert lines[0].startswith('000012345 653')
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.status_code = 200
+        self.text = text
+        self.content = text.encode('utf-8')
+
+
+def test_record_of_sysno_from_offline_index_is_compared(tmp_path, monkeypatch):
+    requests = pytest.importorskip('requests')
+    pytest.importorskip('xmltodict')
+    monkeypatch.setattr(config, 'aleph_skip_unchanged', True)
+    monkeypatch.setattr(config, 'isbn_index_file', str(tmp_path / 'isbn.bin'), raising=False)
+    isbn_index.build_index([('80-7169-311-1', '000012345')], config.isbn_index_file)
+    urls = []
+
+    def get(url, timeout=None):
+        urls.append(url)
+        return FakeResponse(PRESENT_RESPONSE.replace('present>', 'find-doc>'))
+
+    monkeypatch.setattr(requests, 'get', get)
+    job = make_job(tmp_path, ['elektrochemie', 'roztoky'])
+    job.sysno, job.record_fields, job.isbn = None, None, '8071693111'
+
+    workflow.resolve_doc(job)
+    workflow.write_doc(job)
+
+    assert len(urls) == 1 and 'op=find-doc&doc_num=000012345' in urls[0]
+    assert job.sysno == '000012345'
+    assert job.update_file is None
+    assert os.path.isfile(os.path.join(job.path, config.finished_state))
+
+
+def test_consecutive_runs_of_unchanged_document_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'aleph_skip_unchanged', True)
+    job = make_job(tmp_path, ['elektrochemie', 'elektrody'])
+    workflow.write_doc(job)
+    workflow.write_status_file(config.finished_state, job.path)
+
+    # the update file holds only the changed keywords, the TOC is compared with the whole record of the first run
+    for run in range(2):
+        job.update_file, job.record_fields = None, None
+        workflow.write_doc(job)
+
+        assert job.update_file is None
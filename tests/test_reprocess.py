@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+from datetime import date
+
+import pytest
+
+import config
+from modules import keywords
+from modules import pipeline
+from modules import reprocess
+from modules import workflow
+
+ALTO = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<alto xmlns="http://www.loc.gov/standards/alto/ns-v2#"><Layout><Page ID="p001"><PrintSpace>'
+        '<TextBlock ID="b1"><TextLine><String CONTENT="Elektrochemie"/><SP/><String CONTENT="roztoků"/><SP/>'
+        '<String CONTENT="11"/></TextLine></TextBlock></PrintSpace></Page></Layout></alto>')
+
+
+def make_doc(root, name, finished=True):
+    doc_path = root / name
+    doc_path.mkdir()
+    (doc_path / 'toc_001.xml').write_text(ALTO, encoding='utf-8')
+    (doc_path / 'toc_001.txt').write_text('Úvod 7\nElektrochemie roztoků 11\n', encoding='utf-8')
+    if finished:
+        (doc_path / config.finished_state).write_text('', encoding='utf-8')
+    return str(doc_path)
+
+
+@pytest.fixture
+def calls(tmp_path, monkeypatch):
+    for option, value in (('scheduler_cost_file', 'costs.json'), ('history_file', 'history.jsonl'),
+                          ('isbn_index_file', 'isbn.bin'), ('authority_index_file', 'authority.bin'),
+                          ('reprocess_dir', 'reprocess')):
+        monkeypatch.setattr(config, option, str(tmp_path / value), raising=False)
+    monkeypatch.setattr(config, 'cpu_workers', 0, raising=False)
+    monkeypatch.setattr(config, 'trace_file', None, raising=False)
+    calls = []
+
+    def get_document_record(doc_path, deadline=None):
+        calls.append('resolve')
+        return '000012345', None
+
+    def preprocess_keywords(toc_xml_location, doc_path, deadline=None):
+        calls.append('extract')
+        return {'cs': {'elektrochemie': 0.8, 'roztoky': 0.4}}
+
+    process_txt_toc = workflow.process_txt_toc
+
+    def count_normalize(toc_txt_files, path):
+        calls.append('normalize')
+        return process_txt_toc(toc_txt_files, path)
+
+    monkeypatch.setattr(workflow, 'get_document_record', get_document_record)
+    monkeypatch.setattr(workflow, 'preprocess_keywords', preprocess_keywords)
+    monkeypatch.setattr(workflow, 'process_txt_toc', count_normalize)
+    return calls
+
+
+def test_select_dirs_by_date_isbn_and_collection(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'collections', {'proceedings': r'_978-?80-?7080'}, raising=False)
+    old = make_doc(tmp_path, 'DONE_20230105_8071693111')
+    new = make_doc(tmp_path, 'DONE_20240310_978-80-7080-123-4')
+    make_doc(tmp_path, 'DONE_20240311_8071693111', finished=False)
+    root = str(tmp_path)
+
+    assert sorted(reprocess.select_dirs(root)) == [old, new]
+    assert list(reprocess.select_dirs(root, since=date(2024, 1, 1))) == [new]
+    assert list(reprocess.select_dirs(root, until=date(2023, 12, 31))) == [old]
+    # ISBN-13 of the ISBN-10 in the directory name
+    assert list(reprocess.select_dirs(root, isbns=['978-80-7169-311-6'])) == [old]
+    assert list(reprocess.select_dirs(root, collection='proceedings')) == [new]
+    with pytest.raises(ValueError):
+        list(reprocess.select_dirs(root, collection='theses'))
+
+
+def test_reprocess_reuses_cached_artifacts(tmp_path, calls, monkeypatch):
+    doc_path = make_doc(tmp_path, 'DONE_20240101_8071693111', finished=False)
+    pipeline.run([doc_path], upload=False)
+    (tmp_path / 'DONE_20240101_8071693111' / config.finished_state).write_text('', encoding='utf-8')
+    assert sorted(calls) == ['extract', 'normalize', 'resolve']
+    del calls[:]
+
+    counters, batch_file = reprocess.run([doc_path], upload=False)
+
+    assert calls == []
+    assert counters['unchanged'] == 1 and batch_file is None
+
+    # a new keyword selection changes the record without calling KER
+    monkeypatch.setattr(config, 'keyword_profiles', {'default': {'threshold': 0.5, 'max_words': 15}}, raising=False)
+    counters, batch_file = reprocess.run([doc_path], upload=False)
+
+    assert calls == []
+    assert counters['uploaded'] == 1
+    with open(batch_file) as f:
+        batch = f.read().splitlines()
+    assert batch[0] == '000012345 653   L $$aelektrochemie'
+    assert batch[1].startswith('000012345 5050  L $$a')
+    assert reprocess.get_pending_batches() == [batch_file]
+
+
+def test_reprocess_redoes_given_stages(tmp_path, calls):
+    doc_path = make_doc(tmp_path, 'DONE_20240101_8071693111', finished=False)
+    pipeline.run([doc_path], upload=False)
+    (tmp_path / 'DONE_20240101_8071693111' / config.finished_state).write_text('', encoding='utf-8')
+    del calls[:]
+
+    reprocess.run([doc_path], upload=False, redo=['extract'])
+
+    assert calls == ['extract']
+    with pytest.raises(ValueError):
+        reprocess.run([doc_path], upload=False, redo=['write'])
+
+
+def test_new_ker_model_invalidates_stored_scores(tmp_path, monkeypatch):
+    toc_file = tmp_path / 'toc_001.xml'
+    toc_file.write_text(ALTO, encoding='utf-8')
+    keywords.save_scored_keywords(str(tmp_path), [str(toc_file)], {'cs': {'elektrochemie': 0.8}})
+    monkeypatch.setattr(config, 'ker_model', 'ker-2', raising=False)
+
+    assert keywords.load_scored_keywords(str(tmp_path), [str(toc_file)]) is None
+
+
+def test_pending_batches_are_uploaded_once(tmp_path, monkeypatch):
+    pytest.importorskip('paramiko')
+    from modules import ssh
+    from tests.sftp_server import SFTPServerStandIn
+
+    monkeypatch.setattr(config, 'reprocess_dir', str(tmp_path / 'reprocess'), raising=False)
+    monkeypatch.setattr(config, 'update_dir_location', '/', raising=False)
+    remote = tmp_path / 'remote'
+    remote.mkdir()
+    sftp_server = SFTPServerStandIn(str(remote))
+    links = []
+
+    def create_ssh_client(server, user):
+        client, link = sftp_server.connect()
+        links.append(link)
+        return client
+
+    monkeypatch.setattr(ssh, 'create_ssh_client', create_ssh_client)
+    # a run which changes no record leaves no batch
+    upload_doc, close = reprocess.make_batch_stage(reprocess.get_batch_file(now=0))
+    close()
+    assert reprocess.get_pending_batches() == []
+
+    os.makedirs(config.reprocess_dir)
+    batch_file = reprocess.get_batch_file(now=0)
+    with open(batch_file, mode='w') as f:
+        f.write('000012345 653   L $$aelektrochemie\n')
+
+    try:
+        reprocess.upload_batches(reprocess.get_pending_batches())
+    finally:
+        for link in links:
+            link.close()
+        sftp_server.close()
+
+    assert os.listdir(str(remote)) == [os.path.basename(batch_file)]
+    assert reprocess.get_pending_batches() == []
+    assert os.path.isfile(batch_file + config.finished_state)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import config
+from modules import history
+from modules import pipeline
+from modules.errors import DocumentTimeout
+from modules.job import DocumentJob
+
+
+@pytest.fixture
+def costs(monkeypatch):
+    monkeypatch.setattr(config, 'trace_file', None, raising=False)
+    return {'unit_seconds': 10.0, 'samples': 0}
+
+
+def report(job, costs):
+    counters = {'processed': 0, 'failed': 0, 'uploaded': 0, 'unchanged': 0}
+    pipeline.report_job(job, counters, costs, history.new_run(), upload=False)
+
+
+def test_costs_are_updated_with_stage_times(tmp_path, costs):
+    job = DocumentJob(str(tmp_path))
+    job.pages = 1
+    job.started = 0.0
+    # resolve and extract ran inside gather, the queue waits are not counted
+    job.timings = {'validate': 0.5, 'dedupe': 0.5, 'gather': 2.0, 'resolve': 1.5, 'extract': 2.0, 'write': 1.0}
+    job.update_file = str(tmp_path / '000012345_update')
+
+    report(job, costs)
+
+    assert costs == {'unit_seconds': 2.0, 'samples': 1}
+
+
+def test_failed_documents_do_not_update_costs(tmp_path, costs):
+    job = DocumentJob(str(tmp_path))
+    job.started = 0.0
+    job.timings = {'validate': 0.01}
+    job.error = DocumentTimeout("KER did not respond in time")
+    job.failed_stage = 'extract'
+
+    report(job, costs)
+
+    assert costs == {'unit_seconds': 10.0, 'samples': 0}
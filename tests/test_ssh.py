@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+paramiko = pytest.importorskip('paramiko')
+
+from modules import ssh
+from tests.sftp_server import SFTPServerStandIn
+
+
+@pytest.fixture(scope='module')
+def sftp_server(tmp_path_factory):
+    server = SFTPServerStandIn(str(tmp_path_factory.mktemp('aleph_update_dir')))
+    yield server
+    server.close()
+
+
+@pytest.mark.parametrize('strategy', ['sequential', 'pipelined', 'multichannel'])
+def test_upload_files(sftp_server, tmp_path, strategy):
+    update_files = []
+    for i in range(7):
+        update_file = tmp_path / '{:09d}_update'.format(i)
+        update_file.write_bytes(os.urandom(100 + i * 1000))
+        update_files.append(str(update_file))
+    remote_dir = os.path.join(sftp_server.root, strategy)
+    os.mkdir(remote_dir)
+    client, link = sftp_server.connect()
+
+    try:
+        sent = ssh.upload_files(client, update_files, '/' + strategy, strategy=strategy, channels=3)
+    finally:
+        client.close()
+        link.close()
+
+    assert sent == sum(os.path.getsize(update_file) for update_file in update_files)
+    for update_file in update_files:
+        with open(update_file, mode='rb') as local, \
+                open(os.path.join(remote_dir, os.path.basename(update_file)), mode='rb') as remote:
+            assert local.read() == remote.read()
+
+
+@pytest.mark.parametrize('strategy, pipelined', [('sequential', False), ('pipelined', True), ('multichannel', True)])
+def test_only_sequential_upload_waits_for_each_write(sftp_server, tmp_path, monkeypatch, strategy, pipelined):
+    update_file = tmp_path / '000000001_update'
+    update_file.write_bytes(os.urandom(3 * ssh.SFTP_CHUNK_SIZE))
+    os.mkdir(os.path.join(sftp_server.root, 'writes_' + strategy))
+    set_pipelined = paramiko.SFTPFile.set_pipelined
+    modes = []
+
+    def record_mode(self, pipelined=True):
+        modes.append(pipelined)
+        set_pipelined(self, pipelined)
+
+    monkeypatch.setattr(paramiko.SFTPFile, 'set_pipelined', record_mode)
+    client, link = sftp_server.connect()
+
+    try:
+        ssh.upload_files(client, [str(update_file)], '/writes_' + strategy, strategy=strategy, channels=1)
+    finally:
+        client.close()
+        link.close()
+
+    assert modes == [pipelined]
+
+
+def test_upload_files_rejects_unknown_strategy(sftp_server):
+    with pytest.raises(ValueError):
+        ssh.upload_files(None, [], '/', strategy='parallel')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+import config
+from modules import raw_toc
+from modules import tracing
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'traces.jsonl')
+    monkeypatch.setattr(config, 'trace_file', path, raising=False)
+    return path
+
+
+def read_spans(path):
+    spans = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            for resource_spans in json.loads(line)['resourceSpans']:
+                for scope_spans in resource_spans['scopeSpans']:
+                    spans.extend(scope_spans['spans'])
+    return {span['name']: span for span in spans}
+
+
+def test_document_trace_is_exported_as_otlp_json(trace_file, tmp_path):
+    toc_file = tmp_path / 'toc_001.txt'
+    toc_file.write_text('Úvod 7\nElektrochemie 11\n', encoding='utf-8')
+
+    root = tracing.start_trace('document', {'document.name': 'DONE_20240101_8071693111'})
+    with tracing.span('normalize', parent=root):
+        raw_toc.get_page_toc_list(str(toc_file))
+    tracing.end_trace(root)
+
+    spans = read_spans(trace_file)
+    assert spans['normalize']['parentSpanId'] == spans['document']['spanId']
+    assert spans['raw_toc.read']['parentSpanId'] == spans['normalize']['spanId']
+    assert len(set(span['traceId'] for span in spans.values())) == 1
+    attributes = dict((a['key'], a['value']) for a in spans['raw_toc.read']['attributes'])
+    assert attributes['file.size'] == {'intValue': str(toc_file.stat().st_size)}
+    assert spans['document']['status'] == {'code': tracing.STATUS_OK}
+
+
+def test_error_is_recorded_in_span(trace_file):
+    root = tracing.start_trace('document')
+    with pytest.raises(ValueError):
+        with tracing.span('resolve', parent=root):
+            raise ValueError("Aleph server returned response 503")
+    tracing.end_trace(root, error=ValueError("failed"))
+
+    spans = read_spans(trace_file)
+    assert spans['resolve']['status'] == {'code': tracing.STATUS_ERROR,
+                                          'message': "Aleph server returned response 503"}
+    assert spans['document']['status']['code'] == tracing.STATUS_ERROR
+
+
+def test_worker_spans_join_the_caller_trace(trace_file, tmp_path):
+    toc_file = tmp_path / 'toc_001.txt'
+    toc_file.write_text('Úvod 7\n', encoding='utf-8')
+
+    root = tracing.start_trace('document')
+    with tracing.span('normalize', parent=root):
+        context = tracing.get_context()
+    # what a worker process runs for the caller
+    tracing.call_traced(context, raw_toc.get_page_toc_list, str(toc_file))
+    tracing.end_trace(root)
+
+    spans = read_spans(trace_file)
+    assert spans['raw_toc.read']['traceId'] == spans['document']['traceId']
+    assert spans['raw_toc.read']['parentSpanId'] == spans['normalize']['spanId']
+
+
+def test_nothing_is_traced_without_trace_file(monkeypatch):
+    monkeypatch.setattr(config, 'trace_file', None, raising=False)
+
+    assert tracing.start_trace('document') is None
+    with tracing.span('normalize') as span:
+        assert span is tracing.NULL_SPAN
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from modules import pipeline
+from modules import workflow
+from modules.errors import InvalidDocument
+from modules.job import DocumentJob
+
+
+def make_doc(tmp_path, name, files):
+    path = tmp_path / name
+    path.mkdir()
+    for filename in files:
+        (path / filename).write_text('')
+    return str(path)
+
+
+def test_inventory_toc_pages_sorts_by_type(tmp_path):
+    path = make_doc(tmp_path, 'DONE_20240101_8071693111',
+                    ['toc_002.xml', 'toc_001.xml', 'toc_001.txt', 'cover.xml', 'toc_001.jpg'])
+
+    toc_xml_files, toc_txt_files = workflow.inventory_toc_pages(path)
+
+    assert [name[len(path) + 1:] for name in toc_xml_files] == ['toc_001.xml', 'toc_002.xml']
+    assert [name[len(path) + 1:] for name in toc_txt_files] == ['toc_001.txt']
+
+
+def test_validate_doc_fills_in_job(tmp_path):
+    job = DocumentJob(make_doc(tmp_path, 'DONE_20240101_8071693111', ['toc_001.xml', 'toc_001.txt']))
+
+    workflow.validate_doc(job)
+
+    assert job.isbn == '8071693111'
+    assert job.pages == 1
+
+
+@pytest.mark.parametrize('name, files', [
+    ('DONE_20240101_notanisbn', ['toc_001.xml', 'toc_001.txt']),
+    ('DONE_20240101_8071693111', ['toc_001.txt']),
+])
+def test_validate_doc_rejects_invalid_documents(tmp_path, name, files):
+    with pytest.raises(InvalidDocument):
+        workflow.validate_doc(DocumentJob(make_doc(tmp_path, name, files)))
+
+
+def test_scan_docs_yields_rejected_documents_first(tmp_path):
+    valid = make_doc(tmp_path, 'DONE_20240101_8071693111', ['toc_001.xml', 'toc_001.txt'])
+    invalid = make_doc(tmp_path, 'DONE_20240102_9788071693115', [])
+    costs = {'unit_seconds': 1.0, 'samples': 0}
+
+    jobs = list(pipeline.scan_docs([valid, invalid], costs))
+
+    assert [job.path for job in jobs] == [invalid, valid]
+    assert jobs[0].failed_stage == 'validate'
+    assert jobs[1].error is None and 'validate' in jobs[1].timings